@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Single-pass evaluation of many LSH bandings of the same signatures.
+
+The thresholds and numbers of permutations of the build_hash_index sweep only
+change the (b, r) banding of the signature matrix: band j of a (b, r) index is
+the hash of the signature rows [j * r, (j + 1) * r). Bandings with the same r
+share their first bands, so each band is hashed and sorted once, for the
+largest b of its r, and its pairs are added to every configuration that
+includes it. The songs of a bucket are a run of equal keys in the sorted band,
+and the pairs of every run are expanded with NumPy, one offset at a time.
+
+The candidate pairs files are named and written as the ones of
+build_hash_index.dump_possible_duplicates, and the number of candidates,
+precision and recall of every configuration are appended to
+SWEEP_BENCHMARK_FILE. Every bucket is expanded, as with the keep policy of
+bucket_policy.
+"""
+
+import os
+import sys
+import time
+import shutil
+import numpy as np
+from build_hash_index import SHINGLE_SIZES, NUM_PERMUTATIONS, LSH_THRESHOLDS, PAIRS_EXTENSION
+from build_hash_index import get_signature_paths
+from batch_minhash import load_signature_file
+from candidate_pairs import CandidatePairWriter, DEFAULT_BUFFER_SIZE, iter_packed_pairs, count_common_pairs
+from find_duplicates import TRAIN_GT_FILE
+from lsh_store import get_lsh_parameters, compute_band_keys
+from song_keys import load_key_dictionary, load_ground_truth
+
+SWEEP_BENCHMARK_FILE = os.path.join('out', 'output_band_sweep.csv')
+## Number of bands hashed at once. Each one takes 8 bytes per song.
+BANDS_PER_BLOCK = 8
+## Smallest buffer of the candidate pairs writers, which share DEFAULT_BUFFER_SIZE.
+MIN_BUFFER_SIZE = 1 << 16
+
+
+def get_sweep_configurations(num_permutations, lsh_thresholds):
+    """
+    Returns the (num_perm, threshold, b, r) tuples of the indexes of a sweep,
+    with the bandings MinHashLSH picks.
+    """
+    configurations = []
+    for num_perm in num_permutations:
+        for threshold in lsh_thresholds:
+            b, r = get_lsh_parameters(threshold, num_perm)
+            configurations.append((num_perm, threshold, b, r))
+    return configurations
+
+
+def iter_run_pairs(sorted_keys, rows):
+    """
+    Expands the runs of equal keys of a sorted band into pairs.
+
+    Arguments:
+    sorted_keys -- The sorted keys of a band.
+    rows -- The signature row of each sorted key.
+
+    Returns:
+    A generator of (first_rows, second_rows) arrays, the pairs of rows at the
+    same offset within their run, one offset at a time. Each chunk has fewer
+    pairs than the band has songs.
+    """
+    sorted_keys = np.asarray(sorted_keys)
+    bounds = np.concatenate(([0], np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1,
+                             [len(sorted_keys)]))
+    ## Number of songs after each position in its run, itself included.
+    remaining = np.repeat(bounds[1:], np.diff(bounds)) - np.arange(len(sorted_keys))
+    positions = np.flatnonzero(remaining > 1)
+    offset = 1
+    while len(positions):
+        yield rows[positions], rows[positions + offset]
+        offset += 1
+        positions = positions[remaining[positions] > offset]
+
+
+def sweep_bandings(song_ids, signatures, bandings, writers):
+    """
+    Writes the candidate pairs of several bandings of a signature matrix.
+
+    Arguments:
+    song_ids -- The song id of each signature row.
+    signatures -- The (N, num_perm) signature matrix.
+    bandings -- A list of distinct (b, r) tuples, with b * r <= num_perm.
+    writers -- A CandidatePairWriter for each banding.
+    """
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    for r in sorted(set(r for _, r in bandings)):
+        band_writers = [(b, writer) for (b, banding_r), writer in zip(bandings, writers) if banding_r == r]
+        num_bands = max(b for b, _ in band_writers)
+        for first_band in range(0, num_bands, BANDS_PER_BLOCK):
+            block_size = min(BANDS_PER_BLOCK, num_bands - first_band)
+            band_keys = compute_band_keys(signatures, block_size, r, first_band)
+            for block_band in range(block_size):
+                band = first_band + block_band
+                rows = np.argsort(band_keys[block_band], kind='stable')
+                sorted_keys = band_keys[block_band][rows]
+                current_writers = [writer for b, writer in band_writers if b > band]
+                for first_rows, second_rows in iter_run_pairs(sorted_keys, rows):
+                    first_ids, second_ids = song_ids[first_rows], song_ids[second_rows]
+                    for writer in current_writers:
+                        writer.add_pairs(first_ids, second_ids)
+
+
+def run_sweep(shingle_size, num_permutations, lsh_thresholds, ground_truth=None):
+    """
+    Writes the candidate pairs of every index of a sweep of one shingle size
+    from its signature file, and appends their metrics to
+    SWEEP_BENCHMARK_FILE.
+
+    Arguments:
+    shingle_size -- The shingle size of the signature file, see
+    build_hash_index.build_signatures.
+    num_permutations -- The numbers of permutations of the sweep.
+    lsh_thresholds -- The thresholds of the sweep.
+    ground_truth -- A sorted array of packed pairs, see
+    song_keys.load_ground_truth. If None, the precision and recall are not
+    computed.
+
+    Returns:
+    A list with the (num_perm, threshold, b, r, pairs_path) of each index.
+    """
+    configurations = get_sweep_configurations(num_permutations, lsh_thresholds)
+    if max(b * r for _, _, b, r in configurations) > max(num_permutations):
+        raise ValueError('Invalid sweep. Bandings must fit in the signatures.')
+
+    signature_path, keys_path = get_signature_paths(shingle_size)
+    song_ids, signatures = load_signature_file(signature_path, keys_path, num_perm=max(num_permutations))
+    id_to_key, _ = load_key_dictionary()
+
+    ## Indexes with the same banding have the same candidates, they are
+    ## computed once and copied.
+    bandings = sorted(set((b, r) for _, _, b, r in configurations))
+    pairs_paths = ['b-{}_r-{}_shinglesize-{}_numperp-{}_thresh-{}{}'.format(b, r, shingle_size, num_perm,
+                                                                           threshold, PAIRS_EXTENSION)
+                   for num_perm, threshold, b, r in configurations]
+    banding_paths = [pairs_paths[[(b, r) for _, _, b, r in configurations].index(banding)]
+                     for banding in bandings]
+    buffer_size = max(DEFAULT_BUFFER_SIZE // len(bandings), MIN_BUFFER_SIZE)
+    writers = [CandidatePairWriter(path, len(id_to_key), buffer_size=buffer_size) for path in banding_paths]
+
+    start_time = time.time()
+    sweep_bandings(song_ids, signatures, bandings, writers)
+    num_candidates = dict((banding, writer.close()) for banding, writer in zip(bandings, writers))
+    sweep_time = time.time() - start_time
+    print('Shingle size {}: {} indexes, {} bandings, swept in {:.1f}s.'.format(shingle_size, len(configurations),
+                                                                              len(bandings), sweep_time))
+
+    write_header = not os.path.exists(SWEEP_BENCHMARK_FILE)
+    with open(SWEEP_BENCHMARK_FILE, 'a') as sweep_out:
+        if write_header:
+            print('Shingle.Size, Num.Hashes, Threshold, Num.Bands, Rows.Per.Band, Num.Candidates, Precision, Recall, '
+                  'Sweep.Seconds', file=sweep_out)
+        for (num_perm, threshold, b, r), pairs_path in zip(configurations, pairs_paths):
+            banding_path = banding_paths[bandings.index((b, r))]
+            if pairs_path != banding_path:
+                shutil.copyfile(banding_path, pairs_path)
+
+            precision, recall = '', ''
+            if ground_truth is not None and len(ground_truth):
+                num_actual_matches = count_common_pairs(iter_packed_pairs(pairs_path), ground_truth)
+                precision = num_actual_matches / num_candidates[(b, r)] if num_candidates[(b, r)] else 0.0
+                recall = num_actual_matches / len(ground_truth)
+                print('(shingle_size = {}, num_hashes = {}, threshold = {}, b = {}, r = {}) => P = {}; R = {}'.format(
+                    shingle_size, num_perm, threshold, b, r, precision, recall))
+            print('{}, {}, {}, {}, {}, {}, {}, {}, {:.3f}'.format(shingle_size, num_perm, threshold, b, r,
+                                                                  num_candidates[(b, r)], precision, recall,
+                                                                  sweep_time),
+                  file=sweep_out)
+
+    return [configuration + (pairs_path,) for configuration, pairs_path in zip(configurations, pairs_paths)]
+
+
+def main():
+    shingle_sizes = [int(s) for s in sys.argv[1:]] or SHINGLE_SIZES
+    _, key_to_id = load_key_dictionary()
+    ground_truth = load_ground_truth(TRAIN_GT_FILE, key_to_id, mmap_mode='r') if os.path.exists(TRAIN_GT_FILE) \
+        else None
+
+    for shingle_size in shingle_sizes:
+        run_sweep(shingle_size, NUM_PERMUTATIONS, LSH_THRESHOLDS, ground_truth)
+
+
+if __name__ == '__main__':
+    main()
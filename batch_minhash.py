@@ -0,0 +1,498 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Batch MinHash signature engine.
+
+Instead of feeding each shingle to datasketch.MinHash.update, this module hashes
+all the shingles of a chunk of songs in bulk and applies every permutation
+function at once with NumPy array operations. The resulting signatures are
+bit-for-bit identical to the ones built by build_hash_index.build_minhash, so
+they can be loaded into a MinHashLSH index or compared against MinHash objects
+built the old way.
+"""
+
+import pickle
+import hashlib
+import numpy as np
+from datasketch import MinHash
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+DEFAULT_SEED = 1
+## Number of (shingle, permutation) cells evaluated at once. Each cell takes
+## 8 bytes, small batches keep the temporaries in the CPU cache.
+MAX_BATCH_CELLS = 1 << 16
+DEFAULT_CHUNK_SIZE = 10000
+## Odd multiplier of the polynomial n-gram hash, computed modulo 2^64.
+NGRAM_HASH_BASE = np.uint64(0x100000001b3)
+## Permutation parameters by (num_perm, seed), generating them takes longer
+## than hashing a song.
+_PERMUTATIONS = {}
+
+
+def get_permutations(num_perm, seed=DEFAULT_SEED):
+    """
+    Returns the permutation parameters used by datasketch for the given number
+    of permutations and seed.
+
+    Arguments:
+    num_perm -- The number of permutation functions.
+    seed -- The seed used to generate the permutation functions.
+
+    Returns:
+    Two read-only arrays of np.uint64 with num_perm elements each, the "a" and
+    "b" parameters of the permutation functions.
+    """
+    if num_perm <= 0:
+        raise ValueError('Invalid number of permutations. Must be larger than 0.')
+
+    if (num_perm, seed) not in _PERMUTATIONS:
+        a, b = MinHash(num_perm=num_perm, seed=seed).permutations
+        a.flags.writeable = False
+        b.flags.writeable = False
+        _PERMUTATIONS[(num_perm, seed)] = (a, b)
+    return _PERMUTATIONS[(num_perm, seed)]
+
+
+def mod_mersenne(values):
+    """
+    Computes values % MERSENNE_PRIME with shifts and masks, which is much
+    cheaper than the integer division done by the % operator.
+
+    Arguments:
+    values -- An array of np.uint64.
+
+    Returns:
+    A new array with the remainders.
+    """
+    remainder = values & MERSENNE_PRIME
+    remainder += values >> np.uint64(61)
+    np.subtract(remainder, MERSENNE_PRIME, out=remainder, where=remainder >= MERSENNE_PRIME)
+    return remainder
+
+
+def hash_shingles(shingle_list):
+    """
+    Hashes a list of shingles with the same 32-bit SHA1 hash used by
+    datasketch.MinHash.
+
+    Arguments:
+    shingle_list -- A list containing the n-grams(shingles).
+
+    Returns:
+    An array of np.uint64 with the hash of each shingle. Shingles that can not
+    be encoded to UTF-8 are skipped, as in build_hash_index.build_minhash.
+    """
+    sha1 = hashlib.sha1
+    from_bytes = int.from_bytes
+    hashes = []
+    for shingle in shingle_list:
+        try:
+            hashes.append(from_bytes(sha1(shingle.encode('utf8')).digest()[:4], 'little'))
+        except UnicodeEncodeError:
+            continue
+    return np.array(hashes, dtype=np.uint64)
+
+
+def _mix64(values):
+    """
+    SplitMix64 finalizer. Spreads the bits of 64-bit hash values, so that the
+    32-bit fold done before the permutations keeps all of their entropy.
+    """
+    values = values ^ (values >> np.uint64(30))
+    values *= np.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94d049bb133111eb)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def tokenize(input_str, token_table):
+    """
+    Splits a text into tokens and maps each token to a 64-bit hash. The hash of
+    each distinct token is computed once and cached in token_table, so a corpus
+    only hashes each word of its vocabulary once.
+
+    Arguments:
+    input_str -- The input text as a single string.
+    token_table -- A dictionary mapping tokens to their hashes. It is updated
+    with the tokens of input_str.
+
+    Returns:
+    An array of np.uint64 with the hash of each token of the text.
+    """
+    token_hashes = []
+    for token in input_str.split():
+        token_hash = token_table.get(token)
+        if token_hash is None:
+            digest = hashlib.blake2b(token.encode('utf8', 'surrogatepass'), digest_size=8).digest()
+            token_hash = int.from_bytes(digest, 'little')
+            token_table[token] = token_hash
+        token_hashes.append(token_hash)
+    return np.array(token_hashes, dtype=np.uint64)
+
+
+def build_shingle_hashes(token_hashes, ngram_sizes):
+    """
+    Integer version of build_hash_index.build_shingle_list. Computes the 64-bit
+    hashes of the n-grams of a tokenized text with a polynomial hash over the
+    token hashes, without building any string. All the n-gram sizes are
+    computed in a single pass, each size extending the hashes of the previous
+    one.
+
+    Arguments:
+    token_hashes -- The token hashes returned by tokenize.
+    ngram_sizes -- A list of n-gram sizes, all greater than 0.
+
+    Returns:
+    A dictionary mapping each n-gram size to a sorted array of np.uint64 with
+    the distinct hashes of the n-grams of that size. If a size is larger than the number of
+    tokens, the whole text is a single n-gram, as in build_shingle_list.
+    """
+    if min(ngram_sizes) <= 0:
+        raise ValueError('Invalid n-gram size. Must be greater than 0.')
+
+    num_tokens = len(token_hashes)
+    shingle_hashes = {}
+    if num_tokens == 0:
+        for ngram_size in ngram_sizes:
+            shingle_hashes[ngram_size] = np.empty(0, dtype=np.uint64)
+        return shingle_hashes
+
+    ## ngram_hashes[i] is the hash of the n-gram of the current size starting
+    ## at token i.
+    ngram_hashes = token_hashes.copy()
+    curr_size = 1
+    for ngram_size in sorted(ngram_sizes):
+        last_size = min(ngram_size, num_tokens)
+        while curr_size < last_size:
+            ngram_hashes = ngram_hashes[:-1] * NGRAM_HASH_BASE
+            ngram_hashes += token_hashes[curr_size:]
+            curr_size += 1
+        ## Repeated n-grams (e.g. a chorus) do not change the MinHash.
+        shingle_hashes[ngram_size] = np.unique(_mix64(ngram_hashes))
+
+    return shingle_hashes
+
+
+def build_lyrics_hashes(lyrics, shingle_size, token_shingles=False):
+    """
+    Returns the sorted distinct hashes of the shingles of a lyric, hashed the
+    same way as its signature.
+
+    Arguments:
+    lyrics -- The text of the lyric.
+    shingle_size -- The size of the n-grams.
+    token_shingles -- If True, the n-grams are hashed from token hashes as in
+    iter_token_signature_chunks, otherwise as strings as in
+    iter_signature_chunks.
+
+    Returns:
+    An np.uint64 array, empty if the lyric has no shingles.
+    """
+    ## Imported here to avoid a circular import, build_hash_index uses this module.
+    from build_hash_index import build_shingle_list
+
+    if lyrics is None or len(lyrics.split()) == 0:
+        return np.empty(0, dtype=np.uint64)
+    if token_shingles:
+        return build_shingle_hashes(tokenize(lyrics, {}), [shingle_size])[shingle_size]
+    return np.unique(hash_shingles(build_shingle_list(lyrics, ngram_size=shingle_size)))
+
+
+def get_jaccard(hashes_a, hashes_b):
+    """
+    Returns the Jaccard similarity of two sorted arrays of distinct hashes.
+    """
+    if len(hashes_a) == 0 or len(hashes_b) == 0:
+        return 0.0
+    num_common = len(np.intersect1d(hashes_a, hashes_b, assume_unique=True))
+    return num_common / float(len(hashes_a) + len(hashes_b) - num_common)
+
+
+def build_signature_matrix(hash_arrays, num_perm=128, seed=DEFAULT_SEED):
+    """
+    Builds the MinHash signatures of a list of songs given the hashes of their
+    shingles.
+
+    Arguments:
+    hash_arrays -- A list of np.uint64 arrays, one per song, with the hashes of
+    the song's shingles. 64-bit hashes are folded to 32 bits first, 32-bit
+    hashes are used as they are.
+    num_perm -- The number of permutation functions.
+    seed -- The seed used to generate the permutation functions.
+
+    Returns:
+    A (len(hash_arrays), num_perm) np.uint64 matrix. Row i holds the hash values
+    of the MinHash of song i. Songs without shingles get the hash values of an
+    empty MinHash.
+    """
+    a, b = get_permutations(num_perm, seed)
+    num_songs = len(hash_arrays)
+    signatures = np.full((num_songs, num_perm), MAX_HASH, dtype=np.uint64)
+    if num_songs == 0:
+        return signatures
+
+    lengths = np.fromiter((len(h) for h in hash_arrays), dtype=np.int64, count=num_songs)
+    cells_per_song = np.cumsum(lengths) * num_perm
+
+    start = 0
+    while start < num_songs:
+        ## Largest batch of songs that fits in MAX_BATCH_CELLS, at least one.
+        done_cells = cells_per_song[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(cells_per_song, done_cells + MAX_BATCH_CELLS, side='right'))
+        end = max(end, start + 1)
+
+        batch_lengths = lengths[start:end]
+        nonempty = batch_lengths > 0
+        if np.any(nonempty):
+            values = np.concatenate(hash_arrays[start:end]).astype(np.uint64, copy=False)
+            values = (values ^ (values >> np.uint64(32))) & MAX_HASH
+            phv = values[:, np.newaxis] * a
+            phv += b
+            phv = mod_mersenne(phv)
+            phv &= MAX_HASH
+            offsets = np.concatenate(([0], np.cumsum(batch_lengths)[:-1]))
+            signatures[start:end][nonempty] = np.minimum.reduceat(phv, offsets[nonempty], axis=0)
+        start = end
+
+    return signatures
+
+
+def build_minhash_matrix(shingle_lists, num_perm=128, seed=DEFAULT_SEED):
+    """
+    Batch version of build_hash_index.build_minhash.
+
+    Arguments:
+    shingle_lists -- A list of lists of shingles, one list per song.
+    num_perm -- The number of permutation functions.
+    seed -- The seed used to generate the permutation functions.
+
+    Returns:
+    A (len(shingle_lists), num_perm) np.uint64 signature matrix.
+    """
+    return build_signature_matrix([hash_shingles(s) for s in shingle_lists],
+                                  num_perm=num_perm, seed=seed)
+
+
+def iter_signature_chunks(dataset_items, shingle_size, num_perm=128,
+                          seed=DEFAULT_SEED, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Computes the signatures of a corpus chunk by chunk.
+
+    Arguments:
+    dataset_items -- An iterable of (key, lyrics) tuples, e.g. dataset.items().
+    shingle_size -- The size of the n-grams.
+    num_perm -- The number of permutation functions.
+    seed -- The seed used to generate the permutation functions.
+    chunk_size -- The number of songs processed at once.
+
+    Returns:
+    A generator of (keys, signatures) tuples, where keys is a list of song keys
+    and signatures is the corresponding signature matrix. Songs with empty
+    lyrics are skipped.
+    """
+    ## Imported here to avoid a circular import, build_hash_index uses this module.
+    from build_hash_index import build_shingle_list
+
+    keys = []
+    hash_arrays = []
+    for key, lyrics in dataset_items:
+        if len(lyrics) == 0:
+            continue
+
+        shingle_list = build_shingle_list(lyrics, ngram_size=shingle_size)
+        if len(shingle_list) == 0:
+            continue
+
+        keys.append(key)
+        hash_arrays.append(hash_shingles(shingle_list))
+        if len(keys) == chunk_size:
+            yield keys, build_signature_matrix(hash_arrays, num_perm=num_perm, seed=seed)
+            keys = []
+            hash_arrays = []
+
+    if keys:
+        yield keys, build_signature_matrix(hash_arrays, num_perm=num_perm, seed=seed)
+
+
+def iter_token_signature_chunks(dataset_items, shingle_sizes, num_perm=128,
+                                seed=DEFAULT_SEED, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Same as iter_signature_chunks, but the shingles are hashed with tokenize
+    and build_shingle_hashes, and the signatures of several shingle sizes are
+    computed from a single tokenization of each song.
+
+    Arguments:
+    dataset_items -- An iterable of (key, lyrics) tuples, e.g. dataset.items().
+    shingle_sizes -- A list of n-gram sizes.
+    num_perm -- The number of permutation functions.
+    seed -- The seed used to generate the permutation functions.
+    chunk_size -- The number of songs processed at once.
+
+    Returns:
+    A generator of (keys, signatures_list) tuples, where signatures_list has
+    one signature matrix per shingle size, in the order of shingle_sizes. Songs
+    without tokens are skipped.
+    """
+    token_table = {}
+    keys = []
+    hash_arrays = [[] for _ in shingle_sizes]
+    for key, lyrics in dataset_items:
+        token_hashes = tokenize(lyrics, token_table)
+        if len(token_hashes) == 0:
+            continue
+
+        shingle_hashes = build_shingle_hashes(token_hashes, shingle_sizes)
+        keys.append(key)
+        for size_hash_arrays, shingle_size in zip(hash_arrays, shingle_sizes):
+            size_hash_arrays.append(shingle_hashes[shingle_size])
+
+        if len(keys) == chunk_size:
+            yield keys, [build_signature_matrix(h, num_perm=num_perm, seed=seed) for h in hash_arrays]
+            keys = []
+            hash_arrays = [[] for _ in shingle_sizes]
+
+    if keys:
+        yield keys, [build_signature_matrix(h, num_perm=num_perm, seed=seed) for h in hash_arrays]
+
+
+def build_corpus_signatures(dataset_items, shingle_size, num_perm=128,
+                            seed=DEFAULT_SEED, chunk_size=DEFAULT_CHUNK_SIZE,
+                            token_shingles=False):
+    """
+    Computes the signatures of a whole corpus.
+
+    Arguments:
+    dataset_items -- An iterable of (key, lyrics) tuples, e.g. dataset.items().
+    shingle_size -- The size of the n-grams.
+    num_perm -- The number of permutation functions.
+    seed -- The seed used to generate the permutation functions.
+    chunk_size -- The number of songs processed at once.
+    token_shingles -- If True, the n-grams are hashed from token hashes as in
+    iter_token_signature_chunks, otherwise as strings as in
+    iter_signature_chunks.
+
+    Returns:
+    A list of song keys and the (len(keys), num_perm) np.uint64 signature
+    matrix, in the same order.
+    """
+    if token_shingles:
+        signature_chunks = ((keys, signatures_list[0]) for keys, signatures_list in
+                            iter_token_signature_chunks(dataset_items, [shingle_size],
+                                                        num_perm=num_perm, seed=seed,
+                                                        chunk_size=chunk_size))
+    else:
+        signature_chunks = iter_signature_chunks(dataset_items, shingle_size, num_perm=num_perm,
+                                                 seed=seed, chunk_size=chunk_size)
+
+    all_keys = []
+    all_signatures = []
+    for keys, signatures in signature_chunks:
+        all_keys.extend(keys)
+        all_signatures.append(signatures)
+
+    if not all_signatures:
+        return all_keys, np.empty((0, num_perm), dtype=np.uint64)
+    return all_keys, np.concatenate(all_signatures)
+
+
+def insert_signatures(lsh_index, keys, signatures, seed=DEFAULT_SEED):
+    """
+    Inserts the rows of a signature matrix into a MinHashLSH index.
+
+    Arguments:
+    lsh_index -- The datasketch.MinHashLSH index.
+    keys -- The list of song keys, one per row of signatures.
+    signatures -- The signature matrix. Its number of columns must match the
+    number of permutations of the index.
+    seed -- The seed used to generate the signatures.
+    """
+    if len(keys) != len(signatures):
+        raise ValueError('Number of keys and signatures mismatch.')
+
+    ## Passing the permutations avoids generating them again for every MinHash.
+    permutations = get_permutations(signatures.shape[1], seed)
+    for key, hashvalues in zip(keys, signatures):
+        try:
+            mhash = MinHash(seed=seed, hashvalues=hashvalues, permutations=permutations)
+            lsh_index.insert(key, mhash)
+        except ValueError:
+            ## This error occurs if there is a song with the same name in the hash.
+            print('Repeated Key = {}'.format(key))
+
+
+def write_signature_files(signature_paths, keys_paths, signature_chunks,
+                          num_songs, num_perm=128):
+    """
+    Writes the signatures of a corpus to memory-mapped .npy files, chunk by
+    chunk, so the whole matrices never have to fit in memory.
+
+    Since datasketch draws the permutation parameters one permutation at a
+    time, the first k columns of a signature built with num_perm permutations
+    are the signature built with k permutations. A file written with the
+    largest num_perm of a sweep serves every smaller num_perm as a prefix.
+
+    Arguments:
+    signature_paths -- The paths of the .npy files to write, one per signature
+    matrix yielded by signature_chunks.
+    keys_paths -- The paths of the pickle files that will store the song keys,
+    one per signature file.
+    signature_chunks -- An iterable of (keys, signatures_list) tuples, e.g.
+    from iter_token_signature_chunks.
+    num_songs -- An upper bound of the number of songs, used to size the files.
+    num_perm -- The number of permutation functions.
+
+    Returns:
+    The number of signatures written to each file. Songs with empty lyrics are
+    skipped, so this may be smaller than num_songs.
+    """
+    if num_songs <= 0:
+        raise ValueError('Invalid number of songs. Must be larger than 0.')
+    if len(signature_paths) != len(keys_paths):
+        raise ValueError('Number of signature and keys paths mismatch.')
+
+    signature_files = [np.lib.format.open_memmap(path, mode='w+', dtype=np.uint64,
+                                                 shape=(num_songs, num_perm))
+                       for path in signature_paths]
+    all_keys = []
+    for keys, signatures_list in signature_chunks:
+        for signature_file, signatures in zip(signature_files, signatures_list):
+            signature_file[len(all_keys):len(all_keys) + len(keys)] = signatures
+        all_keys.extend(keys)
+
+    for signature_file in signature_files:
+        signature_file.flush()
+    del signature_files
+
+    for keys_path in keys_paths:
+        with open(keys_path, 'wb') as keys_out:
+            pickle.dump(all_keys, keys_out)
+
+    return len(all_keys)
+
+
+def load_signature_file(signature_path, keys_path, num_perm=None):
+    """
+    Opens a signature file written by write_signature_files.
+
+    Arguments:
+    signature_path -- The path of the .npy signature file.
+    keys_path -- The path of the pickle file with the song keys.
+    num_perm -- If given, only the first num_perm columns are returned.
+
+    Returns:
+    The list of song keys and a read-only memory-mapped view of their
+    signatures. The pages of the file are shared by every process that opens it.
+    """
+    with open(keys_path, 'rb') as keys_in:
+        keys = pickle.load(keys_in)
+
+    signatures = np.load(signature_path, mmap_mode='r')
+    if num_perm is not None:
+        if num_perm > signatures.shape[1]:
+            raise ValueError('Signature file has only {} permutations.'.format(signatures.shape[1]))
+        signatures = signatures[:, :num_perm]
+
+    return keys, signatures[:len(keys)]
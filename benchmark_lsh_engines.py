@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the LSH engines of lsh_forest on the training dataset.
+
+Builds an index of the signature file of a shingle size for every engine,
+threshold and number of permutations, and measures its build time, memory,
+number of tables, number of candidate pairs, precision and recall. The memory
+is the peak traced by tracemalloc during a second build, so the build time is
+not slowed down by the tracing. The results are appended to
+ENGINE_BENCHMARK_FILE.
+
+The forests are built with each number of trees of FOREST_TREES and each
+maximum bucket size of FOREST_MAX_BUCKET_SIZES. The index with the fewest
+candidates of MinHashLSH, and of the forests of each number of trees, that
+reaches the target recall is compared with the MinHashLSH one, its
+tables, memory and candidates as a multiple of theirs, and appended to
+ENGINE_COMPARISON_FILE.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from build_hash_index import NUM_PERMUTATIONS, LSH_THRESHOLDS
+from build_hash_index import get_signature_paths, get_possible_duplicates
+from batch_minhash import load_signature_file
+from candidate_pairs import pack_bucket_pairs, count_common_pairs
+from find_duplicates import TRAIN_GT_FILE
+from lsh_forest import build_lsh_index, ENGINE_MINHASH, ENGINE_FOREST
+from song_keys import load_key_dictionary, load_ground_truth
+
+ENGINE_BENCHMARK_FILE = os.path.join('out', 'output_engine_benchmarks.csv')
+ENGINE_COMPARISON_FILE = os.path.join('out', 'output_engine_comparison.csv')
+## The high-recall settings of train_lsh_parameters.csv use lower thresholds.
+BENCHMARK_THRESHOLDS = [0.001, 0.01] + LSH_THRESHOLDS
+FOREST_TREES = [8, 16, 32, 64, 128]
+FOREST_MAX_BUCKET_SIZES = [8, 32, 128]
+TARGET_RECALL = 0.95
+
+
+def usage():
+    print('./{} shingle_size [target_recall]'.format(sys.argv[0]))
+
+
+def get_configurations(num_permutations, thresholds):
+    """
+    Returns the (engine, threshold, num_perm, num_trees, max_bucket_size)
+    tuples of the benchmark, num_trees and max_bucket_size being 0 for
+    MinHashLSH.
+    """
+    configurations = []
+    for num_perm in num_permutations:
+        for threshold in thresholds:
+            configurations.append((ENGINE_MINHASH, threshold, num_perm, 0, 0))
+            for num_trees in FOREST_TREES:
+                if num_trees > num_perm:
+                    continue
+                for max_bucket_size in FOREST_MAX_BUCKET_SIZES:
+                    configurations.append((ENGINE_FOREST, threshold, num_perm, num_trees, max_bucket_size))
+    return configurations
+
+
+def benchmark(engine, threshold, num_perm, num_trees, max_bucket_size, song_ids, signatures, ground_truth):
+    """
+    Builds one index and measures it.
+
+    Returns:
+    A dictionary with the measures.
+    """
+    start_time = time.perf_counter()
+    lsh = build_lsh_index(engine, threshold, num_perm, song_ids, signatures, num_trees, max_bucket_size)
+    build_time = time.perf_counter() - start_time
+    ## The trees of a forest are its bands, its buckets start with min_depth
+    ## rows.
+    b, r = lsh.b, getattr(lsh, 'min_depth', lsh.r)
+
+    start_time = time.perf_counter()
+    lsh_pairs = pack_bucket_pairs(get_possible_duplicates(lsh))
+    pairs_time = time.perf_counter() - start_time
+    num_actual_matches = count_common_pairs(lsh_pairs, ground_truth)
+    del lsh
+
+    tracemalloc.start()
+    lsh = build_lsh_index(engine, threshold, num_perm, song_ids, signatures, num_trees, max_bucket_size)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del lsh
+
+    return {'b': b,
+            'r': r,
+            'num_tables': b,
+            'build_time': build_time,
+            'pairs_time': pairs_time,
+            'memory_mb': peak_memory / float(1 << 20),
+            'candidates': len(lsh_pairs),
+            'precision': num_actual_matches / len(lsh_pairs) if len(lsh_pairs) else 0.0,
+            'recall': num_actual_matches / len(ground_truth)}
+
+
+def compare_at_recall(results, target_recall):
+    """
+    Picks the index with the fewest candidates of MinHashLSH, and of the
+    forests of each number of trees, among the ones that reach a target
+    recall.
+
+    Returns:
+    A list of the picked results, MinHashLSH first, with the ratios of their
+    tables, memory and candidates to the MinHashLSH one, None if no MinHashLSH
+    index reaches the target recall.
+    """
+    best_results = {}
+    for result in results:
+        if result['recall'] < target_recall:
+            continue
+        group = (result['engine'] != ENGINE_MINHASH, result['num_trees'])
+        if group not in best_results or result['candidates'] < best_results[group]['candidates']:
+            best_results[group] = result
+
+    baseline = best_results.get((False, 0))
+    compared = []
+    for group in sorted(best_results):
+        result = dict(best_results[group])
+        for name in ['num_tables', 'memory_mb', 'candidates']:
+            result[name + '_ratio'] = result[name] / float(baseline[name]) \
+                if baseline is not None and baseline[name] else None
+        compared.append(result)
+    return compared
+
+
+def format_ratio(ratio):
+    return '-' if ratio is None else '{:.2f}'.format(ratio)
+
+
+def main():
+    if len(sys.argv) < 2:
+        usage()
+        exit(1)
+
+    shingle_size = int(sys.argv[1])
+    target_recall = float(sys.argv[2]) if len(sys.argv) > 2 else TARGET_RECALL
+
+    _, key_to_id = load_key_dictionary()
+    ground_truth = load_ground_truth(TRAIN_GT_FILE, key_to_id)
+    if len(ground_truth) == 0:
+        print('INVALID GROUND TRUTH FILE')
+        exit(1)
+
+    signature_path, keys_path = get_signature_paths(shingle_size)
+    song_ids, signatures = load_signature_file(signature_path, keys_path)
+    num_permutations = [num_perm for num_perm in NUM_PERMUTATIONS if num_perm <= signatures.shape[1]]
+
+    if not os.path.exists(ENGINE_BENCHMARK_FILE):
+        with open(ENGINE_BENCHMARK_FILE, 'w+') as benchmark_out:
+            print('Engine, Num.Trees, Max.Bucket.Size, Lsh.Threshold, Shingle.Size, Num.Hashes, Num.Bands, Rows.Per.Band, '
+                  'Num.Tables, Build.Seconds, Pairs.Seconds, Memory.MB, Candidates, Precision, Recall',
+                  file=benchmark_out)
+
+    results = []
+    for engine, threshold, num_perm, num_trees, max_bucket_size in get_configurations(num_permutations,
+                                                                                       BENCHMARK_THRESHOLDS):
+        result = benchmark(engine, threshold, num_perm, num_trees, max_bucket_size, song_ids,
+                           signatures[:, :num_perm], ground_truth)
+        result.update(engine=engine, threshold=threshold, num_perm=num_perm, num_trees=num_trees,
+                      max_bucket_size=max_bucket_size)
+        results.append(result)
+        print('({}, num_trees = {}, max_bucket_size = {}, thresh = {}, num_hashes = {}, b = {}, r = {}) => '
+              'tables = {}; build = {:.2f}s; memory = {:.1f} MB; candidates = {}; P = {:.4f}; R = {:.4f}'.format(
+                  engine, num_trees, max_bucket_size, threshold, num_perm, result['b'], result['r'], result['num_tables'],
+                  result['build_time'], result['memory_mb'], result['candidates'],
+                  result['precision'], result['recall']))
+        with open(ENGINE_BENCHMARK_FILE, 'a') as benchmark_out:
+            print('{}, {}, {}, {}, {}, {}, {}, {}, {}, {:.3f}, {:.3f}, {:.1f}, {}, {}, {}'.format(
+                engine, num_trees, max_bucket_size, threshold, shingle_size, num_perm, result['b'], result['r'],
+                result['num_tables'], result['build_time'], result['pairs_time'], result['memory_mb'],
+                result['candidates'], result['precision'], result['recall']), file=benchmark_out)
+
+    compared = compare_at_recall(results, target_recall)
+    if not os.path.exists(ENGINE_COMPARISON_FILE):
+        with open(ENGINE_COMPARISON_FILE, 'w+') as comparison_out:
+            print('Target.Recall, Engine, Num.Trees, Max.Bucket.Size, Lsh.Threshold, Shingle.Size, Num.Hashes, Num.Tables, '
+                  'Memory.MB, Candidates, Precision, Recall, Tables.Ratio, Memory.Ratio, Candidates.Ratio',
+                  file=comparison_out)
+
+    print('Fewest candidates with recall >= {}, tables, memory and candidates relative to {}:'.format(
+        target_recall, ENGINE_MINHASH))
+    if not compared:
+        print('  none')
+    for result in compared:
+        print('  {}: num_trees = {}, max_bucket_size = {}, thresh = {}, num_hashes = {}, {} tables ({}x), '
+              'memory = {:.1f} MB ({}x), candidates = {} ({}x), build = {:.2f}s, P = {:.4f}, R = {:.4f}'.format(
+                  result['engine'], result['num_trees'], result['max_bucket_size'], result['threshold'],
+                  result['num_perm'], result['num_tables'], format_ratio(result['num_tables_ratio']),
+                  result['memory_mb'], format_ratio(result['memory_mb_ratio']), result['candidates'],
+                  format_ratio(result['candidates_ratio']), result['build_time'], result['precision'],
+                  result['recall']))
+        with open(ENGINE_COMPARISON_FILE, 'a') as comparison_out:
+            print('{}, {}, {}, {}, {}, {}, {}, {}, {:.1f}, {}, {}, {}, {}, {}, {}'.format(
+                target_recall, result['engine'], result['num_trees'], result['max_bucket_size'],
+                result['threshold'], shingle_size, result['num_perm'], result['num_tables'], result['memory_mb'],
+                result['candidates'],
+                result['precision'], result['recall'], format_ratio(result['num_tables_ratio']),
+                format_ratio(result['memory_mb_ratio']), format_ratio(result['candidates_ratio'])),
+                file=comparison_out)
+
+if __name__ == '__main__':
+    main()
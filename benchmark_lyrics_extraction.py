@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of lyrics_extraction on saved pages of each website.
+
+The pages are read from FIXTURES_DIR/<website>/<kind>.html, for the listing,
+artist and song pages of every website of SITE_RULES. They are trimmed copies
+of the markup of each website, with its navigation, scripts, comments,
+entities and charset.
+
+Each page is parsed by lyrics_extraction and by the code the crawlers used
+before it: a BeautifulSoup tree built with html.parser, searched with
+find_all and the predicates of LEGACY_PREDICATES, copied from the crawlers.
+The first predicate with matches is used, as the crawlers did. Both must find
+the same elements: the same links, or the same normalized lyrics (see
+normalize_lyrics). The time per page of both, their number of matches and
+whether they agree are appended to EXTRACTION_BENCHMARK_FILE.
+
+The song predicates of cifraclub.com.br never matched anything: tag.child is
+a search for a <child> tag in BeautifulSoup, which is None, not the first
+child of the tag. Their page is reported as different.
+"""
+
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+from lyrics_extraction import SITE_RULES, select
+from normalize_lyrics import normalize_lyrics
+
+FIXTURES_DIR = 'fixtures'
+EXTRACTION_BENCHMARK_FILE = os.path.join('out', 'output_extraction_benchmarks.csv')
+## The rule of each kind of page.
+PAGE_KINDS = [('listing', 'artists'), ('artist', 'songs'), ('song', 'lyrics')]
+NUM_REPETITIONS = 20
+## Errors of the legacy predicates on tags without the tested parents or
+## attributes, which mean no match.
+LEGACY_ERRORS = (AttributeError, KeyError, TypeError, IndexError)
+## Prefixes of the text of the links a crawler keeps from the matches of a
+## rule, e.g. crawler_musica.get_songs_URLs.
+LINK_TEXT_PREFIXES = {('musica.com', 'songs'): 'Letras de '}
+
+
+def usage():
+    print('./{} [fixtures_dir] [repetitions]'.format(sys.argv[0]))
+
+
+def is_artist_vagalume(tag):
+    try:
+        # .meio_no_block div ol li a
+        return (tag.name == "a"
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ol"
+                and tag.parent.parent.parent.name == "div"
+                and tag.parent.parent.parent.parent.name == "div"
+                and "meio_no_block" in tag.parent.parent.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_song_vagalume(tag):
+    try:
+        # .vscroll .tracks li a
+        return (tag.name == "a"
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ul"
+                and "tracks" in tag.parent.parent["class"]
+                and tag.parent.parent.parent.name == "div"
+                and "vscroll" in tag.parent.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_lyrics_vagalume(tag):
+    try:
+        return (tag.name == "div"
+                and tag.parent.name == "div"
+                and "lyr_original" == tag.parent["id"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_artist_cifraclub(tag):
+    try:
+        # #b_alfabeto ul li a
+        return (tag.name == "a"
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ul"
+                and tag.parent.parent.parent.name == "div"
+                and "b_alfabeto" == tag.parent.parent.parent["id"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_song_cifraclub(tag):
+    try:
+        # .list-alf ul.list-links li a.tooltip .ico_letra
+        return ("ico_letra" in tag.child["class"]
+                and tag.name == "a"
+                and "tooltip" in tag["class"]
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ul"
+                and "list-links" in tag.parent.parent["class"]
+                and tag.parent.parent.parent.name == "div"
+                and "list-alf" in tag.parent.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_song2_cifraclub(tag):
+    try:
+        # ol.list-links li a.tooltip .ico_letra
+        return ("ico_letra" in tag.child["class"]
+                and tag.name == "a"
+                and "tooltip" in tag["class"]
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ol"
+                and "list-links" in tag.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_lyrics_cifraclub(tag):
+    try:
+        # div.p402_premium div.letra-l
+        return (tag.name == "div"
+                and "letra-l" in tag["class"]
+                and tag.parent.name == "div"
+                and "p402_premium" in tag.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_lyrics2_cifraclub(tag):
+    try:
+        # div.p402_premium div.letra
+        return (tag.name == "div"
+                and "letra" in tag["class"]
+                and tag.parent.name == "div"
+                and "p402_premium" in tag.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_artist_letras(tag):
+    try:
+        return (tag.name == "a"
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ul"
+                and "cnt-list" in tag.parent.parent["class"]
+                and tag.parent.parent.parent.name == "div"
+                and "artistas-a" in tag.parent.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_song_letras(tag):
+    try:
+        return (tag.name == "a"
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ul"
+                and "cnt-list" in tag.parent.parent["class"]
+                and tag.parent.parent.parent.name == "div"
+                and "cnt-list--alp" in tag.parent.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_lyrics_letras(tag):
+    try:
+        return (tag.name == "p"
+                and tag.parent.name == "article"
+                and tag.parent.parent.name == "div"
+                and "cnt-letra" in tag.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_link_letras_de_musicas(tag):
+    try:
+        return (tag.name == "a"
+                and tag.parent.name == "li"
+                and tag.parent.parent.name == "ol"
+                and tag.parent.parent.parent.name == "div"
+                and "lst1" in tag.parent.parent.parent["class"])
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_lyrics_letras_de_musicas(tag):
+    try:
+        return tag.name == "p" and "pumSum" in tag["class"]
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_artist_musica(tag):
+    try:
+        return (tag.name == "a"
+                and tag["href"][:18] == "letras.asp?letras=")
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_song_musica(tag):
+    try:
+        return (tag.name == "a"
+                and tag["href"][:17] == "letras.asp?letra="
+                and tag.contents[1][:11] == " Letras de ")
+    except LEGACY_ERRORS:
+        return False
+
+
+def is_lyrics_musica(tag):
+    try:
+        return (tag.name == "p"
+                and tag.parent.name == "td"
+                and tag.parent.parent.name == "tr")
+    except LEGACY_ERRORS:
+        return False
+
+
+## The find_all predicates of the crawlers before lyrics_extraction, with the
+## rule of SITE_RULES they correspond to.
+LEGACY_PREDICATES = {
+    'vagalume.com.br': {
+        'artists': [is_artist_vagalume],
+        'songs': [is_song_vagalume],
+        'lyrics': [is_lyrics_vagalume],
+    },
+    'cifraclub.com.br': {
+        'artists': [is_artist_cifraclub],
+        'songs': [is_song_cifraclub, is_song2_cifraclub],
+        'lyrics': [is_lyrics_cifraclub, is_lyrics2_cifraclub],
+    },
+    'letras.mus.br': {
+        'artists': [is_artist_letras],
+        'songs': [is_song_letras],
+        'lyrics': [is_lyrics_letras],
+    },
+    'letrasdemusicas.com.br': {
+        'artists': [is_link_letras_de_musicas],
+        'songs': [is_link_letras_de_musicas],
+        'lyrics': [is_lyrics_letras_de_musicas],
+    },
+    'musica.com': {
+        'artists': [is_artist_musica],
+        'songs': [is_song_musica],
+        'lyrics': [is_lyrics_musica],
+    },
+}
+
+
+def load_fixtures(fixtures_dir):
+    """
+    Reads the pages of every website.
+
+    Returns:
+    A list of (website, kind, rule, page bytes) tuples.
+    """
+    fixtures = []
+    for website in sorted(SITE_RULES):
+        for kind, rule in PAGE_KINDS:
+            path = os.path.join(fixtures_dir, website, kind + '.html')
+            if not os.path.exists(path):
+                raise ValueError('Fixture page {} not found.'.format(path))
+            with open(path, 'rb') as fixture_in:
+                fixtures.append((website, kind, rule, fixture_in.read()))
+    return fixtures
+
+
+def select_with_soup(page, predicates):
+    """
+    Finds the tags of a page with BeautifulSoup and the first legacy
+    predicate with matches, as the crawlers did.
+    """
+    soup = BeautifulSoup(page, 'html.parser')
+    for predicate in predicates:
+        tags = soup.find_all(predicate)
+        if tags:
+            return tags
+    return []
+
+
+def get_soup_results(tags, rule):
+    """
+    Returns what is compared of the tags found by select_with_soup: their
+    links, or their normalized texts.
+    """
+    if rule == 'lyrics':
+        return [normalize_lyrics(str(tag)) for tag in tags]
+    return [tag.get('href') for tag in tags]
+
+
+def get_selector_results(matches, website, rule):
+    """
+    Returns what is compared of the matches of lyrics_extraction.select, see
+    get_soup_results. Only the links kept by the crawler are compared.
+    """
+    if rule == 'lyrics':
+        return [normalize_lyrics(text) for _, text in matches]
+    prefix = LINK_TEXT_PREFIXES.get((website, rule), '')
+    return [attrs.get('href') for attrs, text in matches if text.startswith(prefix)]
+
+
+def time_extraction(function, page, selectors, repetitions):
+    """
+    Returns the matches and the mean seconds of an extraction.
+    """
+    start_time = time.perf_counter()
+    for _ in range(repetitions):
+        matches = function(page, selectors)
+    return matches, (time.perf_counter() - start_time) / repetitions
+
+
+def main():
+    if len(sys.argv) > 3:
+        usage()
+        exit(1)
+
+    fixtures_dir = sys.argv[1] if len(sys.argv) > 1 else FIXTURES_DIR
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_REPETITIONS
+
+    if not os.path.exists(EXTRACTION_BENCHMARK_FILE):
+        with open(EXTRACTION_BENCHMARK_FILE, 'w+') as benchmark_out:
+            print('Website, Page, Page.KB, Soup.Matches, Soup.Ms, Selector.Matches, Selector.Ms, Speedup, Same',
+                  file=benchmark_out)
+
+    total_soup_time, total_selector_time = 0.0, 0.0
+    for website, kind, rule, page in load_fixtures(fixtures_dir):
+        soup_tags, soup_time = time_extraction(select_with_soup, page, LEGACY_PREDICATES[website][rule],
+                                               repetitions)
+        matches, selector_time = time_extraction(select, page, SITE_RULES[website][rule], repetitions)
+        is_same = get_soup_results(soup_tags, rule) == get_selector_results(matches, website, rule)
+        total_soup_time += soup_time
+        total_selector_time += selector_time
+        print('({}, {}, {:.0f} KB) => soup: {} matches, {:.2f} ms; selectors: {} matches, {:.2f} ms; '
+              'speedup = {:.1f}x; {}'.format(website, kind, len(page) / 1024.0, len(soup_tags), soup_time * 1000,
+                                             len(matches), selector_time * 1000, soup_time / selector_time,
+                                             'same' if is_same else 'DIFFERENT'))
+        with open(EXTRACTION_BENCHMARK_FILE, 'a') as benchmark_out:
+            print('{}, {}, {:.1f}, {}, {:.3f}, {}, {:.3f}, {:.2f}, {}'.format(
+                website, kind, len(page) / 1024.0, len(soup_tags), soup_time * 1000, len(matches),
+                selector_time * 1000, soup_time / selector_time, is_same), file=benchmark_out)
+    print('Overall speedup = {:.1f}x'.format(total_soup_time / total_selector_time))
+
+
+if __name__ == '__main__':
+    main()
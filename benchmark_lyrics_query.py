@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Latency benchmark of LyricsQueryIndex.
+
+Queries a saved LSH index with lyrics from a dataset, one at a time, and
+reports the latency percentiles. The results are appended to
+QUERY_BENCHMARK_FILE.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from corpus_store import load_dataset
+from lyrics_query import LyricsQueryIndex, DEFAULT_TOP_K
+
+QUERY_BENCHMARK_FILE = os.path.join('out', 'output_query_benchmarks.csv')
+NUM_QUERIES = 10000
+NUM_WARMUP_QUERIES = 100
+PERCENTILES = [50, 90, 99, 99.9]
+SEED = 1
+
+
+def usage():
+    print('./{} lsh_index_path query_dataset [num_queries]'.format(sys.argv[0]))
+
+
+def run(query_index, lyrics_list, k=DEFAULT_TOP_K):
+    """
+    Runs one query per lyric.
+
+    Returns:
+    An array with the latency of each query, in milliseconds, and the total
+    number of songs returned.
+    """
+    latencies = np.empty(len(lyrics_list))
+    num_results = 0
+    for i, lyrics in enumerate(lyrics_list):
+        start_time = time.perf_counter()
+        results = query_index.query(lyrics, k)
+        latencies[i] = (time.perf_counter() - start_time) * 1000
+        num_results += len(results)
+    return latencies, num_results
+
+
+def main():
+    if len(sys.argv) < 3:
+        usage()
+        exit(1)
+
+    index_path = sys.argv[1]
+    num_queries = int(sys.argv[3]) if len(sys.argv) > 3 else NUM_QUERIES
+
+    query_set = load_dataset(sys.argv[2])
+    lyrics_list = [lyrics for lyrics in query_set.values() if len(lyrics) > 0]
+    del query_set
+    if len(lyrics_list) == 0:
+        raise ValueError('Invalid query dataset. Must have lyrics.')
+    choice = np.random.RandomState(SEED).randint(0, len(lyrics_list), num_queries + NUM_WARMUP_QUERIES)
+    lyrics_list = [lyrics_list[i] for i in choice]
+
+    start_time = time.perf_counter()
+    query_index = LyricsQueryIndex(index_path)
+    load_time = (time.perf_counter() - start_time) * 1000
+    print('Index with {} songs loaded in {:.1f} ms.'.format(len(query_index.index), load_time))
+
+    ## The first queries fault in the pages of the index.
+    run(query_index, lyrics_list[:NUM_WARMUP_QUERIES])
+    latencies, num_results = run(query_index, lyrics_list[NUM_WARMUP_QUERIES:])
+
+    percentiles = np.percentile(latencies, PERCENTILES)
+    for percentile, latency in zip(PERCENTILES, percentiles):
+        print('p{} = {:.3f} ms'.format(percentile, latency))
+    print('max = {:.3f} ms, mean results = {:.2f}'.format(latencies.max(), num_results / float(num_queries)))
+
+    if not os.path.exists(QUERY_BENCHMARK_FILE):
+        with open(QUERY_BENCHMARK_FILE, 'w+') as benchmark_out:
+            print('Index, Num.Songs, Num.Queries, Load.Ms, ' +
+                  ', '.join('P{}.Ms'.format(p) for p in PERCENTILES) + ', Max.Ms',
+                  file=benchmark_out)
+    with open(QUERY_BENCHMARK_FILE, 'a') as benchmark_out:
+        print('{}, {}, {}, {:.3f}, {}, {:.3f}'.format(os.path.basename(os.path.normpath(index_path)),
+                                                     len(query_index.index), num_queries, load_time,
+                                                     ', '.join('{:.3f}'.format(l) for l in percentiles),
+                                                     latencies.max()),
+              file=benchmark_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Bucket-size instrumentation and handling of oversized LSH buckets.
+
+A bucket of n songs produces n * (n - 1) / 2 candidate pairs, so a few huge
+buckets (instrumentals, "letra não disponível" stubs, boilerplate) can produce
+most of the pairs of an index. The policies for buckets larger than a maximum
+size are:
+
+    keep    -- Expand the bucket as usual.
+    cap     -- Keep only the first max_bucket_size songs of the bucket.
+    split   -- Split the bucket by the values of extra signature rows, the
+               ones after the rows of its band, until every part fits.
+    cluster -- Do not expand the bucket, report it as a single cluster.
+"""
+
+import os
+import heapq
+import numpy as np
+
+POLICY_KEEP = 'keep'
+POLICY_CAP = 'cap'
+POLICY_SPLIT = 'split'
+POLICY_CLUSTER = 'cluster'
+POLICIES = [POLICY_KEEP, POLICY_CAP, POLICY_SPLIT, POLICY_CLUSTER]
+## Number of largest buckets reported.
+NUM_LARGEST_BUCKETS = 10
+BUCKET_STATS_HEADER = 'Index, Band, Num.Buckets, Num.Singletons, Max.Size, Num.Pairs, Size.Histogram'
+
+
+def count_bucket_pairs(bucket_size):
+    """
+    Returns the number of candidate pairs of a bucket with bucket_size songs.
+    """
+    return bucket_size * (bucket_size - 1) // 2
+
+
+class BucketStats(object):
+    """
+    Aggregates the size of every bucket of an index, band by band, as it is
+    added: the number of buckets, singletons and pairs, the largest size, a
+    histogram of the sizes in powers of two and the num_largest largest
+    sizes. The memory of a band does not depend on its number of buckets.
+
+    Usage:
+        stats = BucketStats()
+        stats.add_sizes(band, bucket_sizes)
+        stats.report()
+
+    add_sizes takes all the sizes of a band at once; add, for a single
+    bucket, costs about as much, so it should not be called per bucket.
+    """
+
+    def __init__(self, num_largest=NUM_LARGEST_BUCKETS):
+        self.num_largest = num_largest
+        self.band_stats = {}
+        ## Min-heap of the largest bucket sizes of each band.
+        self.largest_sizes = {}
+
+    def get_stats(self, band):
+        if band not in self.band_stats:
+            self.band_stats[band] = {'num_buckets': 0,
+                                     'num_singletons': 0,
+                                     'max_size': 0,
+                                     'num_pairs': 0,
+                                     'histogram': []}
+            self.largest_sizes[band] = []
+        return self.band_stats[band]
+
+    def add(self, band, bucket_size):
+        self.add_sizes(band, [bucket_size])
+
+    def add_sizes(self, band, bucket_sizes):
+        """
+        Adds the sizes of several buckets of a band.
+        """
+        sizes = np.asarray(bucket_sizes, dtype=np.int64)
+        if len(sizes) == 0:
+            return
+        stats = self.get_stats(band)
+        stats['num_buckets'] += len(sizes)
+        stats['num_singletons'] += int(np.count_nonzero(sizes == 1))
+        stats['max_size'] = max(stats['max_size'], int(sizes.max()))
+        stats['num_pairs'] += int(np.sum(sizes * (sizes - 1) // 2))
+
+        log_sizes = np.ceil(np.log2(np.maximum(sizes, 1))).astype(np.int64)
+        counts = np.bincount(log_sizes).tolist()
+        histogram = stats['histogram']
+        histogram.extend([0] * (len(counts) - len(histogram)))
+        for log_size, count in enumerate(counts):
+            histogram[log_size] += count
+
+        largest = self.largest_sizes[band]
+        if len(sizes) > self.num_largest:
+            sizes = np.partition(sizes, len(sizes) - self.num_largest)[-self.num_largest:]
+        for size in sizes.tolist():
+            if len(largest) < self.num_largest:
+                heapq.heappush(largest, size)
+            elif size > largest[0]:
+                heapq.heapreplace(largest, size)
+
+    def get_band_stats(self, band):
+        """
+        Returns a dictionary with the number of buckets, singletons, largest
+        size and pairs of a band, and a histogram of the bucket sizes in
+        powers of two: histogram[i] is the number of buckets with a size in
+        (2^(i-1), 2^i].
+        """
+        return dict(self.get_stats(band))
+
+    def get_largest_buckets(self, num_buckets=NUM_LARGEST_BUCKETS):
+        """
+        Returns the (band, size, pairs) tuples of the largest buckets of every
+        band, from the largest. At most num_largest buckets are kept per band.
+        """
+        largest = []
+        for band, sizes in self.largest_sizes.items():
+            for size in sorted(sizes, reverse=True)[:num_buckets]:
+                largest.append((band, size, count_bucket_pairs(size)))
+        largest.sort(key=lambda bucket: (-bucket[1], bucket[0]))
+        return largest[:num_buckets]
+
+    def report(self, index_name='', stats_file=None, num_buckets=NUM_LARGEST_BUCKETS):
+        """
+        Prints the largest buckets and the share of the pairs they produce,
+        and optionally appends the stats of each band to a CSV file.
+        """
+        band_stats = [(band, self.get_band_stats(band)) for band in sorted(self.band_stats)]
+        total_pairs = sum(stats['num_pairs'] for _, stats in band_stats)
+        print('{}: {} buckets, {} pairs before deduplication.'.format(index_name,
+                                                                       sum(stats['num_buckets'] for _, stats in band_stats),
+                                                                       total_pairs))
+        for band, size, num_pairs in self.get_largest_buckets(num_buckets):
+            print('  band {}: bucket of {} songs, {} pairs ({:.1%}).'.format(band, size, num_pairs,
+                                                                            num_pairs / float(max(total_pairs, 1))))
+
+        if stats_file:
+            write_header = not os.path.exists(stats_file)
+            with open(stats_file, 'a') as stats_out:
+                if write_header:
+                    print(BUCKET_STATS_HEADER, file=stats_out)
+                for band, stats in band_stats:
+                    print('{}, {}, {}, {}, {}, {}, {}'.format(index_name, band, stats['num_buckets'],
+                                                              stats['num_singletons'], stats['max_size'],
+                                                              stats['num_pairs'],
+                                                              '|'.join(str(c) for c in stats['histogram'])),
+                          file=stats_out)
+
+
+def split_bucket(bucket, signatures, first_row, max_bucket_size):
+    """
+    Splits a bucket by the values of the signature rows starting at
+    first_row, one row at a time, until every part has at most max_bucket_size
+    songs. Songs that agree on every row stay together.
+
+    Arguments:
+    bucket -- An array of song ids.
+    signatures -- A function mapping an array of song ids to their signature
+    matrix.
+    first_row -- The first signature row used to split, e.g. the first row
+    after the band of the bucket. Rows wrap around the signature.
+    max_bucket_size -- The maximum size of the parts.
+
+    Returns:
+    A list of arrays of song ids, the parts with more than one song.
+    """
+    bucket = np.asarray(bucket)
+    bucket_signatures = signatures(bucket)
+    num_perm = bucket_signatures.shape[1]
+
+    parts = []
+    pending = [(np.arange(len(bucket)), 0)]
+    while pending:
+        members, num_rows_used = pending.pop()
+        if len(members) <= max_bucket_size or num_rows_used == num_perm:
+            if len(members) > 1:
+                parts.append(bucket[members])
+            continue
+        row = (first_row + num_rows_used) % num_perm
+        _, groups = np.unique(bucket_signatures[members, row], return_inverse=True)
+        for group in range(groups.max() + 1):
+            group_members = members[groups == group]
+            if len(group_members) > 1:
+                pending.append((group_members, num_rows_used + 1))
+    return parts
+
+
+def apply_bucket_policy(bucket, band, r, max_bucket_size, policy, signatures=None, clusters=None):
+    """
+    Applies an oversized-bucket policy to a bucket.
+
+    Arguments:
+    bucket -- The song ids of the bucket.
+    band -- The band of the bucket.
+    r -- The number of rows per band.
+    max_bucket_size -- The maximum size of a bucket. None means no limit.
+    policy -- One of POLICIES.
+    signatures -- A function mapping an array of song ids to their signature
+    matrix. Needed by the split policy.
+    clusters -- A list where oversized buckets are appended by the cluster
+    policy.
+
+    Returns:
+    A list with the buckets to expand into candidate pairs.
+    """
+    if policy not in POLICIES:
+        raise ValueError('Invalid oversized bucket policy {}. Must be one of {}.'.format(policy, POLICIES))
+    if max_bucket_size is None or len(bucket) <= max_bucket_size or policy == POLICY_KEEP:
+        return [bucket]
+    if policy == POLICY_CAP:
+        return [bucket[:max_bucket_size]]
+    if policy == POLICY_SPLIT:
+        if signatures is None:
+            raise ValueError('The split policy needs the signatures of the songs.')
+        return split_bucket(bucket, signatures, (band + 1) * r, max_bucket_size)
+    ## POLICY_CLUSTER
+    if clusters is not None:
+        clusters.append(bucket)
+    return []
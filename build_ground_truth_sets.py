@@ -3,12 +3,11 @@
 
 
 import sys
-import pickle
 import itertools
-from multiprocessing import Pool
+import deletion_index
 from find_duplicates import is_same_string
-
-NUM_PROCESSES = 4
+from song_keys import load_key_dictionary, pack_key_pairs, save_ground_truth
+from corpus_store import load_dataset
 
 def usage(scriptname):
     print("Usage: %s pickle_processed_dict_filename pickle_count_true_and_matches_filename" % scriptname)
@@ -100,28 +99,17 @@ def main():
     pickle_processed_dict_filename = sys.argv[1]
     pickle_ground_truth_output = sys.argv[2]
 
-    count_true = 0
-    matches = set()
-    with open(pickle_processed_dict_filename, 'rb') as file_input:
-        print('RUNNING!')
-        dict_lyrics = pickle.load(file_input)
-
-        chunk_size = int(len(dict_lyrics) / NUM_PROCESSES)
-        items = list(dict_lyrics.keys())
-        dict_chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
-        print('Split the data into {} chunks of {} elements.'.format(NUM_PROCESSES, chunk_size))
-
-        pool = Pool(processes=NUM_PROCESSES)
-        results = pool.map(generate_matches, dict_chunks)
-        print('DONE!')
-
-        count_true = sum(r[0] for r in results)
-        matches = set.union(*(s[1] for s in results))
+    print('RUNNING!')
+    dict_lyrics = load_dataset(pickle_processed_dict_filename)
 
-        print('Number of matches found = {}'.format(count_true))
+    ## The deletion index only verifies the pairs that can match, so the whole
+    ## corpus is compared at once instead of within chunks.
+    count_true, matches = deletion_index.generate_matches(list(dict_lyrics.keys()))
+    print('DONE!')
+    print('Number of matches found = {}'.format(count_true))
 
-    with open(pickle_ground_truth_output, "wb") as file_out:
-        pickle.dump((count_true, matches), file_out)
+    _, key_to_id = load_key_dictionary()
+    save_ground_truth(pickle_ground_truth_output, pack_key_pairs(matches, key_to_id))
 
 
 if __name__ == "__main__":
@@ -3,11 +3,20 @@
 
 import os
 import pickle
-import editdistance
 import numpy as np
 from collections import defaultdict
-from multiprocessing import Process
-from datasketch import MinHash, MinHashLSH
+from datasketch import MinHash
+from batch_minhash import build_corpus_signatures
+from batch_minhash import iter_signature_chunks, iter_token_signature_chunks
+from batch_minhash import write_signature_files, load_signature_file
+from job_scheduler import run_jobs
+from candidate_pairs import CandidatePairWriter, unpack_pairs
+from song_keys import load_key_dictionary, extend_key_dictionary
+from corpus_store import load_dataset
+from build_train_test_sets import get_split_value
+from lsh_store import save_lsh_index, insert_songs, MappedLSHIndex
+from bucket_policy import BucketStats, apply_bucket_policy, POLICY_KEEP
+from lsh_forest import LSHForest, build_lsh_index, ENGINE_MINHASH, DEFAULT_NUM_TREES
 
 # Algorithm outline:
 #  For each website:
@@ -28,7 +37,39 @@ LSH_THRESHOLDS = [0.1, 0.3, 0.5, 0.7, 0.9]
 NUM_PERMUTATIONS = [64, 128, 256]
 BENCHMARK_FILE = os.path.join('out', 'output_lsh_benchmarks.csv')
 WEBSITE_BENCHMARK_FILE = os.path.join('out', 'output_website_benchmarks.csv')
-TRAIN_DATASET_FILE = os.path.join('out', 'train_set_pickle')
+TRAIN_DATASET_FILE = os.path.join('out', 'train_set')
+## Seed of build_train_validation_datasets. The training set only has keys
+## whose split value for build_train_test_sets.SPLIT_SEED is low, so splitting
+## it again needs independent values.
+TRAIN_VALIDATION_SEED = 2
+SIGNATURES_PATH = os.path.join('out', 'signatures')
+## If True, the sweep hashes the n-grams from integer token hashes (see
+## batch_minhash.build_shingle_hashes) and computes the signatures of every
+## shingle size from a single tokenization pass over the dataset.
+TOKEN_SHINGLES = True
+## Extension of the candidate pairs files.
+PAIRS_EXTENSION = '.pairs'
+## Extension of the files with the candidate pairs added by run_incremental.
+## They are not picked up by find_duplicates with the full pairs files.
+NEW_PAIRS_EXTENSION = '.newpairs'
+## Buckets with more songs than MAX_BUCKET_SIZE are handled by
+## OVERSIZED_POLICY, see bucket_policy. None means no limit.
+MAX_BUCKET_SIZE = None
+OVERSIZED_POLICY = POLICY_KEEP
+CLUSTERS_EXTENSION = '.clusters'
+BUCKET_STATS_FILE = os.path.join('out', 'output_bucket_stats.csv')
+LSH_INDEX_PATH = os.path.join('out', 'lsh_indexes')
+## Index engine of the sweep, one of lsh_forest.ENGINES. The LSH Forest
+## engine has FOREST_TREES trees.
+LSH_ENGINE = ENGINE_MINHASH
+FOREST_TREES = DEFAULT_NUM_TREES
+## If True, the indexes of the sweep are also saved as memory-mapped indexes
+## (see lsh_store), so run_from_index and run_incremental can walk or update
+## them without rehashing. Each one takes about as much disk as the signature
+## file, so only the (shingle size, permutations, threshold) configurations of
+## SAVED_LSH_INDEXES are saved, None meaning all of them.
+SAVE_LSH_INDEXES = False
+SAVED_LSH_INDEXES = None
 
 def build_shingle_list(input_str, ngram_size=3):
     """
@@ -87,11 +128,13 @@ def build_minhash(shingle_list, num_perm=128):
 def build_train_validation_datasets(song_list, train_proportion=0.5):
     """
     Given a list of songs and a proportion of training elements, this functions
-    selects uniformly at random which songs will compose the training and train
-    validation datasets.
+    selects which songs will compose the training and train validation
+    datasets, by the hash of their keys with TRAIN_VALIDATION_SEED (see
+    build_train_test_sets), so the same songs are selected on every run.
 
     Arguments:
-    song_list -- The list of songs to be split.
+    song_list -- The list of songs to be split. Each song is a tuple of
+    (website, artist-name, song-name, song-lyrics).
     train_proportion -- The proportion of elements to be assigned to the training
     set. The remaining 1-train_proportion elements will be assigned to the
     validation set. Default value is 0.5, half of the elements will be assigned
@@ -106,9 +149,13 @@ def build_train_validation_datasets(song_list, train_proportion=0.5):
     if train_proportion >= 1 or train_proportion <= 0:
         raise ValueError('Invalid train set proportion. Value must be in range (0, 1)')
 
-    choice = np.random.sample(len(song_list))
-    train_set = [s for i, s in enumerate(song_list) if choice[i] <= train_proportion]
-    validation_set = [s for i, s in enumerate(song_list) if choice[i] > train_proportion]
+    train_set = []
+    validation_set = []
+    for song in song_list:
+        if get_split_value('|'.join(song[:3]), seed=TRAIN_VALIDATION_SEED) < train_proportion:
+            train_set.append(song)
+        else:
+            validation_set.append(song)
     return train_set, validation_set
 
 
@@ -145,63 +192,171 @@ def build_lyrics_dict(lyrics_list):
     return lyrics_dict
 
 
-def get_possible_duplicates(lsh_index):
+def iter_possible_duplicates(lsh_index, max_bucket_size=None, oversized_policy=POLICY_KEEP,
+                             signatures=None, clusters=None, bucket_stats=None):
+    """
+    Generator version of get_possible_duplicates.
+    """
+    if not lsh_index:
+        raise ValueError('Invalid LSH index.')
+
+    if isinstance(lsh_index, (MappedLSHIndex, LSHForest)):
+        if signatures is None:
+            signatures = lsh_index.get_song_signatures
+        ## The trees of a forest are its bands.
+        for band in range(lsh_index.b):
+            if bucket_stats is not None:
+                bucket_stats.add_sizes(band, lsh_index.get_bucket_sizes(band))
+            for rows in lsh_index.iter_band_buckets(band):
+                for dups in apply_bucket_policy(lsh_index.song_ids[rows], band, lsh_index.r,
+                                                max_bucket_size, oversized_policy, signatures, clusters):
+                    yield dups
+        return
+
+    for band, bucket in enumerate(lsh_index.hashtables):
+        if bucket_stats is not None:
+            bucket_stats.add_sizes(band, np.fromiter((len(elem) for elem in bucket.values()),
+                                                     dtype=np.int64, count=len(bucket)))
+        for elem in bucket.values():
+            if len(elem) > 1:
+                for dups in apply_bucket_policy(elem, band, lsh_index.r, max_bucket_size,
+                                                oversized_policy, signatures, clusters):
+                    yield dups
+
+
+def get_possible_duplicates(lsh_index, max_bucket_size=None, oversized_policy=POLICY_KEEP,
+                            signatures=None, clusters=None, bucket_stats=None):
     """
     Given an LSH index, this function iterates through the buckets of the index
     and retrieves a list of possible duplicates.
 
     Arguments:
-    lsh_index -- The LSH index structure.
+    lsh_index -- The LSH index structure, a MinHashLSH, LSHForest or
+    MappedLSHIndex.
+    max_bucket_size -- Buckets with more songs are handled by oversized_policy.
+    Default value is None, meaning no limit.
+    oversized_policy -- One of bucket_policy.POLICIES. Default value is to keep
+    oversized buckets as they are.
+    signatures -- A function mapping an array of song ids to their signature
+    matrix, used by the split policy. A MappedLSHIndex provides its own.
+    clusters -- A list where the cluster policy appends the oversized buckets
+    instead of returning them.
+    bucket_stats -- An optional bucket_policy.BucketStats that receives the
+    size of every bucket, before the policy is applied.
 
     Returns:
     A list of lists, where each sublist contains the keys of the possible
     duplicates stored in the LSH hash.
     """
-    if not lsh_index:
-        raise ValueError('Invalid LSH index.')
+    return list(iter_possible_duplicates(lsh_index, max_bucket_size, oversized_policy,
+                                         signatures, clusters, bucket_stats))
 
-    possible_duplicates = []
-    for bucket in lsh_index.hashtables:
-        for elem in bucket.values():
-            if len(elem) > 1:
-                possible_duplicates.append(elem)
 
-    return possible_duplicates
+def get_signature_paths(shingle_size):
+    """
+    Returns the paths of the signature matrix and keys files of the train
+    dataset for a given shingle size.
+    """
+    prefix = os.path.join(SIGNATURES_PATH, 'shinglesize-{}'.format(shingle_size))
+    return prefix + '.npy', prefix + '_keys'
+
+
+def build_signatures(shingle_sizes, num_permutations):
+    """
+    Computes the signatures of the training dataset once for each shingle size
+    and writes them to memory-mapped files, with the ids of the songs in the
+    key dictionary. Every LSH index of the sweep with
+    one of these shingle sizes and at most num_permutations permutations is
+    built from these files.
+
+    Arguments:
+    shingle_sizes -- A list with the sizes of the n-grams.
+    num_permutations -- The number of permutations of the signatures. Must be
+    the largest number of permutations of the sweep.
+    """
+    train_dataset = load_dataset(TRAIN_DATASET_FILE)
+    _, key_to_id = load_key_dictionary()
+
+    def dataset_items():
+        return ((key_to_id[key], lyrics) for key, lyrics in train_dataset.items())
+
+    os.makedirs(SIGNATURES_PATH, exist_ok=True)
+    if TOKEN_SHINGLES:
+        signature_paths, keys_paths = zip(*[get_signature_paths(s) for s in shingle_sizes])
+        signature_chunks = iter_token_signature_chunks(dataset_items(), shingle_sizes,
+                                                       num_perm=num_permutations)
+        write_signature_files(signature_paths, keys_paths, signature_chunks,
+                              len(train_dataset), num_perm=num_permutations)
+        return
+
+    for shingle_size in shingle_sizes:
+        signature_path, keys_path = get_signature_paths(shingle_size)
+        signature_chunks = ((keys, [signatures]) for keys, signatures in
+                            iter_signature_chunks(dataset_items(), shingle_size,
+                                                  num_perm=num_permutations))
+        write_signature_files([signature_path], [keys_path], signature_chunks,
+                              len(train_dataset), num_perm=num_permutations)
+
+
+def get_index_path(shingle_size, num_permutations, lsh_threshold):
+    """
+    Returns the directory of the saved LSH index of the train dataset for the
+    given parameters.
+    """
+    return os.path.join(LSH_INDEX_PATH, 'shinglesize-{}_numperp-{}_thresh-{}'.format(shingle_size,
+                                                                                    num_permutations,
+                                                                                    lsh_threshold))
 
 
-def is_same_string(string_a, string_b, char_margin=5):
+def get_signature_lookup(song_ids, signatures, num_ids):
     """
-    Given two strings, this function returns True if they are identical within
-    a certain tolerance. This functions uses the edit distance to compare the
-    inputs.
+    Returns a function mapping an array of song ids to their rows of a
+    signature matrix, for the split policy of get_possible_duplicates.
+    """
+    rows_by_id = np.full(num_ids, -1, dtype=np.int64)
+    rows_by_id[np.asarray(song_ids, dtype=np.int64)] = np.arange(len(song_ids))
+    return lambda ids: signatures[rows_by_id[np.asarray(ids, dtype=np.int64)]]
+
+
+def dump_possible_duplicates(lsh, num_ids, shingle_size, num_permutations, lsh_threshold,
+                             signatures=None):
+    """
+    Streams all the pairs of songs that share a bucket of the LSH index to a
+    candidate pairs file named after the index parameters. Buckets larger than
+    MAX_BUCKET_SIZE are handled by OVERSIZED_POLICY, the oversized buckets of
+    the cluster policy are pickled to a clusters file, and the bucket sizes of
+    every band are appended to BUCKET_STATS_FILE.
 
     Arguments:
-    string_a -- The first string
-    string_b -- The second string
-    char_margin -- The number or percentage of characters to use as margin. If
-    this parameter is float, it will be interpreted as a percentage of characters
-    of the smallest string. If is of type int, then it will be interpreted as the
-    number of characters of tolerance to declare that the two strings are the same.
+    lsh -- The MinHashLSH, LSHForest or MappedLSHIndex index, with the
+    song ids of the key dictionary as keys.
+    num_ids -- The number of ids of the key dictionary.
+    shingle_size, num_permutations, lsh_threshold -- The index parameters.
+    signatures -- A function mapping an array of song ids to their signature
+    matrix, used by the split policy.
 
     Returns:
-    True if string_a matches string_b with at most "char_margin" different
-    characters. Also returns the distance between the two strings.
+    The path of the candidate pairs file.
     """
-    if not string_a or len(string_a) == 0:
-        raise ValueError('Invalid input string.')
-    if not string_b or len(string_b) == 0:
-        raise ValueError('Invalid input string.')
-    if isinstance(char_margin, int):
-        if len(string_a) < char_margin or len(string_b) < char_margin:
-            raise ValueError('Input strings shorter than tolerance margin.')
-
-    d = editdistance.eval(string_a, string_b)
-
-    if isinstance(char_margin, float):
-        shortest_str_len = len(string_a) if len(string_a) < len(string_b) else len(string_b)
-        return (False if float(d) / float(shortest_str_len) > char_margin else True), d
-    else:
-        return d < char_margin, d
+    duplicates_filename = 'b-{}_r-{}_shinglesize-{}_numperp-{}_thresh-{}'.format(lsh.b, lsh.r, shingle_size, num_permutations, lsh_threshold)
+    if isinstance(lsh, LSHForest):
+        duplicates_filename += '_maxbucket-{}'.format(lsh.max_bucket_size)
+    pairs_path = duplicates_filename + PAIRS_EXTENSION
+    writer = CandidatePairWriter(pairs_path, num_ids)
+    clusters = []
+    bucket_stats = BucketStats()
+    ## Getting the ids of the possible duplicates.
+    for dups in iter_possible_duplicates(lsh, MAX_BUCKET_SIZE, OVERSIZED_POLICY, signatures,
+                                         clusters, bucket_stats):
+        writer.add_bucket(dups)
+    writer.close()
+
+    bucket_stats.report(duplicates_filename, BUCKET_STATS_FILE)
+    if clusters:
+        with open(duplicates_filename + CLUSTERS_EXTENSION, 'wb') as clusters_out:
+            pickle.dump([np.asarray(cluster).tolist() for cluster in clusters], clusters_out)
+
+    return pairs_path
 
 
 def run(shingle_size, num_permutations, lsh_threshold):
@@ -216,53 +371,123 @@ def run(shingle_size, num_permutations, lsh_threshold):
     for inconsistensies.
     """
     ## Reading the traning dataset.
-    train_dataset = {}
-    with open(TRAIN_DATASET_FILE, 'rb') as train_set_in:
-        train_dataset = pickle.load(train_set_in)
+    train_dataset = load_dataset(TRAIN_DATASET_FILE)
+    id_to_key, key_to_id = load_key_dictionary()
+
+    dataset_items = ((key_to_id[key], lyrics) for key, lyrics in train_dataset.items())
+    ## Shingled the same way as the signature files of the sweep.
+    song_ids, signatures = build_corpus_signatures(dataset_items, shingle_size,
+                                                   num_perm=num_permutations,
+                                                   token_shingles=TOKEN_SHINGLES)
 
     ## Building the LSH index.
-    lsh = MinHashLSH(threshold=lsh_threshold,
-                     num_perm=num_permutations)
+    lsh = build_lsh_index(LSH_ENGINE, lsh_threshold, num_permutations, song_ids, signatures,
+                          FOREST_TREES)
 
-    for key, lyrics in train_dataset.items():
-        if len(lyrics) == 0:
-            continue
+    dump_possible_duplicates(lsh, len(id_to_key), shingle_size, num_permutations, lsh_threshold,
+                             get_signature_lookup(song_ids, signatures, len(id_to_key)))
 
-        shingle_list = build_shingle_list(lyrics, ngram_size=shingle_size)
-        if len(shingle_list) == 0:
-            continue
 
-        mhash = build_minhash(shingle_list, num_perm=num_permutations)
-        try:
-            lsh.insert(key, mhash)
-        except ValueError:
-            ## This error occurs if there is a song with the same name in the hash.
-            print('Repeated Key = {}'.format(key))
+def run_from_signatures(shingle_size, num_permutations, lsh_threshold):
+    """
+    Same as run, but the LSH index is built from the signature file written by
+    build_signatures instead of hashing the training dataset again.
+    """
+    signature_path, keys_path = get_signature_paths(shingle_size)
+    song_ids, signatures = load_signature_file(signature_path, keys_path,
+                                               num_perm=num_permutations)
+    id_to_key, _ = load_key_dictionary()
 
-    ## Getting the keys of the possible duplicates.
-    possible_duplicates = get_possible_duplicates(lsh)
+    ## Building the LSH index.
+    lsh = build_lsh_index(LSH_ENGINE, lsh_threshold, num_permutations, song_ids, signatures,
+                          FOREST_TREES)
 
-    possible_duplicates_comb = []
-    for dups in possible_duplicates:
-        for idx, key in enumerate(dups):
-            for next_idx in range(idx+1, len(dups)):
-                curr_comb = [key, dups[next_idx]]
-                possible_duplicates_comb.append(curr_comb)
+    if SAVE_LSH_INDEXES and (SAVED_LSH_INDEXES is None or
+                             (shingle_size, num_permutations, lsh_threshold) in SAVED_LSH_INDEXES):
+        save_lsh_index(get_index_path(shingle_size, num_permutations, lsh_threshold),
+                       song_ids, signatures, lsh_threshold, num_perm=num_permutations,
+                       shingle_size=shingle_size, token_shingles=TOKEN_SHINGLES)
 
-    duplicates_filename = 'b-{}_r-{}_shinglesize-{}_numperp-{}_thresh-{}'.format(lsh.b, lsh.r, shingle_size, num_permutations, lsh_threshold)
-    pickle.dump(possible_duplicates_comb, open(duplicates_filename, 'wb'))
+    dump_possible_duplicates(lsh, len(id_to_key), shingle_size, num_permutations, lsh_threshold,
+                             get_signature_lookup(song_ids, signatures, len(id_to_key)))
 
 
-if __name__ == '__main__':
-    process_pool = []
+def run_from_index(shingle_size, num_permutations, lsh_threshold):
+    """
+    Same as run, but the buckets are read from the index saved by
+    run_from_signatures, without hashing anything.
+    """
+    index = MappedLSHIndex(get_index_path(shingle_size, num_permutations, lsh_threshold))
+    id_to_key, _ = load_key_dictionary()
+    dump_possible_duplicates(index, len(id_to_key), shingle_size, num_permutations, lsh_threshold)
+
+
+def run_incremental(shingle_size, num_permutations, lsh_threshold, new_dataset_file):
+    """
+    Adds the songs of a new dataset to the index saved by run_from_signatures
+    and writes only the candidate pairs that involve at least one new song.
+    Only the new songs are hashed, with the shingling, permutations and seed
+    recorded in the index.
 
+    Arguments:
+    shingle_size, num_permutations, lsh_threshold -- The parameters of the
+    saved index.
+    new_dataset_file -- A pickled dictionary or a corpus (see corpus_store)
+    mapping 'website|artist|song' keys to lyrics, e.g. the processed output of a new crawl. Keys that are not in
+    the key dictionary are added to it.
+
+    Returns:
+    The path of the candidate pairs file of the new songs.
+    """
+    index_path = get_index_path(shingle_size, num_permutations, lsh_threshold)
+    lsh = MappedLSHIndex(index_path)
+    if lsh.shingle_size is not None and lsh.shingle_size != shingle_size:
+        raise ValueError('LSH index {} has shingle size {}.'.format(index_path, lsh.shingle_size))
+
+    new_dataset = load_dataset(new_dataset_file)
+    id_to_key, key_to_id = extend_key_dictionary(new_dataset.keys())
+
+    dataset_items = ((key_to_id[key], lyrics) for key, lyrics in new_dataset.items())
+    song_ids, signatures = build_corpus_signatures(dataset_items, shingle_size, num_perm=lsh.num_perm,
+                                                   seed=lsh.seed, token_shingles=lsh.token_shingles)
+    new_pairs = unpack_pairs(insert_songs(index_path, song_ids, signatures))
+
+    pairs_path = 'b-{}_r-{}_shinglesize-{}_numperp-{}_thresh-{}{}'.format(lsh.b, lsh.r, shingle_size,
+                                                                         num_permutations, lsh_threshold,
+                                                                         NEW_PAIRS_EXTENSION)
+    writer = CandidatePairWriter(pairs_path, len(id_to_key))
+    writer.add_pairs(new_pairs[:, 0], new_pairs[:, 1])
+    writer.close()
+
+    return pairs_path
+
+
+if __name__ == '__main__':
+    ## Signatures only depend on the shingle size. The smaller numbers of
+    ## permutations are prefixes of the largest one.
+    ## With TOKEN_SHINGLES a single job tokenizes the dataset once for all the
+    ## shingle sizes.
+    if TOKEN_SHINGLES:
+        shingle_size_groups = [SHINGLE_SIZES]
+    else:
+        shingle_size_groups = [[s] for s in SHINGLE_SIZES]
+
+    signature_jobs = []
+    for curr_shingle_sizes in shingle_size_groups:
+        job_name = 'signatures_shinglesize-{}'.format('-'.join(str(s) for s in curr_shingle_sizes))
+        signature_jobs.append((job_name, build_signatures,
+                               (curr_shingle_sizes, max(NUM_PERMUTATIONS)),
+                               max(NUM_PERMUTATIONS)))
+    run_jobs(signature_jobs, benchmark_file=BENCHMARK_FILE)
+
+    ## More permutations and lower thresholds (more bands) mean larger indexes
+    ## and more candidate pairs.
+    sweep_jobs = []
     for curr_shingle_size in SHINGLE_SIZES:
         for curr_num_perm in NUM_PERMUTATIONS:
             for curr_threshold in LSH_THRESHOLDS:
-                p = Process(target=run, args=(curr_shingle_size, curr_num_perm, curr_threshold))
-                process_pool.append(p)
-                p.start()
-
-    for p in process_pool:
-        p.join()
-
+                job_name = 'shinglesize-{}_numperp-{}_thresh-{}'.format(curr_shingle_size, curr_num_perm, curr_threshold)
+                sweep_jobs.append((job_name, run_from_signatures,
+                                   (curr_shingle_size, curr_num_perm, curr_threshold),
+                                   (curr_num_perm, -curr_threshold)))
+    run_jobs(sweep_jobs, benchmark_file=BENCHMARK_FILE)
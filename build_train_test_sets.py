@@ -5,17 +5,33 @@
 This script reads the pickle output files generated by the crawlers, normalize
 the artists' names and song lyrics, splits the dataset into training and test
 sets and saves them for further processing by another module.
+
+Each song is assigned to a split by a seeded BLAKE2b hash of its key, so the
+split is the same on every run and machine without storing it, and the
+dataset is split in a single streaming pass, written directly to one corpus
+(see corpus_store) per split.
 """
 
 import os
 import re
 import pickle
 import string
-import numpy as np
+import hashlib
+from corpus_store import CorpusWriter, load_dataset, METADATA_FILE
+from normalize_lyrics import write_normalized_dataset, NORMALIZED_CORPUS_PATH
 
-OUTPUT_TRAIN_DATASET_FILE = os.path.join('out', 'train_set_pickle')
-OUTPUT_TEST_DATASET_FILE = os.path.join('out', 'test_set_pickle')
+OUTPUT_TRAIN_DATASET_FILE = os.path.join('out', 'train_set')
+OUTPUT_VALIDATION_DATASET_FILE = os.path.join('out', 'validation_set')
+OUTPUT_TEST_DATASET_FILE = os.path.join('out', 'test_set')
 INPUT_PICKLE_FILE = os.path.join('out', 'lyrics_pickle_processed_dict')
+## Changing the seed draws a different split.
+SPLIT_SEED = 1
+## Proportion of the songs in the training and validation sets, the rest is
+## the test set. The validation set is VALIDATION_PROPORTION of them.
+TRAIN_PROPORTION = 0.7
+VALIDATION_PROPORTION = 0.14
+TRAIN_SPLIT, VALIDATION_SPLIT, TEST_SPLIT = 0, 1, 2
+SPLIT_NAMES = ['train', 'validation', 'test']
 
 
 def read_pickle_file(pickle_path):
@@ -45,41 +61,98 @@ def read_pickle_file(pickle_path):
     return lyrics_tuple_list
 
 
+def get_split_value(key, seed=SPLIT_SEED):
+    """
+    Returns a number uniformly distributed in [0, 1) that only depends on a
+    song key and the seed.
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8,
+                             key=seed.to_bytes(8, 'little')).digest()
+    return int.from_bytes(digest, 'little') / float(1 << 64)
+
+
+def assign_split(key, train_proportion=TRAIN_PROPORTION, validation_proportion=VALIDATION_PROPORTION,
+                 seed=SPLIT_SEED):
+    """
+    Returns the split of a song key: TRAIN_SPLIT, VALIDATION_SPLIT or
+    TEST_SPLIT.
+    """
+    value = get_split_value(key, seed)
+    if value >= train_proportion:
+        return TEST_SPLIT
+    if value >= train_proportion * (1 - validation_proportion):
+        return VALIDATION_SPLIT
+    return TRAIN_SPLIT
+
+
 def build_train_validation_test_sets(song_list, train_proportion):
     """
     Given a list of songs and a proportion of training elements, this functions
-    selects uniformly at random which songs will compose the training and test
-    datasets.
+    selects which songs will compose the training and test datasets, by the
+    hash of their keys.
 
     Arguments:
-    song_list -- A list of songs. Each song is a tuple of
-    (website, artist-name, song-name and song-lyrics).
+    song_list -- A {website|artist|song-name: lyrics} dictionary.
     train_proporion -- The percentage of elements to assign to the training set.
     This value must be in range (0, 1)
 
     Returns:
-    Two lists, the first contains the training set, and the second contains the
-    test set.
+    Two dictionaries, the first contains the training set, and the second
+    contains the test set.
     """
     if not song_list or len(song_list) == 0:
         raise ValueError('Invalid list of songs.')
     if train_proportion >= 1 or train_proportion <= 0:
         raise ValueError('Invalid train set proportion. Value must be in range (0, 1)')
-    
-    choice = np.random.sample(len(song_list))
-    train_set = dict([(k, s) for i, (k, s) in enumerate(song_list.items()) if choice[i] <= train_proportion])
-    test_set = dict([(k, s) for i, (k, s) in enumerate(song_list.items()) if choice[i] > train_proportion])
+
+    train_set = {}
+    test_set = {}
+    for key, lyrics in song_list.items():
+        if get_split_value(key) < train_proportion:
+            train_set[key] = lyrics
+        else:
+            test_set[key] = lyrics
     return train_set, test_set
 
+
+def write_splits(dataset, output_paths, train_proportion=TRAIN_PROPORTION,
+                 validation_proportion=VALIDATION_PROPORTION, seed=SPLIT_SEED):
+    """
+    Splits a dataset in a single pass, writing each song directly to the
+    corpus of its split.
+
+    Arguments:
+    dataset -- A dictionary or corpus_store.MappedCorpus mapping song keys to
+    lyrics. A corpus is read one song at a time.
+    output_paths -- The corpus directories of the training, validation and
+    test sets.
+    train_proportion, validation_proportion -- See assign_split.
+    seed -- The seed of the split hash.
+
+    Returns:
+    A list with the number of songs of each split.
+    """
+    if train_proportion >= 1 or train_proportion <= 0:
+        raise ValueError('Invalid train set proportion. Value must be in range (0, 1)')
+    if validation_proportion >= 1 or validation_proportion < 0:
+        raise ValueError('Invalid validation set proportion. Value must be in range [0, 1)')
+    if len(output_paths) != len(SPLIT_NAMES):
+        raise ValueError('Invalid output paths. Must have one path per split.')
+
+    writers = [CorpusWriter(path) for path in output_paths]
+    for key, lyrics in dataset.items():
+        writers[assign_split(key, train_proportion, validation_proportion, seed)].add(key, lyrics)
+    return [writer.close() for writer in writers]
+
+
 if __name__ == '__main__':
-    lyrics_list = read_pickle_files(PICKLE_FILE_LIST)
-    #lyrics_list = normalize_dataset(lyrics_list)
-    train_set, test_set = build_train_test_sets(lyrics_list, 0.7)
-
-    choice = np.random.sample(len(train_set))
-    new_train_set = dict([(k, s) for i, (k, s) in enumerate(train_set.items()) if choice[i] <= 0.86])
-    validation_set = dict([(k, s) for i, (k, s) in enumerate(train_set.items()) if choice[i] > 0.86])
-    
-    pickle.dump(new_train_set, open(OUTPUT_TRAIN_DATASET_FILE, 'wb'))
-    pickle.dump(validation_set, open(os.path.join('out', 'validation_set_pickle'), 'wb'))
-    pickle.dump(test_set, open(OUTPUT_TEST_DATASET_FILE, 'wb'))
+    ## The corpus is normalized once, and again only when it changes.
+    normalized_metadata = os.path.join(NORMALIZED_CORPUS_PATH, METADATA_FILE)
+    if not os.path.exists(normalized_metadata) or \
+            os.path.getmtime(normalized_metadata) < os.path.getmtime(INPUT_PICKLE_FILE):
+        write_normalized_dataset(INPUT_PICKLE_FILE, NORMALIZED_CORPUS_PATH)
+
+    output_paths = [OUTPUT_TRAIN_DATASET_FILE, OUTPUT_VALIDATION_DATASET_FILE, OUTPUT_TEST_DATASET_FILE]
+    split_sizes = write_splits(load_dataset(NORMALIZED_CORPUS_PATH), output_paths)
+    for name, path, size in zip(SPLIT_NAMES, output_paths, split_sizes):
+        print('{} set: {} songs written to {}.'.format(name, size, path))
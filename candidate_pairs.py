@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Compact on-disk storage for the candidate pairs of an LSH index.
+
+A candidate pairs file is a flat binary file of little-endian int32 song ids,
+two per pair, with the smallest id first. The pairs are unique and sorted, and
+are written while the buckets are walked, so the full list of pairs never has
+to be held in memory. The pairs are spread into partition files by their first
+id and each partition is deduplicated on its own when the writer is closed.
+"""
+
+import os
+import numpy as np
+
+PAIR_DTYPE = np.dtype('<i4')
+## Number of pairs buffered in memory before they are spilled to the
+## partition files.
+DEFAULT_BUFFER_SIZE = 1 << 22
+DEFAULT_NUM_PARTITIONS = 64
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def pack_pairs(first_ids, second_ids):
+    """
+    Packs pairs of song ids into single np.uint64 values, (min_id << 32) | max_id,
+    so that both orientations of a pair have the same value.
+    """
+    first_ids = np.asarray(first_ids, dtype=np.uint64)
+    second_ids = np.asarray(second_ids, dtype=np.uint64)
+    return (np.minimum(first_ids, second_ids) << np.uint64(32)) | np.maximum(first_ids, second_ids)
+
+
+def unpack_pairs(packed_pairs):
+    """
+    Inverse of pack_pairs.
+
+    Returns:
+    A (len(packed_pairs), 2) array of int32 song ids.
+    """
+    packed_pairs = np.asarray(packed_pairs, dtype=np.uint64)
+    pairs = np.empty((len(packed_pairs), 2), dtype=PAIR_DTYPE)
+    pairs[:, 0] = packed_pairs >> np.uint64(32)
+    pairs[:, 1] = packed_pairs & np.uint64(0xffffffff)
+    return pairs
+
+
+def pack_bucket_pairs(buckets):
+    """
+    In-memory counterpart of CandidatePairWriter, for small indexes.
+
+    Arguments:
+    buckets -- An iterable of lists of song ids that share a bucket.
+
+    Returns:
+    A sorted np.uint64 array with the unique packed pairs of all the buckets.
+    """
+    packed_pairs = [np.empty(0, dtype=np.uint64)]
+    for bucket_ids in buckets:
+        bucket_ids = np.asarray(bucket_ids, dtype=np.uint64)
+        first, second = np.triu_indices(len(bucket_ids), 1)
+        packed_pairs.append(pack_pairs(bucket_ids[first], bucket_ids[second]))
+    return np.unique(np.concatenate(packed_pairs))
+
+
+class CandidatePairWriter(object):
+    """
+    Streams candidate pairs to a candidate pairs file, removing the pairs
+    repeated across buckets and bands.
+
+    Usage:
+        writer = CandidatePairWriter(path, num_ids)
+        for bucket in buckets:
+            writer.add_bucket(bucket_ids)
+        num_pairs = writer.close()
+    """
+
+    def __init__(self, path, num_ids, num_partitions=DEFAULT_NUM_PARTITIONS,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        Arguments:
+        path -- The path of the candidate pairs file to write.
+        num_ids -- The number of distinct song ids. Ids must be in [0, num_ids).
+        num_partitions -- The number of partition files. Each one holds about
+        1/num_partitions of the pairs and is loaded whole when closing.
+        buffer_size -- The number of pairs buffered in memory before spilling.
+        """
+        if num_ids <= 0 or num_ids > np.iinfo(PAIR_DTYPE).max:
+            raise ValueError('Invalid number of ids.')
+        if num_partitions <= 0:
+            raise ValueError('Invalid number of partitions. Must be larger than 0.')
+
+        self.path = path
+        self.num_ids = num_ids
+        self.num_partitions = min(num_partitions, num_ids)
+        self.buffer_size = buffer_size
+        self.ids_per_partition = -(-num_ids // self.num_partitions)
+        self._buffer = []
+        self._buffered = 0
+        self._partition_paths = ['{}.part-{}'.format(path, p) for p in range(self.num_partitions)]
+        for partition_path in self._partition_paths:
+            open(partition_path, 'wb').close()
+
+    def add_pairs(self, first_ids, second_ids):
+        """
+        Adds pairs of song ids. The order of the ids in each pair does not
+        matter, and pairs may be repeated.
+        """
+        self._buffer.append(pack_pairs(first_ids, second_ids))
+        self._buffered += len(self._buffer[-1])
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def add_bucket(self, bucket_ids):
+        """
+        Adds every pair of song ids of a bucket. Large buckets are expanded a
+        block of rows at a time, so no more than about buffer_size pairs are
+        materialized at once.
+        """
+        bucket_ids = np.asarray(bucket_ids, dtype=np.uint64)
+        bucket_size = len(bucket_ids)
+        if bucket_size < 2:
+            return
+
+        if bucket_size * (bucket_size - 1) // 2 <= self.buffer_size:
+            first, second = np.triu_indices(bucket_size, 1)
+            self.add_pairs(bucket_ids[first], bucket_ids[second])
+            return
+
+        for idx in range(bucket_size - 1):
+            self.add_pairs(np.repeat(bucket_ids[idx], bucket_size - idx - 1), bucket_ids[idx + 1:])
+
+    def flush(self):
+        """
+        Spills the buffered pairs to the partition files.
+        """
+        if not self._buffer:
+            return
+
+        packed_pairs = np.unique(np.concatenate(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+        partitions = (packed_pairs >> np.uint64(32)) // np.uint64(self.ids_per_partition)
+        bounds = np.searchsorted(partitions, np.arange(self.num_partitions + 1))
+        for p, partition_path in enumerate(self._partition_paths):
+            if bounds[p] == bounds[p + 1]:
+                continue
+            with open(partition_path, 'ab') as partition_out:
+                packed_pairs[bounds[p]:bounds[p + 1]].tofile(partition_out)
+
+    def close(self):
+        """
+        Deduplicates each partition and writes the final candidate pairs file.
+
+        Returns:
+        The number of unique pairs written.
+        """
+        self.flush()
+        num_pairs = 0
+        with open(self.path, 'wb') as pairs_out:
+            for partition_path in self._partition_paths:
+                packed_pairs = np.unique(np.fromfile(partition_path, dtype=np.uint64))
+                unpack_pairs(packed_pairs).tofile(pairs_out)
+                num_pairs += len(packed_pairs)
+                os.remove(partition_path)
+        return num_pairs
+
+
+def count_candidate_pairs(path):
+    """
+    Returns the number of pairs stored in a candidate pairs file.
+    """
+    return os.path.getsize(path) // (2 * PAIR_DTYPE.itemsize)
+
+
+def iter_candidate_pairs(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Lazily reads a candidate pairs file.
+
+    Arguments:
+    path -- The path of the candidate pairs file.
+    chunk_size -- The number of pairs returned at a time.
+
+    Returns:
+    A generator of (n, 2) int32 arrays of song ids, n <= chunk_size. The pairs
+    are sorted and unique across all the chunks.
+    """
+    if chunk_size <= 0:
+        raise ValueError('Invalid chunk size. Must be larger than 0.')
+
+    ## np.memmap can not map an empty file.
+    if os.path.getsize(path) == 0:
+        return
+
+    pairs = np.memmap(path, dtype=PAIR_DTYPE, mode='r').reshape(-1, 2)
+    for start in range(0, len(pairs), chunk_size):
+        yield np.array(pairs[start:start + chunk_size])
+
+
+def iter_packed_pairs(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Same as iter_candidate_pairs, but each chunk is returned as a sorted array
+    of packed pairs (see pack_pairs).
+    """
+    for pairs in iter_candidate_pairs(path, chunk_size):
+        yield pack_pairs(pairs[:, 0], pairs[:, 1])
+
+
+def count_common_pairs(packed_chunks, sorted_packed_pairs):
+    """
+    Counts the pairs that two collections of unique packed pairs have in common,
+    by intersecting sorted arrays. Only the slice of sorted_packed_pairs that
+    overlaps each chunk is read, so it can be memory-mapped.
+
+    Arguments:
+    packed_chunks -- An array of unique packed pairs or an iterable of such
+    arrays, e.g. from iter_packed_pairs. Unsorted chunks are sorted first.
+    sorted_packed_pairs -- A sorted array of unique packed pairs, e.g. a ground
+    truth loaded with song_keys.load_ground_truth.
+
+    Returns:
+    The number of pairs of packed_chunks found in sorted_packed_pairs.
+    """
+    if isinstance(packed_chunks, np.ndarray):
+        packed_chunks = [packed_chunks]
+
+    num_common = 0
+    for chunk in packed_chunks:
+        if len(chunk) == 0:
+            continue
+        if np.any(chunk[1:] < chunk[:-1]):
+            chunk = np.sort(chunk)
+
+        ## Slice of the sorted pairs within the range of this chunk.
+        start, end = np.searchsorted(sorted_packed_pairs, [chunk[0], chunk[-1]], side='left')
+        window = np.asarray(sorted_packed_pairs[start:end + 1])
+        if len(window) == 0:
+            continue
+
+        positions = np.searchsorted(window, chunk)
+        positions[positions == len(window)] = len(window) - 1
+        num_common += np.count_nonzero(window[positions] == chunk)
+
+    return num_common
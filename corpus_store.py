@@ -0,0 +1,315 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Memory-mapped columnar corpus, a replacement for the pickled
+{website|artist|song-name: lyrics} dictionaries.
+
+A corpus is a directory with one UTF-8 text blob and one offsets array per
+column, so it opens in milliseconds and its pages are shared by every process
+that maps it:
+
+    metadata              -- Pickled dictionary with the format version and
+                             the number of songs.
+    <column>.txt          -- The UTF-8 text of every song, concatenated.
+    <column>_offsets.npy  -- (N + 1,) int64 byte offsets of each song in the
+                             text blob.
+
+The columns are website, artist, song and lyrics. Row i of every column is the
+i-th song added to the CorpusWriter, and its key is 'website|artist|song'.
+"""
+
+import os
+import sys
+import mmap
+import pickle
+import numpy as np
+
+FORMAT_VERSION = 1
+METADATA_FILE = 'metadata'
+COLUMNS = ['website', 'artist', 'song', 'lyrics']
+KEY_COLUMNS = ['website', 'artist', 'song']
+TEXT_EXTENSION = '.txt'
+OFFSETS_SUFFIX = '_offsets.npy'
+
+
+def usage():
+    print('./{} pickle_dataset corpus_path'.format(sys.argv[0]))
+
+
+def split_key(key):
+    """
+    Splits a 'website|artist|song' key.
+    """
+    key_split = key.split('|')
+    if len(key_split) != 3:
+        raise ValueError('Invalid key: {}'.format(key))
+    return key_split
+
+
+class CorpusWriter(object):
+    """
+    Streams songs to a new corpus. The metadata is written last, so a corpus
+    is only opened once it is complete.
+
+    Usage:
+        writer = CorpusWriter(path)
+        for key, lyrics in dataset.items():
+            writer.add(key, lyrics)
+        num_songs = writer.close()
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+        path -- The directory of the corpus. Existing files are replaced.
+        """
+        os.makedirs(path, exist_ok=True)
+        metadata_path = os.path.join(path, METADATA_FILE)
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+
+        self.path = path
+        self.num_songs = 0
+        self._files = dict((column, open(os.path.join(path, column + TEXT_EXTENSION), 'wb'))
+                           for column in COLUMNS)
+        self._offsets = dict((column, [0]) for column in COLUMNS)
+
+    def __len__(self):
+        return self.num_songs
+
+    def add(self, key, lyrics):
+        """
+        Adds a song.
+
+        Arguments:
+        key -- The 'website|artist|song' key of the song.
+        lyrics -- The text of the lyric.
+        """
+        for column, text in zip(COLUMNS, split_key(key) + [lyrics]):
+            data = text.encode('utf-8')
+            self._files[column].write(data)
+            self._offsets[column].append(self._offsets[column][-1] + len(data))
+        self.num_songs += 1
+
+    def add_items(self, items):
+        """
+        Adds an iterable of (key, lyrics) tuples, e.g. dataset.items().
+        """
+        for key, lyrics in items:
+            self.add(key, lyrics)
+
+    def close(self):
+        """
+        Writes the offsets and the metadata of the corpus.
+
+        Returns:
+        The number of songs written.
+        """
+        for column in COLUMNS:
+            self._files[column].close()
+            np.save(os.path.join(self.path, column + OFFSETS_SUFFIX),
+                    np.array(self._offsets[column], dtype=np.int64))
+        metadata = {'version': FORMAT_VERSION,
+                    'num_songs': self.num_songs,
+                    'columns': COLUMNS}
+        with open(os.path.join(self.path, METADATA_FILE), 'wb') as metadata_out:
+            pickle.dump(metadata, metadata_out)
+        return self.num_songs
+
+
+class MappedCorpus(object):
+    """
+    Read-only view of a corpus written by CorpusWriter. It behaves like the
+    pickled dictionary it replaces: len, keys, values, items, iteration over
+    the keys, lookup and membership of keys. Songs are also read by row, the
+    order they were added in.
+
+    A MappedCorpus is pickled as its path, so worker processes that receive
+    it map the same pages instead of copying the text.
+
+    Usage:
+        corpus = MappedCorpus(path)
+        for key, lyrics in corpus.items():
+            ...
+        lyrics = corpus.get_lyrics(row)
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+        path -- The directory of the corpus.
+        """
+        metadata_path = os.path.join(path, METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            raise ValueError('Corpus {} not found or incomplete.'.format(path))
+
+        with open(metadata_path, 'rb') as metadata_in:
+            metadata = pickle.load(metadata_in)
+        if metadata['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported corpus version {}.'.format(metadata['version']))
+
+        self.path = path
+        self.num_songs = metadata['num_songs']
+        self.offsets = {}
+        self.blobs = {}
+        for column in COLUMNS:
+            self.offsets[column] = np.load(os.path.join(path, column + OFFSETS_SUFFIX), mmap_mode='r')
+            with open(os.path.join(path, column + TEXT_EXTENSION), 'rb') as text_in:
+                ## Empty files cannot be mapped.
+                if os.fstat(text_in.fileno()).st_size == 0:
+                    self.blobs[column] = b''
+                else:
+                    self.blobs[column] = mmap.mmap(text_in.fileno(), 0, access=mmap.ACCESS_READ)
+        self._rows_by_key = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return self.num_songs
+
+    def get_bytes(self, column, row):
+        """
+        Returns the UTF-8 text of a column of a song as a memoryview of the
+        mapped blob, without copying it.
+        """
+        if row < 0 or row >= self.num_songs:
+            raise IndexError('Invalid row {}.'.format(row))
+        offsets = self.offsets[column]
+        return memoryview(self.blobs[column])[int(offsets[row]):int(offsets[row + 1])]
+
+    def get_text(self, column, row):
+        """
+        Returns the text of a column of a song.
+        """
+        return str(self.get_bytes(column, row), 'utf-8')
+
+    def get_lyrics(self, row):
+        return self.get_text('lyrics', row)
+
+    def get_key(self, row):
+        return '|'.join(self.get_text(column, row) for column in KEY_COLUMNS)
+
+    def get_row(self, key):
+        """
+        Returns the row of a song key. The key index is built on the first
+        call.
+        """
+        if self._rows_by_key is None:
+            self._rows_by_key = dict((song_key, row) for row, song_key in enumerate(self.keys()))
+        return self._rows_by_key[key]
+
+    def keys(self):
+        """
+        Returns a generator of the keys of the songs, in row order.
+        """
+        for row in range(self.num_songs):
+            yield self.get_key(row)
+
+    def values(self):
+        """
+        Returns a generator of the lyrics of the songs, in row order.
+        """
+        for row in range(self.num_songs):
+            yield self.get_lyrics(row)
+
+    def items(self):
+        """
+        Returns a generator of the (key, lyrics) tuples of the songs, in row
+        order.
+        """
+        for row in range(self.num_songs):
+            yield self.get_key(row), self.get_lyrics(row)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, key):
+        return self.get_lyrics(self.get_row(key))
+
+    def __contains__(self, key):
+        try:
+            self.get_row(key)
+        except KeyError:
+            return False
+        return True
+
+
+class CorpusIdView(object):
+    """
+    Maps the song ids of the key dictionary to the lyrics of a corpus, like a
+    list of lyrics indexed by song id, with None for the ids that are not in
+    the corpus. It is pickled without the text, see MappedCorpus.
+    """
+
+    def __init__(self, corpus, key_to_id, num_ids):
+        self.corpus = corpus
+        self.rows_by_id = np.full(num_ids, -1, dtype=np.int64)
+        for row, key in enumerate(corpus.keys()):
+            self.rows_by_id[key_to_id[key]] = row
+
+    def __len__(self):
+        return len(self.rows_by_id)
+
+    def __getitem__(self, song_id):
+        row = self.rows_by_id[song_id]
+        if row < 0:
+            return None
+        return self.corpus.get_lyrics(row)
+
+
+def get_lyrics_by_id(dataset, key_to_id, num_ids):
+    """
+    Returns the lyrics of a dataset indexed by song id: a CorpusIdView for a
+    MappedCorpus, whose text stays mapped, or a list for a dictionary.
+    """
+    if isinstance(dataset, MappedCorpus):
+        return CorpusIdView(dataset, key_to_id, num_ids)
+    lyrics_by_id = [None] * num_ids
+    for key, lyrics in dataset.items():
+        lyrics_by_id[key_to_id[key]] = lyrics
+    return lyrics_by_id
+
+
+def write_corpus(path, dataset):
+    """
+    Writes a {website|artist|song-name: lyrics} dictionary as a corpus.
+
+    Returns:
+    The number of songs written.
+    """
+    writer = CorpusWriter(path)
+    writer.add_items(dataset.items())
+    return writer.close()
+
+
+def load_dataset(path):
+    """
+    Opens a dataset, either a corpus directory or a pickled dictionary.
+
+    Returns:
+    A MappedCorpus or a dictionary, both mapping song keys to lyrics.
+    """
+    if os.path.isdir(path):
+        return MappedCorpus(path)
+    with open(path, 'rb') as dataset_in:
+        return pickle.load(dataset_in)
+
+
+def main():
+    if len(sys.argv) != 3:
+        usage()
+        exit(1)
+
+    with open(sys.argv[1], 'rb') as dataset_in:
+        dataset = pickle.load(dataset_in)
+    num_songs = write_corpus(sys.argv[2], dataset)
+    print('Wrote {} songs to {}.'.format(num_songs, sys.argv[2]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous fetch engine shared by the crawlers.
+
+A crawl is three levels of pages: the listing pages of a website, which link
+to its artists, the page of each artist, which links to its songs, and the
+page of each song, which holds its lyric. A crawler only describes how to
+parse each level with a CrawlSite, and crawl_site fetches the pages:
+
+    * Up to `concurrency` requests are in flight at once, over a pool of
+      keep-alive connections, so the throughput grows with the concurrency
+      instead of being bounded by the round-trip latency of one request.
+    * Each host has a token bucket of `rate` requests per second, with bursts
+      of up to `burst` requests.
+    * Connection errors, timeouts and RETRY_STATUSES are retried up to
+      `max_retries` times, with an exponential backoff.
+
+Artists are crawled by `concurrency` workers, and the songs of an artist are
+fetched concurrently. Each artist is handed to a callback once all its songs
+are fetched, e.g. to append it to a crawl_journal.CrawlJournal, so the crawl
+is never held in memory. An artist with a song that could not be fetched is
+not handed to the callback, so a resumed crawl fetches it again instead of
+losing the song.
+"""
+
+import time
+import random
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+
+DEFAULT_CONCURRENCY = 16
+## Requests per second and burst size of each host. All the requests of a
+## crawl go to the same host, so the rate, not the concurrency, caps its
+## throughput: at 20 requests per second a crawl fetches at most 72000 pages an
+## hour, whatever the concurrency. The default is kept polite for the websites;
+## raise it with the requests_per_second argument of the crawlers when a
+## website allows more.
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = DEFAULT_CONCURRENCY
+DEFAULT_MAX_RETRIES = 3
+## The n-th retry waits BACKOFF_SECONDS * 2^n seconds, plus up to 50% jitter.
+BACKOFF_SECONDS = 1.0
+TIMEOUT_SECONDS = 30
+KEEPALIVE_SECONDS = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CrawlSite(object):
+    """
+    Description of a website: its listing pages and the parsers of each
+    level of pages. The parsers receive the raw bytes of a page.
+
+    Arguments:
+    website_name -- The website column of the songs, e.g. 'vagalume.com.br'.
+    listing_urls -- The URLs of the pages that link to the artists.
+    parse_artists -- Function of a listing page that returns a list of
+    (artist_url, artist_name) tuples, with absolute URLs.
+    parse_songs -- Function of an artist page that returns a list of
+    (song_url, song_name) tuples, with absolute URLs.
+    parse_lyrics -- Function of a song page that returns its lyric. Songs
+    whose parser raises an exception are skipped.
+    skip_artists -- Optional container of the names of the artists that are
+    not crawled, e.g. the crawl_journal.CrawlJournal of a resumed crawl.
+    """
+
+    def __init__(self, website_name, listing_urls, parse_artists, parse_songs, parse_lyrics, skip_artists=()):
+        if not listing_urls:
+            raise ValueError('Invalid list of listing URLs. Must not be empty.')
+        self.website_name = website_name
+        self.listing_urls = listing_urls
+        self.parse_artists = parse_artists
+        self.parse_songs = parse_songs
+        self.parse_lyrics = parse_lyrics
+        self.skip_artists = skip_artists
+
+
+class TokenBucket(object):
+    """
+    Rate limit of `rate` requests per second, with bursts of up to `burst`
+    requests.
+    """
+
+    def __init__(self, rate, burst):
+        if rate <= 0 or burst < 1:
+            raise ValueError('Invalid rate limit. Rate must be positive and burst at least 1.')
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_time = time.monotonic()
+
+    async def acquire(self):
+        """
+        Waits until a request may be sent.
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Fetcher(object):
+    """
+    Fetches pages over a shared aiohttp session, with a bound on the requests
+    in flight, per-host rate limits and retries.
+
+    Usage:
+        async with Fetcher(concurrency=16) as fetcher:
+            html = await fetcher.fetch(url)
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        if concurrency < 1:
+            raise ValueError('Invalid concurrency. Must be at least 1.')
+        if max_retries < 0:
+            raise ValueError('Invalid number of retries. Must be at least 0.')
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.num_requests = 0
+        self.num_retries = 0
+        self._buckets = {}
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=KEEPALIVE_SECONDS,
+                                         ttl_dns_cache=None)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=TIMEOUT_SECONDS))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    def get_bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    async def fetch(self, url):
+        """
+        Returns the body of a page, as bytes.
+
+        Raises the last aiohttp.ClientError or asyncio.TimeoutError once the
+        retries are exhausted, or at once for statuses not in RETRY_STATUSES.
+        """
+        bucket = self.get_bucket(url)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                async with self._semaphore:
+                    self.num_requests += 1
+                    async with self._session.get(url) as response:
+                        response.raise_for_status()
+                        return await response.read()
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+            self.num_retries += 1
+            delay = BACKOFF_SECONDS * (1 << attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            attempt += 1
+
+
+async def crawl_artist(fetcher, site, artist_url, artist_name):
+    """
+    Fetches the page of an artist and of all its songs.
+
+    Returns:
+    A list of (song_name, lyrics) tuples, in the order of the artist page.
+    Songs whose lyrics cannot be parsed are skipped. Raises ValueError if a
+    song page cannot be fetched, once the other songs are done.
+    """
+    songs = site.parse_songs(await fetcher.fetch(artist_url))
+    song_pages = await asyncio.gather(*[fetcher.fetch(song_url) for song_url, _ in songs],
+                                      return_exceptions=True)
+
+    artist_songs = []
+    num_failed_songs = 0
+    for (song_url, song_name), song_html in zip(songs, song_pages):
+        if isinstance(song_html, Exception):
+            print('\tError reading song {}: {}'.format(song_url, song_html))
+            num_failed_songs += 1
+            continue
+        try:
+            artist_songs.append((song_name, site.parse_lyrics(song_html)))
+        except Exception as e:
+            print('\tError parsing song {}: {}'.format(song_url, e))
+    if num_failed_songs:
+        raise ValueError('{} of {} songs could not be fetched.'.format(num_failed_songs, len(songs)))
+    return artist_songs
+
+
+async def crawl_site_async(site, save_artist_lyrics, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE,
+                           burst=DEFAULT_BURST, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Coroutine of crawl_site.
+    """
+    async with Fetcher(concurrency, rate, burst, max_retries) as fetcher:
+        ## A listing page that cannot be fetched or parsed only loses its own
+        ## artists, a resumed crawl fetches it again.
+        listing_pages = await asyncio.gather(*[fetcher.fetch(url) for url in site.listing_urls],
+                                             return_exceptions=True)
+        artists = []
+        num_failed_listings = 0
+        for listing_url, listing_html in zip(site.listing_urls, listing_pages):
+            try:
+                if isinstance(listing_html, Exception):
+                    raise listing_html
+                artists.extend(site.parse_artists(listing_html))
+            except Exception as e:
+                print('Error reading listing page {}: {}'.format(listing_url, e))
+                num_failed_listings += 1
+        num_listed_artists = len(artists)
+        artists = [artist for artist in artists if artist[1] not in site.skip_artists]
+        if len(artists) < num_listed_artists:
+            print('Skipping {} artists already crawled.'.format(num_listed_artists - len(artists)))
+
+        queue = asyncio.Queue()
+        for artist in artists:
+            queue.put_nowait(artist)
+        num_songs = 0
+        num_failed_artists = 0
+
+        async def artist_worker():
+            nonlocal num_songs, num_failed_artists
+            while not queue.empty():
+                artist_url, artist_name = queue.get_nowait()
+                try:
+                    artist_songs = await crawl_artist(fetcher, site, artist_url, artist_name)
+                except Exception as e:
+                    print('Error reading artist {}: {}'.format(artist_name, e))
+                    num_failed_artists += 1
+                    continue
+                print(artist_name)
+                for song_name, _ in artist_songs:
+                    print('\t' + song_name)
+                save_artist_lyrics(site.website_name, artist_name, [lyrics for _, lyrics in artist_songs],
+                                   [song_name for song_name, _ in artist_songs])
+                num_songs += len(artist_songs)
+
+        start_time = time.time()
+        await asyncio.gather(*[artist_worker() for _ in range(min(concurrency, len(artists)))])
+        crawl_time = time.time() - start_time
+        print('{}: {} artists, {} songs, {} requests ({} retries) in {:.1f}s, at most {} requests per '
+              'second.'.format(site.website_name, len(artists), num_songs, fetcher.num_requests,
+                               fetcher.num_retries, crawl_time, rate))
+        if num_failed_listings:
+            print('{} of {} listing pages failed.'.format(num_failed_listings, len(site.listing_urls)))
+        if num_failed_artists:
+            print('{} artists were not saved, a resumed crawl fetches them again.'.format(num_failed_artists))
+    return num_songs
+
+
+def crawl_site(site, save_artist_lyrics, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+               max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Crawls a website.
+
+    Arguments:
+    site -- The CrawlSite of the website.
+    save_artist_lyrics -- Function called with (website_name, artist_name,
+    artist_lyrics, artist_lyrics_names) once all the songs of an artist are
+    fetched. It is not called for artists with a song that failed.
+    concurrency -- The maximum number of requests in flight, and of artists
+    crawled at once.
+    rate, burst -- The token bucket of each host, see TokenBucket.
+    max_retries -- The number of retries of a failed request.
+
+    Returns:
+    The number of songs crawled.
+    """
+    return asyncio.run(crawl_site_async(site, save_artist_lyrics, concurrency, rate, burst, max_retries))
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Append-only journal of a crawl.
+
+The crawlers append one record per artist to the journal as soon as its songs
+are fetched, instead of keeping the whole crawl in memory until it ends. A
+record is a pickled (website_name, artist_name, [(song_name, lyrics), ...])
+tuple, flushed to disk before the next one is written, so a crash loses at
+most the artists being crawled. When a journal is reopened, a record cut
+short by a crash is truncated and the artists of the complete records are
+skipped by the crawl, which resumes where it stopped. The crawl engine only
+journals an artist once all its song pages were fetched, so the artists with
+failed songs are crawled again.
+
+Once a crawl ends, compact_journal turns its journal into the pickled list of
+(website_name, artist_name, song_name, lyrics) tuples read by
+remove_lyrics_with_numeric_names_and_repeated_lyrics.
+"""
+
+import os
+import sys
+import pickle
+
+
+def usage():
+    print('./{} journal_path output_pickle'.format(sys.argv[0]))
+
+
+def iter_journal_records(path):
+    """
+    Returns a generator of the (end_offset, record) tuples of the complete
+    records of a journal. It stops at the first incomplete record.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as journal_in:
+        while True:
+            try:
+                record = pickle.load(journal_in)
+            except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                return
+            yield journal_in.tell(), record
+
+
+class CrawlJournal(object):
+    """
+    Append-only journal of the artists of a crawl. Only the names of the
+    journaled artists are kept in memory.
+
+    Usage:
+        journal = CrawlJournal(path)
+        if artist_name not in journal:
+            journal.add_artist(website_name, artist_name, artist_lyrics, artist_lyrics_names)
+        journal.close()
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+        path -- The journal file. An existing journal is resumed.
+        """
+        self.path = path
+        self.artists = set()
+        self.num_songs = 0
+        end_offset = 0
+        for end_offset, (_, artist_name, songs) in iter_journal_records(path):
+            self.artists.add(artist_name)
+            self.num_songs += len(songs)
+
+        if os.path.exists(path) and os.path.getsize(path) > end_offset:
+            print('Truncating incomplete record at the end of journal {}.'.format(path))
+            with open(path, 'r+b') as journal_out:
+                journal_out.truncate(end_offset)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'ab')
+
+    def __len__(self):
+        return len(self.artists)
+
+    def __contains__(self, artist_name):
+        return artist_name in self.artists
+
+    def add_artist(self, website_name, artist_name, artist_lyrics, artist_lyrics_names):
+        """
+        Appends the songs of an artist to the journal. Same arguments as the
+        save_artist_lyrics functions of the crawlers.
+        """
+        songs = list(zip(artist_lyrics_names, artist_lyrics))
+        pickle.dump((website_name, artist_name, songs), self._file)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.artists.add(artist_name)
+        self.num_songs += len(songs)
+
+    def close(self):
+        self._file.close()
+
+
+def compact_journal(journal_path, output_path):
+    """
+    Writes the songs of a journal as a pickled list of (website_name,
+    artist_name, song_name, lyrics) tuples, the output format of the
+    crawlers. An artist journaled more than once keeps its last record.
+
+    Returns:
+    The number of songs written.
+    """
+    records = {}
+    for _, (website_name, artist_name, songs) in iter_journal_records(journal_path):
+        records[(website_name, artist_name)] = songs
+
+    lyrics = [(website_name, artist_name, song_name, song_lyrics)
+              for (website_name, artist_name), songs in records.items()
+              for song_name, song_lyrics in songs]
+    with open(output_path, 'wb') as output_file:
+        pickle.dump(lyrics, output_file)
+    return len(lyrics)
+
+
+def main():
+    if len(sys.argv) != 3:
+        usage()
+        exit(1)
+
+    num_songs = compact_journal(sys.argv[1], sys.argv[2])
+    print('Wrote {} songs to {}.'.format(num_songs, sys.argv[2]))
+
+
+if __name__ == '__main__':
+    main()
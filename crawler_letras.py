@@ -2,105 +2,66 @@
 # -*- coding: utf-8 -*-
 
 
-import pickle
-import urllib
+import sys
 
-from bs4 import BeautifulSoup
+from crawl_engine import CrawlSite, crawl_site, DEFAULT_CONCURRENCY, DEFAULT_RATE
+from lyrics_extraction import SITE_RULES, extract_links, extract_texts
+from crawl_journal import CrawlJournal, compact_journal
 
 
-LYRICS = []
 OUTPUT_PICKLE_PATH = 'lyrics_pickle_output_letras'
+JOURNAL_PATH = 'lyrics_journal_letras'
+WEBSITE_NAME = 'letras.mus.br'
+RULES = SITE_RULES[WEBSITE_NAME]
+BASE_URL = 'https://www.letras.mus.br'
+START_URL = 'https://www.letras.mus.br/letra/A/artistas.html'
 
 
-def save_artist_lyrics(website_name, artist_name, artist_lyrics, artist_lyrics_names):
-    for lyrics_name, lyrics in zip(artist_lyrics_names, artist_lyrics):
-        LYRICS.append((website_name, artist_name, lyrics_name, lyrics))
-
-
-def crawl_letras():
-    def get_artists_URLs(home_html):
-        def is_artist(tag):
-            try:
-                return (tag.name == "a"
-                        and tag.parent.name == "li"
-                        and tag.parent.parent.name == "ul"
-                        and "cnt-list" in tag.parent.parent["class"]
-                        and tag.parent.parent.parent.name == "div"
-                        and "artistas-a" in tag.parent.parent.parent["class"])
-            except:
-                return False
-
-        ret = []
-        soup = BeautifulSoup(home_html, 'html.parser')
-        artists_a_tag_list = soup.find_all(is_artist)
-        for artist_a_tag in artists_a_tag_list:
-            ret.append(artist_a_tag["href"])
-        return ret
-
-    def get_songs_URLs(artist_html):
-        def is_song(tag):
-            try:
-                return (tag.name == "a"
-                        and tag.parent.name == "li"
-                        and tag.parent.parent.name == "ul"
-                        and "cnt-list" in tag.parent.parent["class"]
-                        and tag.parent.parent.parent.name == "div"
-                        and "cnt-list--alp" in tag.parent.parent.parent["class"])
-            except:
-                return False
-
-        ret = []
-        soup = BeautifulSoup(artist_html, 'html.parser')
-        songs_a_tag_list = soup.find_all(is_song)
-        for song_a_tag in songs_a_tag_list:
-            ret.append(song_a_tag["href"])
-        return ret
-
-    def get_lyrics(lyrics_html):
-        def is_lyrics(tag):
-            try:
-                return (tag.name == "p"
-                        and tag.parent.name == "article"
-                        and tag.parent.parent.name == "div"
-                        and "cnt-letra" in tag.parent.parent["class"])
-            except:
-                return False
-
-        ret = []
-        soup = BeautifulSoup(lyrics_html, 'html.parser')
-        lyrics_tags = soup.find_all(is_lyrics)
-        for p_tag in lyrics_tags:
-            string_inside = str(p_tag).lstrip('<p>').rstrip('</p>')
-            clean_string_inside = '\n'.join(string_inside.split('<br/>'))
-            ret.append(clean_string_inside)
-        return '\n'.join(ret)
-    
-    website_name = 'letras.mus.br'
-    base_url = 'https://www.letras.mus.br'
-    start_url = 'https://www.letras.mus.br/letra/A/artistas.html'
-
-    home_html = urllib.request.urlopen(start_url).read()
-    artists_URLs = get_artists_URLs(home_html)
-    for artist_URL in artists_URLs:
-        artist_name = artist_URL.rstrip('/')
-        artist_lyrics_names = []
-        artist_lyrics = []
-        artist_full_URL = base_url + artist_URL
-        artist_html = urllib.request.urlopen(artist_full_URL).read()
-        songs_URLs = get_songs_URLs(artist_html)
-        print(artist_name[1:])
-        for song_URL in songs_URLs:
-            song_name = song_URL.split('/')[-2]
-            song_html = urllib.request.urlopen(base_url + song_URL).read()
-            artist_lyrics.append(get_lyrics(song_html))
-            artist_lyrics_names.append(song_name)
-            print('\t'+song_name)
+def usage():
+    print('./{} [concurrency] [requests_per_second]'.format(sys.argv[0]))
+
+
+def get_artists_URLs(home_html):
+    ret = []
+    for artist_URL, _ in extract_links(home_html, RULES['artists']):
         # Let's remove the leadind '/' in the artist name.
-        save_artist_lyrics(website_name, artist_name[1:], artist_lyrics, artist_lyrics_names)
+        ret.append((BASE_URL + artist_URL, artist_URL.rstrip('/')[1:]))
+    return ret
 
 
-if __name__ == '__main__':
+def get_songs_URLs(artist_html):
+    ret = []
+    for song_URL, _ in extract_links(artist_html, RULES['songs']):
+        ret.append((BASE_URL + song_URL, song_URL.split('/')[-2]))
+    return ret
+
+
+def get_lyrics(lyrics_html):
+    return '\n'.join(extract_texts(lyrics_html, RULES['lyrics']))
+
+
+def crawl_letras(journal, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE):
+    site = CrawlSite(WEBSITE_NAME, [START_URL], get_artists_URLs, get_songs_URLs, get_lyrics, skip_artists=journal)
+    return crawl_site(site, journal.add_artist, concurrency=concurrency, rate=rate)
+
+
+def main():
+    if len(sys.argv) > 3:
+        usage()
+        exit(1)
+
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CONCURRENCY
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RATE
+    ## Artists already in the journal are skipped, so an interrupted crawl
+    ## resumes where it stopped.
+    journal = CrawlJournal(JOURNAL_PATH)
     try:
-        crawl_letras()
+        crawl_letras(journal, concurrency, rate)
     finally:
-        pickle.dump(LYRICS, open(OUTPUT_PICKLE_PATH, 'wb'))
+        journal.close()
+        num_songs = compact_journal(JOURNAL_PATH, OUTPUT_PICKLE_PATH)
+        print('Wrote {} songs to {}.'.format(num_songs, OUTPUT_PICKLE_PATH))
+
+
+if __name__ == '__main__':
+    main()
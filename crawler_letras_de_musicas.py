@@ -2,102 +2,70 @@
 # -*- coding: utf-8 -*-
 
 
-import pickle
-import urllib
+import sys
 
-from bs4 import BeautifulSoup
+from crawl_engine import CrawlSite, crawl_site, DEFAULT_CONCURRENCY, DEFAULT_RATE
+from lyrics_extraction import SITE_RULES, extract_links, extract_texts
+from crawl_journal import CrawlJournal, compact_journal
 
 
-LYRICS = []
 OUTPUT_PICKLE_PATH = 'lyrics_pickle_output_letras_de_musicas'
+JOURNAL_PATH = 'lyrics_journal_letras_de_musicas'
+WEBSITE_NAME = 'letrasdemusicas.com.br'
+RULES = SITE_RULES[WEBSITE_NAME]
+BASE_URL = 'http://www.letrasdemusicas.com.br'
+START_URL = 'http://www.letrasdemusicas.com.br/listagemartistas/a/'
+NUM_LISTING_PAGES = 106
 
 
-def save_artist_lyrics(website_name, artist_name, artist_lyrics, artist_lyrics_names):
-    for lyrics_name, lyrics in zip(artist_lyrics_names, artist_lyrics):
-        LYRICS.append((website_name, artist_name, lyrics_name, lyrics))
-
-
-def crawl_letras():
-    def get_artists_URLs(home_html):
-        def is_artist(tag):
-            try:
-                return (tag.name == "a"
-                        and tag.parent.name == "li"
-                        and tag.parent.parent.name == "ol"
-                        and tag.parent.parent.parent.name == "div"
-                        and "lst1" in tag.parent.parent.parent["class"])
-            except:
-                return False
-
-        ret = []
-        soup = BeautifulSoup(home_html, 'html.parser')
-        artists_a_tag_list = soup.find_all(is_artist)
-        for artist_a_tag in artists_a_tag_list:
-            ret.append(artist_a_tag["href"])
-        return ret
-
-    def get_songs_URLs(artist_html):
-        def is_song(tag):
-            try:
-                return (tag.name == "a"
-                        and tag.parent.name == "li"
-                        and tag.parent.parent.name == "ol"
-                        and tag.parent.parent.parent.name == "div"
-                        and "lst1" in tag.parent.parent.parent["class"])
-            except:
-                return False
-
-        ret = []
-        soup = BeautifulSoup(artist_html, 'html.parser')
-        songs_a_tag_list = soup.find_all(is_song)
-        for song_a_tag in songs_a_tag_list:
-            ret.append(song_a_tag["href"])
-        return ret
-
-    def get_lyrics(lyrics_html):
-        def is_lyrics(tag):
-            try:
-                return tag.name == "p" and "pumSum" in tag["class"]
-            except:
-                return False
-
-        soup = BeautifulSoup(lyrics_html, 'html.parser')
-        lyrics_tags = soup.find_all(is_lyrics)
-        try:
-            string_inside = str(lyrics_tags[0])
-        except IndexError:
-            return ''
-        string_inside = string_inside[string_inside.find(">") + 1: string_inside.rfind('</')]
-        clean_string_inside = '\n'.join(string_inside.split('<br/>'))
-        return clean_string_inside
-
-    website_name = 'letrasdemusicas.com.br'
-    base_url = 'http://www.letrasdemusicas.com.br'
-    start_url = 'http://www.letrasdemusicas.com.br/listagemartistas/a/'
-
-    for page_num in range(1, 107):
-        page = start_url + str(page_num) + '.html'
-        home_html = urllib.request.urlopen(page).read()
-        artists_URLs = get_artists_URLs(home_html)
-        for artist_URL in artists_URLs:
-            artist_name = artist_URL.strip('/')
-            artist_lyrics_names = []
-            artist_lyrics = []
-            artist_full_URL = base_url + artist_URL + "maisletras/"
-            artist_html = urllib.request.urlopen(artist_full_URL).read()
-            songs_URLs = get_songs_URLs(artist_html)
-            print(artist_name)
-            for song_URL in songs_URLs:
-                song_name = song_URL.split('/')[-2]
-                song_html = urllib.request.urlopen(base_url + song_URL).read()
-                artist_lyrics.append(get_lyrics(song_html))
-                artist_lyrics_names.append(song_name)
-                print('\t'+song_name)
-            save_artist_lyrics(website_name, artist_name, artist_lyrics, artist_lyrics_names)
+def usage():
+    print('./{} [concurrency] [requests_per_second]'.format(sys.argv[0]))
 
 
-if __name__ == '__main__':
+def get_artists_URLs(home_html):
+    ret = []
+    for artist_URL, _ in extract_links(home_html, RULES['artists']):
+        ret.append((BASE_URL + artist_URL + "maisletras/", artist_URL.strip('/')))
+    return ret
+
+
+def get_songs_URLs(artist_html):
+    ret = []
+    for song_URL, _ in extract_links(artist_html, RULES['songs']):
+        ret.append((BASE_URL + song_URL, song_URL.split('/')[-2]))
+    return ret
+
+
+def get_lyrics(lyrics_html):
+    lyrics_texts = extract_texts(lyrics_html, RULES['lyrics'])
+    if not lyrics_texts:
+        return ''
+    return lyrics_texts[0]
+
+
+def crawl_letras(journal, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE):
+    listing_urls = [START_URL + str(page_num) + '.html' for page_num in range(1, NUM_LISTING_PAGES + 1)]
+    site = CrawlSite(WEBSITE_NAME, listing_urls, get_artists_URLs, get_songs_URLs, get_lyrics, skip_artists=journal)
+    return crawl_site(site, journal.add_artist, concurrency=concurrency, rate=rate)
+
+
+def main():
+    if len(sys.argv) > 3:
+        usage()
+        exit(1)
+
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CONCURRENCY
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RATE
+    ## Artists already in the journal are skipped, so an interrupted crawl
+    ## resumes where it stopped.
+    journal = CrawlJournal(JOURNAL_PATH)
     try:
-        crawl_letras()
+        crawl_letras(journal, concurrency, rate)
     finally:
-        pickle.dump(LYRICS, open(OUTPUT_PICKLE_PATH, 'wb'))
+        journal.close()
+        num_songs = compact_journal(JOURNAL_PATH, OUTPUT_PICKLE_PATH)
+        print('Wrote {} songs to {}.'.format(num_songs, OUTPUT_PICKLE_PATH))
+
+
+if __name__ == '__main__':
+    main()
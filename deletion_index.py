@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Deletion-neighborhood index for finding pairs of short strings within edit
+distance 1 without comparing every pair.
+
+If two strings are within edit distance 1, then deleting at most one character
+from each of them produces a common string. Indexing every string under all of
+its one-deletion variants therefore puts each such pair in at least one common
+bucket. The buckets also contain some pairs at distance 2 (e.g. two
+substitutions at neighbouring positions), so candidates must still be verified.
+"""
+
+from collections import defaultdict
+
+VAGALUME_WEBSITE_NAME = 'vagalume.com.br'
+TRANSLATION_SUFFIX = ' traducao'
+
+
+def deletion_variants(input_str):
+    """
+    Returns the set with the string itself and every string obtained by
+    deleting one of its characters.
+    """
+    variants = {input_str}
+    for i in range(len(input_str)):
+        variants.add(input_str[:i] + input_str[i+1:])
+    return variants
+
+
+def build_deletion_index(strings):
+    """
+    Indexes a list of strings by their deletion variants.
+
+    Arguments:
+    strings -- A list of (string, item) tuples. The same item may be indexed
+    under several strings.
+
+    Returns:
+    A dictionary mapping each variant to the list of items indexed under it.
+    An item appears at most once per variant.
+    """
+    index = defaultdict(list)
+    for input_str, item in strings:
+        for variant in deletion_variants(input_str):
+            bucket = index[variant]
+            if not bucket or bucket[-1] != item:
+                bucket.append(item)
+    return index
+
+
+def iter_candidate_pairs(index):
+    """
+    Returns a generator of the (item1, item2) pairs, item1 < item2, that share
+    a bucket of a deletion index. Pairs are not repeated, even if they share
+    several buckets.
+    """
+    seen = set()
+    for bucket in index.values():
+        if len(bucket) < 2:
+            continue
+        bucket = sorted(set(bucket))
+        for idx, item1 in enumerate(bucket):
+            for item2 in bucket[idx+1:]:
+                if (item1, item2) not in seen:
+                    seen.add((item1, item2))
+                    yield item1, item2
+
+
+def split_key(key):
+    """
+    Splits a 'website|artist|song' key.
+    """
+    key_split = key.split('|')
+    if len(key_split) != 3:
+        raise ValueError('Invalid key: {}'.format(key))
+    return key_split
+
+
+def get_title_variants(website_name, song_name):
+    """
+    Returns the song names a song is indexed under: its name and, for vagalume
+    songs ending in ' traducao', the name without that suffix, which is how
+    check_match pairs translations with the original song.
+    """
+    titles = [song_name]
+    if website_name == VAGALUME_WEBSITE_NAME and song_name.endswith(TRANSLATION_SUFFIX):
+        titles.append(song_name[:-len(TRANSLATION_SUFFIX)])
+    return titles
+
+
+def generate_matches(keys):
+    """
+    Same as build_ground_truth_sets.generate_matches, without comparing every
+    pair of keys.
+
+    Artist names are indexed by their deletion variants to find the pairs of
+    artists within edit distance 1. For each such pair, the song names of one
+    artist are indexed and looked up with the variants of the song names of the
+    other. Only the pairs of songs found this way are verified with check_match.
+
+    Arguments:
+    keys -- A list of 'website|artist|song' keys.
+
+    Returns:
+    The number of matches and a set containing tuples of songs that matched, in
+    both orientations.
+    """
+    from build_ground_truth_sets import check_match
+
+    if not keys or len(keys) == 0:
+        raise ValueError('Invalid list of keys')
+
+    ## Songs grouped by artist. Empty names never match, check_match fails
+    ## when comparing them.
+    songs_by_artist = defaultdict(list)
+    for song_idx, key in enumerate(keys):
+        website_name, artist_name, song_name = split_key(key)
+        if artist_name and song_name:
+            songs_by_artist[artist_name].append((song_idx, website_name, song_name))
+
+    artist_names = list(songs_by_artist.keys())
+    artist_index = build_deletion_index((artist_name, artist_idx)
+                                        for artist_idx, artist_name in enumerate(artist_names))
+    artist_neighbors = defaultdict(list)
+    for artist1, artist2 in iter_candidate_pairs(artist_index):
+        artist_neighbors[artist1].append(artist2)
+    del artist_index
+
+    match_count = 0
+    match_set = set()
+
+    def add_if_match(song1_idx, song2_idx):
+        key1, key2 = keys[song1_idx], keys[song2_idx]
+        if check_match(key1, key2):
+            match_set.add((key1, key2))
+            match_set.add((key2, key1))
+            return 1
+        return 0
+
+    for artist_idx, artist_name in enumerate(artist_names):
+        songs = songs_by_artist[artist_name]
+        title_index = build_deletion_index((title, song_idx)
+                                           for song_idx, website_name, song_name in songs
+                                           for title in get_title_variants(website_name, song_name))
+
+        ## Songs of the same artist.
+        for song1_idx, song2_idx in iter_candidate_pairs(title_index):
+            match_count += add_if_match(song1_idx, song2_idx)
+
+        ## Songs of the artists within edit distance 1.
+        for neighbor_idx in artist_neighbors[artist_idx]:
+            candidates = set()
+            for song2_idx, website_name, song_name in songs_by_artist[artist_names[neighbor_idx]]:
+                for title in get_title_variants(website_name, song_name):
+                    for variant in deletion_variants(title):
+                        for song1_idx in title_index.get(variant, ()):
+                            candidates.add((song1_idx, song2_idx))
+            for song1_idx, song2_idx in candidates:
+                match_count += add_if_match(song1_idx, song2_idx)
+
+    return match_count, match_set
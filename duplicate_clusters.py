@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Groups duplicate songs into clusters, the connected components of the graph of
+candidate pairs, ground truth matches or bucket members.
+
+k copies of a song produce k * (k - 1) / 2 pairs but a single cluster. The
+components are found with an array-backed union-find: every song has a parent
+id, edges hook the larger of their two roots to the smaller one, and pointer
+jumping flattens the trees, all with NumPy operations over a chunk of edges
+at a time. Memory is linear in the number of songs, and the edges can be
+streamed.
+
+A clustering is saved as two .npy arrays:
+
+    <prefix>_cluster_ids.npy      -- (num_ids,) int32 cluster of each song id.
+    <prefix>_representatives.npy  -- (num_clusters,) int32 song id of the
+                                     representative of each cluster, its
+                                     smallest song id.
+
+Songs without duplicates are clusters of their own.
+"""
+
+import sys
+import pickle
+import numpy as np
+from build_hash_index import PAIRS_EXTENSION, CLUSTERS_EXTENSION
+from candidate_pairs import iter_candidate_pairs, unpack_pairs
+from song_keys import load_key_dictionary, load_ground_truth
+
+CLUSTER_IDS_SUFFIX = '_cluster_ids.npy'
+REPRESENTATIVES_SUFFIX = '_representatives.npy'
+## Number of edges processed at once.
+CHUNK_SIZE = 1 << 20
+
+
+def usage():
+    print('./{} pairs_or_ground_truth_or_clusters_file output_prefix'.format(sys.argv[0]))
+
+
+def make_parents(num_ids):
+    """
+    Returns the parent array of num_ids songs that are not linked yet.
+    """
+    if num_ids <= 0:
+        raise ValueError('Invalid number of ids. Must be larger than 0.')
+    return np.arange(num_ids, dtype=np.int64)
+
+
+def compress(parents):
+    """
+    Pointer jumping: replaces every parent by its root, in place.
+    """
+    while True:
+        grandparents = parents[parents]
+        if np.array_equal(grandparents, parents):
+            return parents
+        parents[:] = grandparents
+
+
+def union_pairs(parents, first_ids, second_ids):
+    """
+    Links the songs of a chunk of pairs.
+
+    Arguments:
+    parents -- The parent array, updated in place. Its trees must be flat
+    (every parent is a root), as make_parents and union_pairs leave them.
+    first_ids, second_ids -- Arrays with the song ids of each pair.
+    """
+    first_ids = np.asarray(first_ids, dtype=np.int64)
+    second_ids = np.asarray(second_ids, dtype=np.int64)
+    while len(first_ids):
+        first_roots = parents[first_ids]
+        second_roots = parents[second_ids]
+        is_split = first_roots != second_roots
+        if not np.any(is_split):
+            return
+        first_ids, second_ids = first_ids[is_split], second_ids[is_split]
+        first_roots, second_roots = first_roots[is_split], second_roots[is_split]
+
+        ## Hooking: the larger root points to the smallest root it is linked
+        ## to. Roots only decrease, so no cycle can be created.
+        np.minimum.at(parents, np.maximum(first_roots, second_roots),
+                      np.minimum(first_roots, second_roots))
+        compress(parents)
+
+
+def union_buckets(parents, buckets):
+    """
+    Links the songs of each bucket, with one edge per member to the first
+    member of the bucket instead of one edge per pair.
+
+    Arguments:
+    parents -- The parent array, updated in place.
+    buckets -- An iterable of lists of song ids, e.g. from
+    build_hash_index.get_possible_duplicates.
+    """
+    first_ids = []
+    second_ids = []
+    num_edges = 0
+    for bucket in buckets:
+        bucket = np.asarray(bucket, dtype=np.int64)
+        if len(bucket) < 2:
+            continue
+        first_ids.append(np.repeat(bucket[0], len(bucket) - 1))
+        second_ids.append(bucket[1:])
+        num_edges += len(bucket) - 1
+        if num_edges >= CHUNK_SIZE:
+            union_pairs(parents, np.concatenate(first_ids), np.concatenate(second_ids))
+            first_ids, second_ids, num_edges = [], [], 0
+    if first_ids:
+        union_pairs(parents, np.concatenate(first_ids), np.concatenate(second_ids))
+
+
+def get_clusters(parents):
+    """
+    Numbers the components of a parent array.
+
+    Returns:
+    An int32 array with the cluster of each song, and an int32 array with the
+    representative of each cluster, its smallest song id. Clusters are
+    numbered in the order of their representatives.
+    """
+    roots = compress(parents.copy())
+    representatives, cluster_ids = np.unique(roots, return_inverse=True)
+    return cluster_ids.astype(np.int32), representatives.astype(np.int32)
+
+
+def iter_clusters(cluster_ids, min_size=2):
+    """
+    Returns a generator of the song ids of each cluster with at least min_size
+    songs, so consumers can work on clusters without expanding them to pairs.
+    """
+    order = np.argsort(cluster_ids, kind='stable')
+    sorted_ids = cluster_ids[order]
+    bounds = np.concatenate(([0], np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1, [len(order)]))
+    for cluster in np.flatnonzero(np.diff(bounds) >= min_size):
+        yield order[bounds[cluster]:bounds[cluster + 1]].astype(np.int32)
+
+
+def cluster_candidate_pairs(pairs_path, num_ids):
+    """
+    Clusters the pairs of a candidate pairs file, reading it in chunks.
+    """
+    parents = make_parents(num_ids)
+    for pairs in iter_candidate_pairs(pairs_path, CHUNK_SIZE):
+        union_pairs(parents, pairs[:, 0], pairs[:, 1])
+    return get_clusters(parents)
+
+
+def cluster_packed_pairs(packed_pairs, num_ids):
+    """
+    Clusters an array of packed pairs, e.g. a ground truth loaded with
+    song_keys.load_ground_truth.
+    """
+    parents = make_parents(num_ids)
+    for start in range(0, len(packed_pairs), CHUNK_SIZE):
+        pairs = unpack_pairs(packed_pairs[start:start + CHUNK_SIZE])
+        union_pairs(parents, pairs[:, 0], pairs[:, 1])
+    return get_clusters(parents)
+
+
+def save_clusters(output_prefix, cluster_ids, representatives):
+    """
+    Saves a clustering returned by get_clusters.
+    """
+    np.save(output_prefix + CLUSTER_IDS_SUFFIX, cluster_ids)
+    np.save(output_prefix + REPRESENTATIVES_SUFFIX, representatives)
+
+
+def load_clusters(output_prefix, mmap_mode=None):
+    """
+    Loads a clustering saved by save_clusters.
+
+    Returns:
+    The cluster of each song id and the representative of each cluster.
+    """
+    return (np.load(output_prefix + CLUSTER_IDS_SUFFIX, mmap_mode=mmap_mode),
+            np.load(output_prefix + REPRESENTATIVES_SUFFIX, mmap_mode=mmap_mode))
+
+
+def main():
+    if len(sys.argv) != 3:
+        usage()
+        exit(1)
+
+    input_path = sys.argv[1]
+    output_prefix = sys.argv[2]
+    id_to_key, key_to_id = load_key_dictionary()
+
+    if input_path.endswith(PAIRS_EXTENSION):
+        cluster_ids, representatives = cluster_candidate_pairs(input_path, len(id_to_key))
+    elif input_path.endswith(CLUSTERS_EXTENSION):
+        with open(input_path, 'rb') as clusters_in:
+            buckets = pickle.load(clusters_in)
+        parents = make_parents(len(id_to_key))
+        union_buckets(parents, buckets)
+        cluster_ids, representatives = get_clusters(parents)
+    else:
+        ground_truth = load_ground_truth(input_path, key_to_id, mmap_mode='r')
+        cluster_ids, representatives = cluster_packed_pairs(ground_truth, len(id_to_key))
+
+    save_clusters(output_prefix, cluster_ids, representatives)
+
+    sizes = np.bincount(cluster_ids)
+    print('{} songs in {} clusters, {} with duplicates, largest with {} songs.'.format(
+        len(cluster_ids), len(representatives), np.count_nonzero(sizes > 1), sizes.max()))
+
+
+if __name__ == '__main__':
+    main()
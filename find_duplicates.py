@@ -4,11 +4,20 @@
 import os
 import pickle
 import itertools
+import editdistance
+import numpy as np
 from datasketch import MinHash, MinHashLSH
+from candidate_pairs import iter_packed_pairs, count_candidate_pairs, count_common_pairs
+from build_hash_index import PAIRS_EXTENSION
+from song_keys import load_key_dictionary, load_ground_truth
 
 TRAIN_GT_FILE = os.path.join('out', 'train_set_ground_truth_pickle')
 TRAIN_LSH_PATH = os.path.join('out', 'lsh_trainset_tests')
 OUTPUT_BENCHMARK_FILE = os.path.join('out', 'train_lsh_parameters.csv')
+FOREST_BENCHMARK_FILE = os.path.join('out', 'train_forest_lsh_parameters.csv')
+## editdistance.eval_criterion stops as soon as the distance is over the
+## threshold. It is missing from old versions of editdistance.
+HAS_EVAL_CRITERION = hasattr(editdistance, 'eval_criterion')
 
 def build_lsh_keypair_set(lsh_index_list):
     '''
@@ -39,8 +48,11 @@ def get_lsh_parameters(lsh_filename):
     if not lsh_filename or len(lsh_filename) == 0:
         raise ValueError('Invalid LSH filename')
 
+    if lsh_filename.endswith(PAIRS_EXTENSION):
+        lsh_filename = lsh_filename[:-len(PAIRS_EXTENSION)]
     first_split = lsh_filename.split('_')
-    if len(first_split) != 5:
+    ## Files of LSH Forest indexes have a sixth 'maxbucket-N' parameter.
+    if len(first_split) not in (5, 6):
         raise ValueError('')
 
     param_dict = {}
@@ -53,54 +65,202 @@ def get_lsh_parameters(lsh_filename):
 
 def calc_precision_recall(lsh_filename, ground_truth):
     '''
-    Given the filename of the LSH index in the filesystem and a ground truth
-    set, this function calculates the precision and recall statistics for the
-    duplicates indicated by the LSH index.
+    Given the filename of the LSH candidate pairs in the filesystem and a ground
+    truth set, this function calculates the precision and recall statistics for
+    the duplicates indicated by the LSH index. The candidate pairs are read
+    lazily, one chunk at a time, and intersected with the ground truth as
+    sorted arrays of packed pairs.
 
     Arguments:
-    lsh_filename -- The full path to the LSH index file.
-    ground_truth -- A set in the form (key1, key2), (key2, key1), ... containing
-    the actual duplicates.
+    lsh_filename -- The full path to the candidate pairs file written by
+    build_hash_index.dump_possible_duplicates.
+    ground_truth -- A sorted array of packed pairs of song ids containing the
+    actual duplicates, as returned by song_keys.load_ground_truth. It may be
+    memory-mapped.
 
     Returns:
     Two floating point numbers, the precision and recall.
     '''
-    lsh_index = []
-    with open(lsh_filename, 'rb') as file_in:
-        lsh_index = pickle.load(file_in)
-
-    if not lsh_index or len(lsh_index) == 0:
+    num_matches_lsh = count_candidate_pairs(lsh_filename)
+    if num_matches_lsh == 0:
         raise ValueError('Invalid LSH, empty list.')
-    
-    lsh_key_set = build_lsh_keypair_set(lsh_index)
-    del lsh_index
-    num_matches_lsh = len(lsh_key_set)
-    num_actual_matches = 0
-    match_set = ground_truth[1]
-
-    for key_pair in lsh_key_set:
-        if key_pair in match_set:
-            num_actual_matches += 1
-        if key_pair[::-1] in match_set:
-            num_actual_matches += 1
-
-    precision = (num_actual_matches // 2) / num_matches_lsh
-    recall = (num_actual_matches // 2) / ground_truth[0]
+
+    num_actual_matches = count_common_pairs(iter_packed_pairs(lsh_filename), ground_truth)
+
+    precision = num_actual_matches / num_matches_lsh
+    recall = num_actual_matches / len(ground_truth)
 
     return precision, recall
 
 
+def _banded_edit_distance(string_a, string_b, max_distance):
+    """
+    Ukkonen's banded edit distance. Only the cells within max_distance of the
+    diagonal are computed, and the computation stops as soon as every cell of
+    a row is larger than max_distance.
+
+    Returns:
+    The edit distance, or max_distance + 1 if it is larger than max_distance.
+    """
+    len_a, len_b = len(string_a), len(string_b)
+    too_far = max_distance + 1
+    previous_row = [j if j <= max_distance else too_far for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        first = max(1, i - max_distance)
+        last = min(len_b, i + max_distance)
+        current_row = [too_far] * (len_b + 1)
+        current_row[0] = i if i <= max_distance else too_far
+        char_a = string_a[i - 1]
+        row_min = current_row[0]
+        for j in range(first, last + 1):
+            cost = previous_row[j - 1] + (char_a != string_b[j - 1])
+            cost = min(cost, previous_row[j] + 1, current_row[j - 1] + 1, too_far)
+            current_row[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return too_far
+        previous_row = current_row
+    return previous_row[len_b]
+
+
+def bounded_edit_distance(string_a, string_b, max_distance):
+    """
+    Computes the edit distance of two strings only as far as needed to know
+    whether it is at most max_distance.
+
+    Arguments:
+    string_a -- The first string
+    string_b -- The second string
+    max_distance -- The largest distance of interest, 0 or more.
+
+    Returns:
+    The edit distance if it is at most max_distance, otherwise
+    max_distance + 1.
+    """
+    if max_distance < 0:
+        raise ValueError('Invalid maximum distance. Must not be negative.')
+
+    ## The distance is at least the difference of the lengths.
+    if abs(len(string_a) - len(string_b)) > max_distance:
+        return max_distance + 1
+    if string_a == string_b:
+        return 0
+    if max_distance == 0:
+        return 1
+
+    if HAS_EVAL_CRITERION:
+        if not editdistance.eval_criterion(string_a, string_b, max_distance):
+            return max_distance + 1
+        return editdistance.eval(string_a, string_b)
+    return _banded_edit_distance(string_a, string_b, max_distance)
+
+
+def get_max_distance(string_a, string_b, char_margin):
+    """
+    Returns the largest edit distance for which is_same_string declares two
+    strings the same.
+    """
+    if isinstance(char_margin, float):
+        shortest_str_len = len(string_a) if len(string_a) < len(string_b) else len(string_b)
+        max_distance = int(char_margin * shortest_str_len)
+        ## Same comparison as a full computation, without rounding surprises.
+        while float(max_distance + 1) / float(shortest_str_len) <= char_margin:
+            max_distance += 1
+        while max_distance >= 0 and float(max_distance) / float(shortest_str_len) > char_margin:
+            max_distance -= 1
+        return max_distance
+    return char_margin - 1
+
+
+def is_same_string(string_a, string_b, char_margin=5):
+    """
+    Given two strings, this function returns True if they are identical within
+    a certain tolerance. This functions uses the edit distance to compare the
+    inputs, stopping as soon as it exceeds the tolerance.
+
+    Arguments:
+    string_a -- The first string
+    string_b -- The second string
+    char_margin -- The number or percentage of characters to use as margin. If
+    this parameter is float, it will be interpreted as a percentage of characters
+    of the smallest string. If is of type int, then it will be interpreted as the
+    number of characters of tolerance to declare that the two strings are the same.
+
+    Returns:
+    True if string_a matches string_b with at most "char_margin" different
+    characters. Also returns the distance between the two strings if they
+    match, or a lower bound of it that is out of the margin if they do not.
+    """
+    if not string_a or len(string_a) == 0:
+        raise ValueError('Invalid input string.')
+    if not string_b or len(string_b) == 0:
+        raise ValueError('Invalid input string.')
+    if isinstance(char_margin, int):
+        if len(string_a) < char_margin or len(string_b) < char_margin:
+            raise ValueError('Input strings shorter than tolerance margin.')
+
+    max_distance = get_max_distance(string_a, string_b, char_margin)
+    if max_distance < 0:
+        return False, 0 if string_a == string_b else 1
+
+    d = bounded_edit_distance(string_a, string_b, max_distance)
+    return d <= max_distance, d
+
+
+def is_same_string_batch(strings_a, strings_b, char_margin=5):
+    """
+    Batch version of is_same_string.
+
+    Arguments:
+    strings_a -- A sequence of strings.
+    strings_b -- A sequence of strings, compared with strings_a element-wise.
+    char_margin -- The margin of is_same_string.
+
+    Returns:
+    An np.bool_ array, True where the strings are the same within the margin.
+    Pairs that is_same_string rejects as invalid (e.g. empty strings) are
+    False.
+    """
+    if len(strings_a) != len(strings_b):
+        raise ValueError('Number of strings mismatch.')
+
+    lengths_a = np.fromiter((len(s) if s else 0 for s in strings_a), dtype=np.int64, count=len(strings_a))
+    lengths_b = np.fromiter((len(s) if s else 0 for s in strings_b), dtype=np.int64, count=len(strings_b))
+    shortest = np.minimum(lengths_a, lengths_b)
+
+    ## Length pre-check for the whole batch: the distance is at least the
+    ## difference of the lengths.
+    if isinstance(char_margin, float):
+        max_distances = np.floor(char_margin * shortest).astype(np.int64) + 1
+        is_candidate = (shortest > 0) & (np.abs(lengths_a - lengths_b) <= max_distances)
+    else:
+        is_candidate = (shortest > 0) & (shortest >= char_margin) & \
+            (np.abs(lengths_a - lengths_b) <= char_margin - 1)
+
+    is_same = np.zeros(len(strings_a), dtype=bool)
+    max_distance = char_margin - 1 if isinstance(char_margin, int) else None
+    for i in np.flatnonzero(is_candidate).tolist():
+        string_a, string_b = strings_a[i], strings_b[i]
+        if max_distance is None:
+            pair_max_distance = get_max_distance(string_a, string_b, char_margin)
+        else:
+            pair_max_distance = max_distance
+        if pair_max_distance >= 0:
+            is_same[i] = bounded_edit_distance(string_a, string_b, pair_max_distance) <= pair_max_distance
+    return is_same
+
+
 def main():
     file_list = []
     for (_, _, filenames) in os.walk(TRAIN_LSH_PATH):
         file_list.extend(filenames)
         break
 
-    train_gt = []
-    with open(TRAIN_GT_FILE, 'rb') as file_in:
-        train_gt = pickle.load(file_in)
+    _, key_to_id = load_key_dictionary()
+    train_gt = load_ground_truth(TRAIN_GT_FILE, key_to_id, mmap_mode='r')
 
-    if not train_gt or len(train_gt) == 0:
+    if len(train_gt) == 0:
         print('INVALID GROUND TRUTH FILE')
         exit(1)
 
@@ -108,9 +268,16 @@ def main():
         with open(OUTPUT_BENCHMARK_FILE, 'w+') as benchmark_out:
             print('Num.Bands, Rows.Per.Band, Lsh.Threshold, Shingle.Size, Num.Hashes, Precision, Recall',
                   file=benchmark_out)
+    if not os.path.exists(FOREST_BENCHMARK_FILE):
+        with open(FOREST_BENCHMARK_FILE, 'w+') as benchmark_out:
+            print('Num.Bands, Rows.Per.Band, Lsh.Threshold, Shingle.Size, Num.Hashes, Precision, Recall, '
+                  'Max.Bucket.Size', file=benchmark_out)
 
-    with open(OUTPUT_BENCHMARK_FILE, 'a') as benchmark_out:
+    with open(OUTPUT_BENCHMARK_FILE, 'a') as benchmark_out, \
+            open(FOREST_BENCHMARK_FILE, 'a') as forest_out:
         for lsh_filename in file_list:
+            if not lsh_filename.endswith(PAIRS_EXTENSION):
+                continue
             print('Processing file: {}'.format(lsh_filename))
             
             precision, recall = calc_precision_recall(os.path.join(TRAIN_LSH_PATH, lsh_filename),
@@ -130,7 +297,10 @@ def main():
                                                             num_hashes,
                                                             precision,
                                                             recall)
-            print(line_data, file=benchmark_out)
+            if 'maxbucket' in param_dict:
+                print('{}, {}'.format(line_data, param_dict['maxbucket']), file=forest_out)
+            else:
+                print(line_data, file=benchmark_out)
 
 
 if __name__ == '__main__':
@@ -3,8 +3,9 @@
 
 
 import sys
-import pickle
 import itertools
+from corpus_store import load_dataset
+from song_keys import load_key_dictionary, pack_key_pairs, save_ground_truth
 
 def usage(scriptname):
     print("Usage: %s pickle_processed_dict_filename pickle_count_true_and_matches_filename" % scriptname)
@@ -68,23 +69,22 @@ def generate_count_true_and_matches(pickle_processed_dict_filename):
     count_true = 0
     matches = set()
     
-    with open(pickle_processed_dict_filename, "rb") as pickle_processed_dict_file:
-        dict_lyrics = pickle.load(pickle_processed_dict_file)
+    dict_lyrics = load_dataset(pickle_processed_dict_filename)
 
-        for key1, key2 in itertools.combinations(dict_lyrics.keys(), 2):
-            if key1 == key2:
-                continue
+    for key1, key2 in itertools.combinations(dict_lyrics.keys(), 2):
+        if key1 == key2:
+            continue
+            
+        if (key1, key2) not in matches:
+            is_a_match = check_match(key1,
+                                     key2,
+                                     dict_lyrics[key1],
+                                     dict_lyrics[key2])
                 
-            if (key1, key2) not in matches:
-                is_a_match = check_match(key1,
-                                         key2,
-                                         dict_lyrics[key1],
-                                         dict_lyrics[key2])
-                    
-                if is_a_match:
-                    matches.add((key1, key2))
-                    matches.add((key2, key1))
-                    count_true += 1
+            if is_a_match:
+                matches.add((key1, key2))
+                matches.add((key2, key1))
+                count_true += 1
 
     return count_true, matches
 
@@ -98,5 +98,5 @@ if __name__ == "__main__":
     
     count_true, matches = generate_count_true_and_matches(pickle_processed_dict_filename)
     
-    with open(pickle_count_true_and_matches_filename, "wb") as pickle_count_true_and_matches_file:
-        pickle.dump((count_true, matches), pickle_count_true_and_matches_file)
+    _, key_to_id = load_key_dictionary()
+    save_ground_truth(pickle_count_true_and_matches_filename, pack_key_pairs(matches, key_to_id))
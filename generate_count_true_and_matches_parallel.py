@@ -3,13 +3,12 @@
 
 
 import sys
-import pickle
-from multiprocessing import Pool
+import deletion_index
 from find_duplicates import is_same_string
+from corpus_store import load_dataset
+from song_keys import load_key_dictionary, pack_key_pairs, save_ground_truth
 
 
-NUM_PROCS = 32
-
 def usage(scriptname):
     print("Usage: %s pickle_processed_dict_filename pickle_count_true_and_matches_filename"
           % scriptname)
@@ -60,63 +59,12 @@ def check_match(key1, key2):
 
     return True
 
-def divide_work(l, num_pieces):
-    size_of_each_chunk = float(len(l))/float(num_pieces)
-    size_done = 0.0
-    last_done = 0
-    list_of_chunks = []
-    for _ in range(num_pieces):
-        size_done += size_of_each_chunk
-        chunk = l[last_done:int(size_done)]
-        list_of_chunks.append(chunk)
-        last_done = int(size_done)
-    if last_done != len(l):
-        list_of_chunks[-1].append(l[-1])
-    return list_of_chunks
-
-
 def generate_count_true_and_matches(pickle_processed_dict_filename):
-    def save_if_match(list_of_pairs_of_dict_lyrics_keys):
-        matches_set = set()
-        for dict_lyrics_key1, dict_lyrics_key2 in list_of_pairs_of_dict_lyrics_keys:
-            if (dict_lyrics_key1, dict_lyrics_key2) not in matches_set:
-                is_a_match = check_match(dict_lyrics_key1,
-                                         dict_lyrics_key2)
-                if is_a_match:
-                    matches_set.add((dict_lyrics_key1, dict_lyrics_key2))
-                    matches_set.add((dict_lyrics_key2, dict_lyrics_key1))
-                    count_true += 1
-        return count_true, matches_set
-
-
-    count_true_total = 0
-    matches_set_total = set()
-
-    with open(pickle_processed_dict_filename, "rb") as pickle_processed_dict_file:
-        dict_lyrics = pickle.load(pickle_processed_dict_file)
-
-        list_of_comparisons = []
-        for dict_lyrics_key1 in dict_lyrics:
-            for dict_lyrics_key2 in dict_lyrics:
-                if dict_lyrics_key1 >= dict_lyrics_key2:
-                    # By including > we only compare each pair once.
-                    continue
-                list_of_comparisons.append((dict_lyrics_key1, dict_lyrics_key2))
-
-        jobs = divide_work(list_of_comparisons, NUM_PROCS)
-        pool_results = []
-        with Pool(processes=NUM_PROCS) as p:
-            print('Pool starting.')
-            for job in jobs:
-                print('Job starting.')
-                pool_results.append(p.apply_async(save_if_match, job))
-
-        for result in pool_results:
-            curr_count, curr_matches = result.get()
-            count_true_total += curr_count
-            matches_set_total.union(curr_matches)
-
-    return count_true_total, matches_set_total
+    dict_lyrics = load_dataset(pickle_processed_dict_filename)
+
+    ## Only the pairs of keys whose artist and song names are within edit
+    ## distance 1 are compared, see deletion_index.
+    return deletion_index.generate_matches(list(dict_lyrics.keys()))
 
 
 if __name__ == "__main__":
@@ -128,5 +76,5 @@ if __name__ == "__main__":
 
     count_true, matches = generate_count_true_and_matches(pickle_processed_dict_filename)
 
-    with open(pickle_count_true_and_matches_filename, "wb") as pickle_count_true_and_matches_file:
-        pickle.dump((count_true, matches), pickle_count_true_and_matches_file)
+    _, key_to_id = load_key_dictionary()
+    save_ground_truth(pickle_count_true_and_matches_filename, pack_key_pairs(matches, key_to_id))
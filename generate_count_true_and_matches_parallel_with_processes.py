@@ -4,12 +4,19 @@
 
 import itertools
 import sys
-import pickle
-from multiprocessing import Process, Queue
+import time
+from multiprocessing import Pool
 from find_duplicates import is_same_string
+from job_scheduler import get_num_cpus
+from corpus_store import load_dataset
+from song_keys import load_key_dictionary, pack_key_pairs, save_ground_truth
 
 
-NUM_PROCS = 32
+## Number of keys in each side of a tile. A tile compares up to
+## BLOCK_SIZE * BLOCK_SIZE pairs.
+BLOCK_SIZE = 1000
+## Number of finished tiles between progress reports.
+PROGRESS_INTERVAL = 100
 
 def usage(scriptname):
     print("Usage: %s pickle_processed_dict_filename pickle_count_true_and_matches_filename"
@@ -61,81 +68,108 @@ def check_match(key1, key2):
 
     return True
 
-def divide_work(l, num_pieces):
-    size_of_each_chunk = float(len(l))/float(num_pieces)
-    size_done = 0.0
-    last_done = 0
-    list_of_chunks = []
-    for _ in range(num_pieces):
-        size_done += size_of_each_chunk
-        chunk = l[last_done:int(size_done)]
-        list_of_chunks.append(chunk)
-        last_done = int(size_done)
-    if last_done != len(l):
-        list_of_chunks[-1].append(l[-1])
-    return list_of_chunks
-
-
-def generate_count_true_and_matches(pickle_processed_dict_filename):
-    def solve(list_of_comparisons):
-        jobs = divide_work(list_of_comparisons, NUM_PROCS)
-        process_list = []
-        result_queue = Queue()
-        print("Starting 32 processes")
-        for job in jobs:
-            process_list.append(Process(target=save_if_match, args=(job, result_queue)))
-            process_list[-1].start()
-        for process in process_list:
-            process.join()
-        print("Processes done!")
-        count_true_total = 0
-        matches_set_total = set()
-        while not result_queue.empty():
-            curr_count, curr_matches = result_queue.get()
-            count_true_total += curr_count
-            matches_set_total.union(curr_matches)
-        return count_true_total, matches_set_total
-
-    def save_if_match(list_of_pairs_of_dict_lyrics_keys, out_queue):
-        matches_set = set()
-        for dict_lyrics_key1, dict_lyrics_key2 in list_of_pairs_of_dict_lyrics_keys:
-            if (dict_lyrics_key1, dict_lyrics_key2) not in matches_set:
-                is_a_match = check_match(dict_lyrics_key1,
-                                         dict_lyrics_key2)
-                if is_a_match:
-                    matches_set.add((dict_lyrics_key1, dict_lyrics_key2))
-                    matches_set.add((dict_lyrics_key2, dict_lyrics_key1))
-                    count_true += 1
-        out_queue.put((count_true, matches_set))
-
-
-    with open(pickle_processed_dict_filename, "rb") as pickle_processed_dict_file:
-        dict_lyrics = pickle.load(pickle_processed_dict_file)
-
-        list_keys = list(dict_lyrics.keys())
-        print("Total number of lyrics:", len(list_keys))
-        middle = len(list_keys) // 2
-
-        # First half only
-        print("Starting part 1 (out of 3)")
-        list_of_comparisons = list(itertools.combinations(list_keys[:middle], 2))
-        curr_count_true, curr_matches_set = solve(list_of_comparisons)
-        count_true_total = curr_count_true
-        matches_set_total = curr_matches_set
-
-        # Mixed halfs
-        print("Starting part 2 (out of 3)")
-        list_of_comparisons = list(itertools.product(list_keys[:middle], list_keys[middle:]))
-        curr_count_true, curr_matches_set = solve(list_of_comparisons)
-        count_true_total += curr_count_true
-        matches_set_total.union(curr_matches_set)
-
-        # Second half only
-        print("Starting part 3 (out of 3)")
-        list_of_comparisons = list(itertools.combinations(list_keys[middle:], 2))
-        curr_count_true, curr_matches_set = solve(list_of_comparisons)
-        count_true_total += curr_count_true
-        matches_set_total.union(curr_matches_set)
+def get_tiles(num_keys, block_size):
+    """
+    Returns a generator of the (block_i, block_j) tiles, block_i <= block_j,
+    that cover every pair of keys once.
+    """
+    num_blocks = -(-num_keys // block_size)
+    for block_i in range(num_blocks):
+        for block_j in range(block_i, num_blocks):
+            yield block_i, block_j
+
+
+def _init_worker(list_keys, block_size):
+    """
+    Keeps the list of keys in each worker, so tasks only carry tile coordinates.
+    """
+    global WORKER_KEYS, WORKER_BLOCK_SIZE
+    WORKER_KEYS = list_keys
+    WORKER_BLOCK_SIZE = block_size
+
+
+def match_tile(tile):
+    """
+    Compares the pairs of keys of a tile, generating them lazily.
+
+    Arguments:
+    tile -- The (block_i, block_j) coordinates of the tile. A tile on the
+    diagonal compares the keys of one block among themselves.
+
+    Returns:
+    The tile and the list of (idx1, idx2) key indexes that matched.
+    """
+    block_i, block_j = tile
+    block1 = range(block_i * WORKER_BLOCK_SIZE, min((block_i + 1) * WORKER_BLOCK_SIZE, len(WORKER_KEYS)))
+    block2 = range(block_j * WORKER_BLOCK_SIZE, min((block_j + 1) * WORKER_BLOCK_SIZE, len(WORKER_KEYS)))
+    if block_i == block_j:
+        pairs = itertools.combinations(block1, 2)
+    else:
+        pairs = itertools.product(block1, block2)
+
+    matches = []
+    for idx1, idx2 in pairs:
+        if check_match(WORKER_KEYS[idx1], WORKER_KEYS[idx2]):
+            matches.append((idx1, idx2))
+    return tile, matches
+
+
+def generate_count_true_and_matches(pickle_processed_dict_filename, block_size=BLOCK_SIZE,
+                                    num_processes=None):
+    """
+    Compares every pair of keys of a processed dictionary with check_match.
+
+    The pairs are split into tiles of block_size x block_size keys. Workers
+    receive only the coordinates of the tiles and send back the matches of
+    each tile as soon as it is done, so memory does not depend on the number
+    of pairs.
+
+    Arguments:
+    pickle_processed_dict_filename -- The processed dictionary, pickled or as a
+    corpus (see corpus_store).
+    block_size -- The number of keys in each side of a tile.
+    num_processes -- The number of worker processes. Default value is None,
+    meaning the number of cores.
+
+    Returns:
+    The number of matches and a set containing tuples of songs that matched, in
+    both orientations.
+    """
+    if block_size <= 0:
+        raise ValueError('Invalid block size. Must be larger than 0.')
+
+    dict_lyrics = load_dataset(pickle_processed_dict_filename)
+    list_keys = list(dict_lyrics.keys())
+    del dict_lyrics
+
+    if num_processes is None:
+        num_processes = get_num_cpus()
+    num_blocks = -(-len(list_keys) // block_size)
+    num_tiles = num_blocks * (num_blocks + 1) // 2
+    print("Total number of lyrics:", len(list_keys))
+    print("Starting {} tiles of {} keys on {} processes".format(num_tiles, block_size, num_processes))
+
+    count_true_total = 0
+    matches_set_total = set()
+    start_time = time.time()
+    with Pool(processes=num_processes, initializer=_init_worker,
+              initargs=(list_keys, block_size)) as pool:
+        ## Tiles are handed out one at a time and their results are consumed
+        ## in completion order, so no worker waits on a slow tile.
+        for num_done, (_, matches) in enumerate(pool.imap_unordered(match_tile,
+                                                                     get_tiles(len(list_keys), block_size)),
+                                                1):
+            for idx1, idx2 in matches:
+                matches_set_total.add((list_keys[idx1], list_keys[idx2]))
+                matches_set_total.add((list_keys[idx2], list_keys[idx1]))
+            count_true_total += len(matches)
+
+            if num_done % PROGRESS_INTERVAL == 0 or num_done == num_tiles:
+                elapsed = time.time() - start_time
+                print("{}/{} tiles done, {} matches, {:.1f}s elapsed, {:.1f}s remaining".format(
+                    num_done, num_tiles, count_true_total, elapsed,
+                    elapsed * (num_tiles - num_done) / num_done))
+    print("Processes done!")
 
     return count_true_total, matches_set_total
 
@@ -149,5 +183,5 @@ if __name__ == "__main__":
 
     count_true, matches = generate_count_true_and_matches(pickle_processed_dict_filename)
 
-    with open(pickle_count_true_and_matches_filename, "wb") as pickle_count_true_and_matches_file:
-        pickle.dump((count_true, matches), pickle_count_true_and_matches_file)
+    _, key_to_id = load_key_dictionary()
+    save_ground_truth(pickle_count_true_and_matches_filename, pack_key_pairs(matches, key_to_id))
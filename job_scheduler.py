@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Bounded job scheduler for the parameter sweeps.
+
+Each job runs in its own process, but at most one process per core is alive at
+any time, and no more jobs run at once than the available memory can hold
+given the largest peak RSS measured so far. Jobs are started from the largest
+to the smallest, so the first measurements bound the remaining jobs.
+The wall time and peak memory of every job can be appended to a benchmark CSV.
+"""
+
+import os
+import time
+import resource
+import traceback
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import wait
+
+## Fraction of the available memory that the running jobs may use.
+MEMORY_FRACTION = 0.8
+BENCHMARK_HEADER = 'Job, Wall.Time.Seconds, Peak.Rss.MB, Status'
+
+
+def get_num_cpus():
+    """
+    Returns the number of cores this process is allowed to run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_available_memory():
+    """
+    Returns the memory available for new processes, in bytes, as reported by
+    /proc/meminfo. Falls back to the amount of free physical pages on systems
+    without it.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def _run_job(target, args, result_conn):
+    """
+    Runs a single job inside the worker process and sends its result, wall time
+    and peak RSS back to the scheduler.
+    """
+    start_time = time.time()
+    status = 'ok'
+    result = None
+    try:
+        result = target(*args)
+    except Exception:
+        traceback.print_exc()
+        status = 'error'
+    wall_time = time.time() - start_time
+    ## ru_maxrss is in kilobytes on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result_conn.send((status, wall_time, peak_rss, result))
+    result_conn.close()
+
+
+def write_benchmark(benchmark_file, job_name, wall_time, peak_rss, status):
+    """
+    Appends the statistics of one job to the benchmark CSV, writing the header
+    if the file does not exist yet.
+    """
+    if not os.path.exists(benchmark_file):
+        with open(benchmark_file, 'w+') as benchmark_out:
+            print(BENCHMARK_HEADER, file=benchmark_out)
+
+    with open(benchmark_file, 'a') as benchmark_out:
+        print('{}, {:.3f}, {:.1f}, {}'.format(job_name, wall_time,
+                                             peak_rss / float(1 << 20), status),
+              file=benchmark_out)
+
+
+def run_jobs(jobs, max_workers=None, memory_fraction=MEMORY_FRACTION,
+             benchmark_file=None):
+    """
+    Runs a list of jobs on a bounded number of worker processes.
+
+    Arguments:
+    jobs -- A list of tuples in the form (job-name, target, args, cost). The
+    target is called as target(*args) in a new process. The cost is any
+    comparable value used to start the most expensive jobs first.
+    max_workers -- The maximum number of jobs running at once. Default value is
+    None, meaning the number of cores.
+    memory_fraction -- Fraction of the available memory the running jobs may
+    use. The number of concurrent jobs is this memory divided by the largest
+    peak RSS seen so far.
+    benchmark_file -- Optional path to a CSV file where the wall time and peak
+    RSS of each job are appended.
+
+    Returns:
+    A dictionary mapping each job name to the value returned by its target, or
+    None if the job failed.
+    """
+    if not jobs:
+        raise ValueError('Invalid list of jobs.')
+    if memory_fraction <= 0 or memory_fraction > 1:
+        raise ValueError('Invalid memory fraction. Value must be in range (0, 1]')
+
+    if max_workers is None:
+        max_workers = get_num_cpus()
+    max_workers = max(1, min(max_workers, len(jobs)))
+
+    ## Sorted by increasing cost, jobs are popped from the end.
+    pending = sorted(jobs, key=lambda job: job[3])
+    running = {}
+    results = {}
+    memory_budget = get_available_memory() * memory_fraction
+    max_peak_rss = 0
+    num_workers = 1
+
+    while pending or running:
+        ## The first job runs alone, so its peak RSS can be measured before
+        ## deciding how many jobs fit in memory.
+        while pending and len(running) < num_workers:
+            job_name, target, args, _ = pending.pop()
+            parent_conn, child_conn = Pipe(duplex=False)
+            p = Process(target=_run_job, args=(target, args, child_conn))
+            p.start()
+            child_conn.close()
+            running[parent_conn] = (job_name, p, time.time())
+            print('Job {} started ({} running, {} pending).'.format(job_name, len(running), len(pending)))
+
+        for conn in wait(list(running.keys())):
+            job_name, p, start_time = running.pop(conn)
+            try:
+                status, wall_time, peak_rss, result = conn.recv()
+            except EOFError:
+                ## The process died without sending its result.
+                status, wall_time, peak_rss, result = 'killed', time.time() - start_time, 0, None
+            conn.close()
+            p.join()
+
+            if peak_rss > max_peak_rss:
+                max_peak_rss = peak_rss
+                num_workers = max(1, min(max_workers, int(memory_budget // max_peak_rss)))
+            results[job_name] = result
+            print('Job {} finished: {} in {:.1f}s, peak RSS {:.1f} MB.'.format(job_name, status, wall_time,
+                                                                             peak_rss / float(1 << 20)))
+            if benchmark_file:
+                write_benchmark(benchmark_file, job_name, wall_time, peak_rss, status)
+
+    return results
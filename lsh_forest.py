@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+LSH Forest engine, an alternative to datasketch.MinHashLSH.
+
+Two songs collide in a band of MinHashLSH only if they agree on all its r
+rows, with probability s^r for a Jaccard similarity s. High recall needs
+short bands, whose buckets fill with songs that only share a common phrase,
+so MinHashLSH makes up for the short bands with many of them, and the
+candidates grow with every band.
+
+The forest splits the signature into num_trees trees of depth = num_perm //
+num_trees rows. A tree is the songs sorted by the values of its rows, a
+prefix tree: the songs that agree on the first d rows of the tree are a run
+of the sorted order, for every d. A bucket starts as a run of min_depth
+rows, and a bucket with more than max_bucket_size songs is split by the
+next row of the tree, then the next one, until it fits or the tree ends.
+Short prefixes give the recall of short bands to the songs of small
+buckets, and only the crowded buckets pay for longer ones, so a few trees
+reach the recall of many bands with fewer candidates. benchmark_lsh_engines
+compares the tables, memory and candidates of both engines at the same
+recall.
+
+Each tree keeps the sorted order of the songs and the length of the prefix
+each song shares with the next one, 6 bytes per song. The buckets of a tree
+partition its songs, and they are found from the prefix lengths alone.
+"""
+
+import numpy as np
+from datasketch import MinHashLSH
+from batch_minhash import insert_signatures
+
+ENGINE_MINHASH = 'minhash'
+ENGINE_FOREST = 'forest'
+ENGINES = [ENGINE_MINHASH, ENGINE_FOREST]
+DEFAULT_NUM_TREES = 16
+DEFAULT_MAX_BUCKET_SIZE = 8
+
+
+def get_min_depth(threshold, num_trees, depth):
+    """
+    Returns the prefix length of the buckets of a forest before they are
+    split: the longest one with which two songs of Jaccard similarity
+    threshold share a bucket of some tree with probability at least 1/2.
+    """
+    for min_depth in range(depth, 1, -1):
+        if 1.0 - (1.0 - threshold ** min_depth) ** num_trees >= 0.5:
+            return min_depth
+    return 1
+
+
+class LSHForest(object):
+    """
+    In-memory LSH Forest over a signature matrix.
+
+    Usage:
+        lsh = LSHForest(threshold, num_perm, num_trees=16)
+        lsh.insert_signatures(song_ids, signatures)
+        for song_ids in lsh.iter_buckets():
+            ...
+        candidate_ids = lsh.query(signature)
+    """
+
+    def __init__(self, threshold=0.9, num_perm=128, num_trees=DEFAULT_NUM_TREES,
+                 max_bucket_size=DEFAULT_MAX_BUCKET_SIZE):
+        """
+        Arguments:
+        threshold -- The Jaccard threshold the prefix length of the buckets
+        is picked for, see get_min_depth.
+        num_perm -- The number of permutations of the signatures.
+        num_trees -- The number of trees. At most num_perm.
+        max_bucket_size -- Buckets with more songs are split by the next row
+        of their tree.
+        """
+        if num_trees <= 0 or num_trees > num_perm:
+            raise ValueError('Invalid number of trees. Must be between 1 and num_perm.')
+        if max_bucket_size < 2:
+            raise ValueError('Invalid maximum bucket size. Must be at least 2.')
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.max_bucket_size = max_bucket_size
+        ## Same names as the bands and rows of MinHashLSH: each tree is a band
+        ## of r rows.
+        self.b = num_trees
+        self.r = num_perm // num_trees
+        self.min_depth = get_min_depth(threshold, self.b, self.r)
+        self.song_ids = np.empty(0, dtype=np.int32)
+        self.signatures = None
+        ## The signature rows of each tree, sorted by their prefix.
+        self.tree_rows = None
+        ## prefix_lengths[tree, i] is the number of rows the i-th and
+        ## (i + 1)-th songs of a tree agree on.
+        self.prefix_lengths = None
+        self._rows_by_id = None
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    def get_tree_columns(self, tree):
+        return np.arange(tree * self.r, (tree + 1) * self.r)
+
+    def insert_signatures(self, song_ids, signatures):
+        """
+        Builds the index from a signature matrix. The index is built once, all
+        the songs must be inserted at the same time.
+
+        Arguments:
+        song_ids -- The song id of each signature row.
+        signatures -- The (N, num_perm) signature matrix. It is kept, not
+        copied, for queries and get_song_signatures.
+        """
+        if self.tree_rows is not None:
+            raise ValueError('LSH Forest already built.')
+        if len(song_ids) != len(signatures):
+            raise ValueError('Number of keys and signatures mismatch.')
+        if len(song_ids) == 0:
+            raise ValueError('Invalid list of songs. Must not be empty.')
+
+        self.song_ids = np.asarray(song_ids, dtype=np.int32)
+        self.signatures = signatures
+        num_songs = len(signatures)
+        self.tree_rows = np.empty((self.b, num_songs), dtype=np.int32)
+        self.prefix_lengths = np.empty((self.b, num_songs - 1), dtype=np.uint16)
+        for tree in range(self.b):
+            tree_signatures = np.asarray(signatures[:, self.get_tree_columns(tree)])
+            ## np.lexsort sorts by its last key first.
+            order = np.lexsort(tree_signatures.T[::-1])
+            tree_signatures = tree_signatures[order]
+            is_different = tree_signatures[1:] != tree_signatures[:-1]
+            self.tree_rows[tree] = order
+            self.prefix_lengths[tree] = np.where(is_different.any(axis=1), is_different.argmax(axis=1), self.r)
+
+    def get_memory_usage(self):
+        """
+        Returns the size of the arrays of the index in bytes, not counting the
+        signatures.
+        """
+        return sum(array.nbytes for array in [self.song_ids, self.tree_rows, self.prefix_lengths]
+                   if array is not None)
+
+    def get_bucket_bounds(self, tree):
+        """
+        Returns the start and end positions of the buckets of a tree in its
+        sorted order, including the buckets of a single song. Every song is in
+        exactly one bucket of each tree.
+        """
+        prefix_lengths = self.prefix_lengths[tree]
+        num_songs = len(prefix_lengths) + 1
+        bucket_starts, bucket_ends = [], []
+        ## Songs whose run of the previous prefix length was too large.
+        is_oversized = np.ones(num_songs, dtype=bool)
+        for depth in range(self.min_depth, self.r + 1):
+            starts = np.concatenate(([0], np.flatnonzero(prefix_lengths < depth) + 1))
+            sizes = np.diff(np.append(starts, num_songs))
+            is_split = is_oversized[starts]
+            is_final = is_split & ((sizes <= self.max_bucket_size) | (depth == self.r))
+            bucket_starts.append(starts[is_final])
+            bucket_ends.append(starts[is_final] + sizes[is_final])
+            is_split &= ~is_final
+            if not np.any(is_split):
+                break
+            is_oversized = np.repeat(is_split, sizes)
+
+        bucket_starts = np.concatenate(bucket_starts)
+        bucket_ends = np.concatenate(bucket_ends)
+        order = np.argsort(bucket_starts)
+        return bucket_starts[order], bucket_ends[order]
+
+    def get_bucket_sizes(self, tree):
+        """
+        Returns the size of every bucket of a tree, including the buckets of a
+        single song.
+        """
+        starts, ends = self.get_bucket_bounds(tree)
+        return ends - starts
+
+    def get_song_signatures(self, song_ids):
+        """
+        Returns the signature matrix of a list of song ids of the index.
+        """
+        if self._rows_by_id is None:
+            self._rows_by_id = np.full(int(self.song_ids.max()) + 1, -1, dtype=np.int64)
+            self._rows_by_id[self.song_ids] = np.arange(len(self.song_ids))
+        return self.signatures[self._rows_by_id[np.asarray(song_ids)]]
+
+    def iter_band_buckets(self, tree, min_size=2):
+        """
+        Returns a generator of the signature rows of each bucket of a tree
+        with at least min_size songs.
+        """
+        starts, ends = self.get_bucket_bounds(tree)
+        rows = self.tree_rows[tree]
+        for bucket in np.flatnonzero(ends - starts >= min_size):
+            yield rows[starts[bucket]:ends[bucket]]
+
+    def iter_buckets(self, min_size=2):
+        """
+        Returns a generator of the song ids of each bucket of every tree with
+        at least min_size songs.
+        """
+        for tree in range(self.b):
+            for rows in self.iter_band_buckets(tree, min_size):
+                yield self.song_ids[rows]
+
+    def _search_prefix(self, tree, values, start, end, side):
+        """
+        Binary search of the first position of [start, end) of a tree whose
+        prefix of len(values) rows is not below values, or above them for
+        side 'right'.
+        """
+        rows = self.tree_rows[tree]
+        columns = self.get_tree_columns(tree)[:len(values)]
+        while start < end:
+            middle = (start + end) // 2
+            middle_values = self.signatures[rows[middle], columns]
+            different = np.flatnonzero(middle_values != values)
+            if len(different):
+                is_below = middle_values[different[0]] < values[different[0]]
+            else:
+                is_below = side == 'right'
+            if is_below:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def query(self, signature):
+        """
+        Returns the ids of the songs that share a bucket of some tree with a
+        signature, like MinHashLSH.query. The bucket of the signature in a
+        tree is the run of songs sharing its prefix of min_depth rows, or of
+        more rows while that run has more than max_bucket_size songs.
+        """
+        signature = np.asarray(signature)
+        rows = []
+        for tree in range(self.b):
+            tree_values = signature[self.get_tree_columns(tree)]
+            start, end = 0, len(self.song_ids)
+            for depth in range(self.min_depth, self.r + 1):
+                start = self._search_prefix(tree, tree_values[:depth], start, end, 'left')
+                end = self._search_prefix(tree, tree_values[:depth], start, end, 'right')
+                if end - start <= self.max_bucket_size:
+                    break
+            if start < end:
+                rows.append(self.tree_rows[tree, start:end])
+        if not rows:
+            return np.empty(0, dtype=np.int32)
+        return self.song_ids[np.unique(np.concatenate(rows))]
+
+
+def build_lsh_index(engine, threshold, num_perm, song_ids, signatures, num_trees=DEFAULT_NUM_TREES,
+                    max_bucket_size=DEFAULT_MAX_BUCKET_SIZE):
+    """
+    Builds an LSH index of a signature matrix with one of ENGINES.
+
+    Arguments:
+    engine -- ENGINE_MINHASH for datasketch.MinHashLSH, or ENGINE_FOREST.
+    threshold, num_perm -- The index parameters.
+    song_ids -- The song id of each signature row.
+    signatures -- The (N, num_perm) signature matrix.
+    num_trees, max_bucket_size -- The parameters of the LSH Forest engine.
+
+    Returns:
+    The index, which get_possible_duplicates and dump_possible_duplicates of
+    build_hash_index accept.
+    """
+    if engine == ENGINE_MINHASH:
+        lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        insert_signatures(lsh, song_ids, signatures)
+    elif engine == ENGINE_FOREST:
+        lsh = LSHForest(threshold=threshold, num_perm=num_perm, num_trees=min(num_trees, num_perm),
+                        max_bucket_size=max_bucket_size)
+        lsh.insert_signatures(song_ids, signatures)
+    else:
+        raise ValueError('Invalid LSH engine {}. Must be one of {}.'.format(engine, ENGINES))
+    return lsh
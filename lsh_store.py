@@ -0,0 +1,531 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Persistent, memory-mapped LSH index.
+
+An index is a directory with plain .npy arrays, so it can be opened with
+np.load(mmap_mode='r') in milliseconds and its pages are shared by every
+process that reads it:
+
+    metadata          -- Pickled dictionary with the index parameters and
+                         the list of its segments.
+    song_ids.npy      -- (N,) int32 ids of the songs in the key dictionary.
+    signatures.npy    -- (N, num_perm) uint32 MinHash signatures.
+    band_keys.npy     -- (b, N) uint64 band keys, sorted within each band.
+    band_rows.npy     -- (b, N) int32 signature row of each band key.
+
+The four arrays form a segment. save_lsh_index writes one, in the index
+directory itself. insert_songs never rewrites them: the new songs are written
+to a new segment subdirectory, and the index only includes it once the
+metadata listing it replaces the old one, so a reader sees either the index
+before the insert or after it. Queries look up every segment, and walks merge
+the bands of the segments. compact_lsh_index merges the segments into one.
+
+The bands are the same as the ones MinHashLSH(threshold, num_perm) uses. The
+key of a band is a 64-bit hash of its r signature values instead of their raw
+bytes, so the songs of a bucket form a run of equal keys in the sorted band
+and a lookup is a binary search. Two different bands collide with
+probability about 2^-64.
+"""
+
+import os
+import pickle
+import shutil
+import numpy as np
+from datasketch import MinHashLSH
+from batch_minhash import DEFAULT_SEED, _mix64
+from candidate_pairs import pack_pairs
+
+FORMAT_VERSION = 1
+METADATA_FILE = 'metadata'
+SONG_IDS_FILE = 'song_ids.npy'
+SIGNATURES_FILE = 'signatures.npy'
+BAND_KEYS_FILE = 'band_keys.npy'
+BAND_ROWS_FILE = 'band_rows.npy'
+## The segment written by save_lsh_index, the index directory itself.
+BASE_SEGMENT = '.'
+SEGMENT_FORMAT = 'segment-{:06d}'
+## insert_songs compacts an index with more segments than MAX_SEGMENTS.
+MAX_SEGMENTS = 8
+## Initial value of the band key hash, offset by the band number so equal
+## values in different bands do not produce the same key.
+BAND_HASH_SEED = 0x9e3779b97f4a7c15
+
+
+def get_lsh_parameters(threshold, num_perm):
+    """
+    Returns the number of bands and rows per band MinHashLSH picks for a
+    threshold and number of permutations.
+    """
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    return lsh.b, lsh.r
+
+
+def compute_band_keys(signatures, b, r, first_band=0):
+    """
+    Hashes the bands of a signature matrix.
+
+    Arguments:
+    signatures -- An (N, num_perm) signature matrix,
+    num_perm >= (first_band + b) * r.
+    b -- The number of bands.
+    r -- The number of rows (signature values) per band.
+    first_band -- The first band hashed, so the bands of a large index can be
+    hashed a block at a time. The keys do not depend on the block size.
+
+    Returns:
+    A (b, N) np.uint64 array with the key of each band of each signature.
+    """
+    signatures = np.asarray(signatures)
+    if signatures.ndim != 2 or signatures.shape[1] < (first_band + b) * r:
+        raise ValueError('Invalid signature matrix. Must have at least (first_band + b) * r columns.')
+
+    ## All the bands are hashed at once, one row of each band per step.
+    bands = signatures[:, first_band * r:(first_band + b) * r].reshape(len(signatures), b, r)
+    band_keys = np.empty((len(signatures), b), dtype=np.uint64)
+    band_keys[:] = np.arange(BAND_HASH_SEED + first_band, BAND_HASH_SEED + first_band + b, dtype=np.uint64)
+    for row in range(r):
+        band_keys = _mix64(band_keys ^ bands[:, :, row].astype(np.uint64))
+    band_keys = np.ascontiguousarray(band_keys.T)
+    return band_keys
+
+
+def sort_band_keys(band_keys):
+    """
+    Sorts each band of a (b, N) band keys array.
+
+    Returns:
+    The sorted band keys and, for each of them, the row it came from.
+    """
+    band_rows = np.argsort(band_keys, axis=1, kind='stable').astype(np.int32)
+    return np.take_along_axis(band_keys, band_rows, axis=1), band_rows
+
+
+def save_lsh_index(index_path, song_ids, signatures, threshold, num_perm=None,
+                   shingle_size=None, token_shingles=False, seed=DEFAULT_SEED):
+    """
+    Builds an LSH index from a signature matrix and saves it.
+
+    Arguments:
+    index_path -- The directory of the index. It is created if needed.
+    song_ids -- The ids of the songs, one per row of signatures.
+    signatures -- The signature matrix, e.g. from batch_minhash.
+    threshold -- The Jaccard similarity threshold of the index.
+    num_perm -- The number of permutations. Default value is None, meaning
+    every column of signatures.
+    shingle_size -- The size of the n-grams of the signatures, kept so queries
+    are hashed the same way.
+    token_shingles -- Whether the n-grams were hashed from token hashes (see
+    batch_minhash.iter_token_signature_chunks) or as strings.
+    seed -- The seed of the permutations of the signatures.
+    """
+    if len(song_ids) != len(signatures):
+        raise ValueError('Number of song ids and signatures mismatch.')
+    if len(song_ids) == 0:
+        raise ValueError('Invalid list of songs. Must not be empty.')
+    if num_perm is None:
+        num_perm = signatures.shape[1]
+    if num_perm > signatures.shape[1]:
+        raise ValueError('Signature matrix has only {} permutations.'.format(signatures.shape[1]))
+
+    b, r = get_lsh_parameters(threshold, num_perm)
+    ## MinHash values are below 2^32, so they are stored in half the space.
+    signatures = np.asarray(signatures[:, :num_perm], dtype=np.uint32)
+    band_keys, band_rows = sort_band_keys(compute_band_keys(signatures, b, r))
+
+    os.makedirs(index_path, exist_ok=True)
+    _write_segment(index_path, song_ids, signatures, band_keys, band_rows)
+
+    metadata = {'version': FORMAT_VERSION,
+                'threshold': threshold,
+                'num_perm': num_perm,
+                'b': b,
+                'r': r,
+                'shingle_size': shingle_size,
+                'token_shingles': token_shingles,
+                'seed': seed,
+                'num_songs': len(song_ids),
+                'segments': [BASE_SEGMENT],
+                'next_segment': 0}
+    ## Written last, so an index without metadata is known to be incomplete.
+    _write_metadata(index_path, metadata)
+
+
+def _write_segment(segment_path, song_ids, signatures, band_keys, band_rows):
+    """
+    Writes the arrays of a segment, see the module documentation.
+    """
+    np.save(os.path.join(segment_path, SONG_IDS_FILE), np.asarray(song_ids, dtype=np.int32))
+    np.save(os.path.join(segment_path, SIGNATURES_FILE), signatures)
+    np.save(os.path.join(segment_path, BAND_KEYS_FILE), band_keys)
+    np.save(os.path.join(segment_path, BAND_ROWS_FILE), band_rows)
+
+
+def _load_metadata(index_path):
+    metadata_path = os.path.join(index_path, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        raise ValueError('LSH index {} not found or incomplete.'.format(index_path))
+
+    with open(metadata_path, 'rb') as metadata_in:
+        metadata = pickle.load(metadata_in)
+    if metadata['version'] != FORMAT_VERSION:
+        raise ValueError('Unsupported LSH index version {}.'.format(metadata['version']))
+    ## Indexes saved before segments were added have a single one.
+    metadata.setdefault('segments', [BASE_SEGMENT])
+    metadata.setdefault('next_segment', 0)
+    return metadata
+
+
+def _write_metadata(index_path, metadata):
+    """
+    Replaces the metadata of an index in a single rename, which is what
+    commits a change of its segments.
+    """
+    metadata_path = os.path.join(index_path, METADATA_FILE)
+    with open(metadata_path + '.tmp', 'wb') as metadata_out:
+        pickle.dump(metadata, metadata_out)
+        metadata_out.flush()
+        os.fsync(metadata_out.fileno())
+    os.replace(metadata_path + '.tmp', metadata_path)
+
+
+class LSHSegment(object):
+    """
+    The arrays of one segment of an index. Its band rows are rows of the
+    whole index, numbered from first_row.
+    """
+
+    def __init__(self, segment_path, first_row, mmap_mode='r'):
+        self.path = segment_path
+        self.first_row = first_row
+        self.song_ids = np.load(os.path.join(segment_path, SONG_IDS_FILE), mmap_mode=mmap_mode)
+        self.signatures = np.load(os.path.join(segment_path, SIGNATURES_FILE), mmap_mode=mmap_mode)
+        self.band_keys = np.load(os.path.join(segment_path, BAND_KEYS_FILE), mmap_mode=mmap_mode)
+        self.band_rows = np.load(os.path.join(segment_path, BAND_ROWS_FILE), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    def is_consistent(self, b, num_perm):
+        """
+        Tests the shapes of the arrays against the index parameters.
+        """
+        num_songs = len(self.song_ids)
+        return (self.signatures.shape == (num_songs, num_perm) and
+                self.band_keys.shape == (b, num_songs) and
+                self.band_rows.shape == (b, num_songs))
+
+
+class MappedLSHIndex(object):
+    """
+    Read-only view of an index saved by save_lsh_index, with the songs added
+    by insert_songs.
+
+    Usage:
+        index = MappedLSHIndex(index_path)
+        for song_ids in index.iter_buckets():
+            ...
+        candidate_ids = index.query(signature)
+    """
+
+    def __init__(self, index_path, mmap_mode='r'):
+        """
+        Arguments:
+        index_path -- The directory of the index.
+        mmap_mode -- Passed to np.load. Default value is 'r', the arrays are
+        memory-mapped and only the pages that are used are read. None loads
+        them into memory.
+        """
+        metadata = _load_metadata(index_path)
+
+        self.path = index_path
+        self.threshold = metadata['threshold']
+        self.num_perm = metadata['num_perm']
+        self.b = metadata['b']
+        self.r = metadata['r']
+        self.shingle_size = metadata['shingle_size']
+        self.token_shingles = metadata['token_shingles']
+        self.seed = metadata['seed']
+
+        self.segments = []
+        first_row = 0
+        for segment_name in metadata['segments']:
+            segment = LSHSegment(os.path.join(index_path, segment_name), first_row, mmap_mode)
+            if not segment.is_consistent(self.b, self.num_perm):
+                raise ValueError('LSH index {} is inconsistent. Segment {} does not match its '
+                                 'parameters.'.format(index_path, segment_name))
+            self.segments.append(segment)
+            first_row += len(segment)
+        if first_row != metadata['num_songs']:
+            raise ValueError('LSH index {} is inconsistent. It has {} songs instead of {}.'.format(
+                index_path, first_row, metadata['num_songs']))
+
+        if len(self.segments) == 1:
+            self.song_ids = self.segments[0].song_ids
+        else:
+            self.song_ids = np.concatenate([segment.song_ids for segment in self.segments])
+        self._first_rows = np.array([segment.first_row for segment in self.segments])
+        self._rows_by_id = None
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    def get_band(self, band):
+        """
+        Returns the sorted keys of a band and the row of each of them, merged
+        from every segment. The rows of a bucket are in insertion order.
+        """
+        if len(self.segments) == 1:
+            return np.asarray(self.segments[0].band_keys[band]), np.asarray(self.segments[0].band_rows[band])
+
+        keys = np.concatenate([segment.band_keys[band] for segment in self.segments])
+        rows = np.concatenate([segment.band_rows[band] for segment in self.segments])
+        order = np.argsort(keys, kind='stable')
+        return keys[order], rows[order]
+
+    def get_bucket_sizes(self, band):
+        """
+        Returns the size of every bucket of a band, including the buckets of a
+        single song.
+        """
+        keys, _ = self.get_band(band)
+        return np.diff(np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [len(keys)])))
+
+    def get_signature_rows(self, rows):
+        """
+        Returns the signature matrix of a list of rows of the index.
+        """
+        if len(self.segments) == 1:
+            return self.segments[0].signatures[rows]
+
+        rows = np.asarray(rows)
+        signatures = np.empty((len(rows), self.num_perm), dtype=np.uint32)
+        row_segments = np.searchsorted(self._first_rows, rows, side='right') - 1
+        for segment_index in np.unique(row_segments):
+            segment = self.segments[segment_index]
+            is_segment = row_segments == segment_index
+            signatures[is_segment] = segment.signatures[rows[is_segment] - segment.first_row]
+        return signatures
+
+    def get_song_signatures(self, song_ids):
+        """
+        Returns the signature matrix of a list of song ids of the index.
+        """
+        if self._rows_by_id is None:
+            self._rows_by_id = np.full(int(self.song_ids.max()) + 1, -1, dtype=np.int64)
+            self._rows_by_id[self.song_ids] = np.arange(len(self.song_ids))
+        return self.get_signature_rows(self._rows_by_id[np.asarray(song_ids)])
+
+    def iter_band_buckets(self, band, min_size=2):
+        """
+        Returns a generator of the signature rows of each bucket of a band with
+        at least min_size songs.
+        """
+        keys, rows = self.get_band(band)
+        bounds = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [len(keys)]))
+        sizes = np.diff(bounds)
+        for bucket in np.flatnonzero(sizes >= min_size):
+            yield rows[bounds[bucket]:bounds[bucket + 1]]
+
+    def iter_buckets(self, min_size=2):
+        """
+        Returns a generator of the song ids of each bucket of every band with
+        at least min_size songs, the same buckets get_possible_duplicates
+        returns for a MinHashLSH index.
+        """
+        for band in range(self.b):
+            for rows in self.iter_band_buckets(band, min_size):
+                yield self.song_ids[rows]
+
+    def query_rows(self, signature):
+        """
+        Returns the sorted signature rows of the songs that share at least one
+        band with a signature.
+        """
+        signature = np.asarray(signature).reshape(1, -1)
+        query_keys = compute_band_keys(signature, self.b, self.r)[:, 0]
+
+        rows = []
+        for segment in self.segments:
+            ## Plain ndarray views avoid the np.memmap overhead on every slice.
+            band_keys = np.asarray(segment.band_keys)
+            band_rows = np.asarray(segment.band_rows)
+            for band, key in enumerate(query_keys):
+                keys = band_keys[band]
+                start = keys.searchsorted(key, side='left')
+                if start < len(keys) and keys[start] == key:
+                    end = keys.searchsorted(key, side='right')
+                    rows.append(band_rows[band, start:end])
+        if not rows:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(rows))
+
+    def query(self, signature):
+        """
+        Returns the ids of the songs that share at least one band with a
+        signature, like MinHashLSH.query.
+        """
+        return self.song_ids[self.query_rows(signature)]
+
+
+def _get_bucket_pairs(band_keys, band_rows, new_keys, new_rows):
+    """
+    Finds the pairs of rows created by inserting new band keys into one band
+    of a segment.
+
+    Arguments:
+    band_keys -- The sorted band keys of the segment.
+    band_rows -- The row of each of band_keys.
+    new_keys -- The sorted band keys of the new rows.
+    new_rows -- The row of each of new_keys.
+
+    Returns:
+    Two arrays of rows with the pairs of a new row and a row of the segment
+    that share a bucket.
+    """
+    starts = np.searchsorted(band_keys, new_keys, side='left')
+    ends = np.searchsorted(band_keys, new_keys, side='right')
+    counts = ends - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(new_rows, counts), np.asarray(band_rows)[np.repeat(starts, counts) + offsets]
+
+
+def _get_run_pairs(new_keys, new_rows):
+    """
+    Returns the pairs of new rows that share a bucket, every pair within a
+    run of equal sorted keys.
+    """
+    first_rows = [np.empty(0, dtype=np.int32)]
+    second_rows = [np.empty(0, dtype=np.int32)]
+    bounds = np.concatenate(([0], np.flatnonzero(new_keys[1:] != new_keys[:-1]) + 1, [len(new_keys)]))
+    for run in np.flatnonzero(np.diff(bounds) > 1):
+        run_rows = new_rows[bounds[run]:bounds[run + 1]]
+        first, second = np.triu_indices(len(run_rows), 1)
+        first_rows.append(run_rows[first])
+        second_rows.append(run_rows[second])
+    return np.concatenate(first_rows), np.concatenate(second_rows)
+
+
+def _add_segment(index_path, metadata, song_ids, signatures, band_keys, band_rows, replace=False):
+    """
+    Writes a new segment and commits it to the metadata of an index.
+
+    Arguments:
+    replace -- If True, the new segment replaces every segment of the index,
+    otherwise it is appended to them.
+
+    Returns:
+    The names of the segments that are no longer in the index.
+    """
+    segment_name = SEGMENT_FORMAT.format(metadata['next_segment'])
+    segment_path = os.path.join(index_path, segment_name)
+    ## Left by an insert that did not commit.
+    if os.path.exists(segment_path):
+        shutil.rmtree(segment_path)
+    os.makedirs(segment_path)
+    _write_segment(segment_path, song_ids, signatures, band_keys, band_rows)
+
+    old_segments = metadata['segments']
+    metadata = dict(metadata)
+    metadata['segments'] = [segment_name] if replace else old_segments + [segment_name]
+    metadata['next_segment'] += 1
+    metadata['num_songs'] = len(song_ids) if replace else metadata['num_songs'] + len(song_ids)
+    _write_metadata(index_path, metadata)
+    return old_segments if replace else []
+
+
+def _remove_segments(index_path, segment_names):
+    for segment_name in segment_names:
+        if segment_name == BASE_SEGMENT:
+            for filename in [SONG_IDS_FILE, SIGNATURES_FILE, BAND_KEYS_FILE, BAND_ROWS_FILE]:
+                os.remove(os.path.join(index_path, filename))
+        else:
+            shutil.rmtree(os.path.join(index_path, segment_name))
+
+
+def compact_lsh_index(index_path):
+    """
+    Merges the segments of an index into one. The merged segment is written
+    next to the old ones and committed with the metadata before they are
+    removed, so the index stays valid if the compaction is interrupted, and
+    readers that opened it before keep their mapped copies.
+    """
+    index = MappedLSHIndex(index_path)
+    if len(index.segments) == 1:
+        return
+
+    band_keys = np.empty((index.b, len(index)), dtype=np.uint64)
+    band_rows = np.empty((index.b, len(index)), dtype=np.int32)
+    for band in range(index.b):
+        band_keys[band], band_rows[band] = index.get_band(band)
+    signatures = index.get_signature_rows(np.arange(len(index)))
+    old_segments = _add_segment(index_path, _load_metadata(index_path), index.song_ids, signatures,
+                                band_keys, band_rows, replace=True)
+    _remove_segments(index_path, old_segments)
+
+
+def insert_songs(index_path, song_ids, signatures):
+    """
+    Inserts new songs into an index saved by save_lsh_index and returns the
+    candidate pairs they create.
+
+    The pairs are found by looking up the band keys of the new songs in the
+    sorted bands of each segment, and the new songs are written to a new
+    segment, so an insert costs time proportional to the number of new songs
+    and the size of the buckets they land in, not to the size of the index.
+    The index is compacted when it has more than MAX_SEGMENTS segments.
+
+    Arguments:
+    index_path -- The directory of the index.
+    song_ids -- The ids of the new songs in the key dictionary. Songs already
+    in the index are skipped.
+    signatures -- The signatures of the new songs, built with the same shingle
+    size, hashing and seed as the index.
+
+    Returns:
+    A sorted np.uint64 array with the unique packed pairs (see
+    candidate_pairs.pack_pairs) of song ids that share a bucket and involve at
+    least one new song.
+    """
+    if len(song_ids) != len(signatures):
+        raise ValueError('Number of song ids and signatures mismatch.')
+
+    metadata = _load_metadata(index_path)
+    index = MappedLSHIndex(index_path)
+    if signatures.shape[1] < index.num_perm:
+        raise ValueError('Signatures have fewer than {} permutations.'.format(index.num_perm))
+
+    ## Songs already in the index, or repeated among the new ones, are skipped
+    ## like MinHashLSH does with repeated keys.
+    song_ids = np.asarray(song_ids, dtype=np.int32)
+    is_new = np.zeros(len(song_ids), dtype=bool)
+    is_new[np.unique(song_ids, return_index=True)[1]] = True
+    is_new &= ~np.isin(song_ids, index.song_ids)
+    for song_id in song_ids[~is_new]:
+        print('Repeated Key = {}'.format(song_id))
+    song_ids = song_ids[is_new]
+    new_signatures = np.asarray(signatures[is_new, :index.num_perm], dtype=np.uint32)
+    if len(song_ids) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    num_rows = len(index)
+    new_band_keys, new_band_rows = sort_band_keys(compute_band_keys(new_signatures, index.b, index.r))
+    new_band_rows += np.int32(num_rows)
+    all_song_ids = np.concatenate((index.song_ids, song_ids))
+    packed_pairs = [np.empty(0, dtype=np.uint64)]
+
+    for band in range(index.b):
+        new_keys, new_rows = new_band_keys[band], new_band_rows[band]
+        for segment in index.segments:
+            first_rows, second_rows = _get_bucket_pairs(segment.band_keys[band], segment.band_rows[band],
+                                                        new_keys, new_rows)
+            packed_pairs.append(pack_pairs(all_song_ids[first_rows], all_song_ids[second_rows]))
+        first_rows, second_rows = _get_run_pairs(new_keys, new_rows)
+        packed_pairs.append(pack_pairs(all_song_ids[first_rows], all_song_ids[second_rows]))
+
+    _add_segment(index_path, metadata, song_ids, new_signatures, new_band_keys, new_band_rows)
+    if len(metadata['segments']) + 1 > MAX_SEGMENTS:
+        compact_lsh_index(index_path)
+
+    return np.unique(np.concatenate(packed_pairs))
@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Selector-based extraction of the artist links, song links and lyrics of the
+crawled pages, shared by the crawlers.
+
+The rules of each website are data, SITE_RULES: for each kind of page, a list
+of selectors, the first one with matches is used. A selector is a chain of
+compound selectors joined by the child combinator, in the subset of CSS the
+crawlers need:
+
+    div.meio_no_block > div > ol > li > a
+    div#lyr_original > div
+    a[href^="letras.asp?letras="]
+
+A compound selector is a tag name, or *, followed by any number of .class,
+#id and [attribute^="prefix"] conditions. Selectors are compiled once.
+
+A page is read in a single pass over the matches of TAG_REGEX, keeping the
+stack of open elements without building a tree. The attributes of an element
+are only parsed when a selector tests it: only the elements whose tag ends a
+selector are tested, and then their ancestors on the stack. The text of the
+matched elements is collected as the page is scanned, with <br> tags and the
+boundaries of block elements as new lines and the HTML entities unescaped.
+"""
+
+import re
+import html
+from functools import lru_cache
+
+## Start tags, end tags, comments and declarations.
+TAG_REGEX = re.compile(r'<(?:(/?)([a-zA-Z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>|!--.*?-->|[!?][^>]*>)',
+                       re.DOTALL)
+ATTRIBUTE_REGEX = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+## Elements whose content is not HTML, and the regex of their end tag.
+RAW_TEXT_END_REGEXES = dict((tag, re.compile(r'</{}\s*>'.format(tag), re.IGNORECASE))
+                            for tag in ['script', 'style', 'textarea', 'title'])
+## Elements without an end tag.
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                           'param', 'source', 'track', 'wbr'])
+## Elements whose start and end tags break the line of the text around them.
+BLOCK_ELEMENTS = frozenset(['address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl', 'dt', 'fieldset',
+                            'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                            'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table',
+                            'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul'])
+## Start tags that close the open element, e.g. <li> closes the previous <li>.
+IMPLICITLY_CLOSED = {'li': frozenset(['li']),
+                     'p': frozenset(['p']),
+                     'option': frozenset(['option']),
+                     'tr': frozenset(['tr']),
+                     'td': frozenset(['td', 'th', 'tr']),
+                     'th': frozenset(['td', 'th', 'tr'])}
+CHARSET_REGEX = re.compile(br'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+DEFAULT_ENCODING = 'utf-8'
+COMPOUND_REGEX = re.compile(r'([\w-]+|\*)?((?:\.[\w-]+|#[\w-]+|\[[\w-]+\^="[^"]*"\])*)$')
+CONDITION_REGEX = re.compile(r'\.([\w-]+)|#([\w-]+)|\[([\w-]+)\^="([^"]*)"\]')
+
+SITE_RULES = {
+    'vagalume.com.br': {
+        'artists': ['div.meio_no_block > div > ol > li > a'],
+        'songs': ['div.vscroll > ul.tracks > li > a'],
+        'lyrics': ['div#lyr_original > div'],
+    },
+    'cifraclub.com.br': {
+        'artists': ['div#b_alfabeto > ul > li > a'],
+        'songs': ['div.list-alf > ul.list-links > li > a.tooltip',
+                  'ol.list-links > li > a.tooltip'],
+        'lyrics': ['div.p402_premium > div.letra-l',
+                   'div.p402_premium > div.letra'],
+    },
+    'letras.mus.br': {
+        'artists': ['div.artistas-a > ul.cnt-list > li > a'],
+        'songs': ['div.cnt-list--alp > ul.cnt-list > li > a'],
+        'lyrics': ['div.cnt-letra > article > p'],
+    },
+    'letrasdemusicas.com.br': {
+        'artists': ['div.lst1 > ol > li > a'],
+        'songs': ['div.lst1 > ol > li > a'],
+        'lyrics': ['p.pumSum'],
+    },
+    'musica.com': {
+        'artists': ['a[href^="letras.asp?letras="]'],
+        'songs': ['a[href^="letras.asp?letra="]'],
+        'lyrics': ['tr > td > p'],
+    },
+}
+
+
+class Element(object):
+    """
+    An open element of a scanned page. Its attributes are parsed on first
+    use.
+    """
+
+    __slots__ = ['tag', 'raw_attrs', '_attrs']
+
+    def __init__(self, tag, raw_attrs):
+        self.tag = tag
+        self.raw_attrs = raw_attrs
+        self._attrs = None
+
+    @property
+    def attrs(self):
+        if self._attrs is None:
+            self._attrs = {}
+            for name, double_quoted, single_quoted, unquoted in ATTRIBUTE_REGEX.findall(self.raw_attrs):
+                value = double_quoted or single_quoted or unquoted
+                self._attrs.setdefault(name.lower(), html.unescape(value) if '&' in value else value)
+        return self._attrs
+
+
+class CompoundSelector(object):
+    """
+    One element of a selector chain: a tag name and the classes, id and
+    attribute prefixes the element must have.
+    """
+
+    def __init__(self, tag, classes, element_id, prefixes):
+        self.tag = tag
+        self.classes = classes
+        self.element_id = element_id
+        self.prefixes = prefixes
+        self.has_conditions = bool(classes or element_id is not None or prefixes)
+
+    def matches(self, element):
+        """
+        Tests an element, any object with a tag name and a dictionary of
+        attributes.
+        """
+        if self.tag is not None and self.tag != element.tag:
+            return False
+        if not self.has_conditions:
+            return True
+
+        attrs = element.attrs
+        if self.classes and not self.classes.issubset((attrs.get('class') or '').split()):
+            return False
+        if self.element_id is not None and attrs.get('id') != self.element_id:
+            return False
+        for name, prefix in self.prefixes:
+            if not (attrs.get(name) or '').startswith(prefix):
+                return False
+        return True
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector):
+    """
+    Compiles a selector.
+
+    Returns:
+    A tuple of CompoundSelector, from the outermost element to the matched
+    one.
+    """
+    compounds = []
+    for compound in selector.split('>'):
+        match = COMPOUND_REGEX.match(compound.strip())
+        if not compound.strip() or match is None:
+            raise ValueError('Invalid selector: {}'.format(selector))
+
+        tag = match.group(1) if match.group(1) != '*' else None
+        classes, element_id, prefixes = set(), None, []
+        for class_name, id_name, attribute, prefix in CONDITION_REGEX.findall(match.group(2)):
+            if class_name:
+                classes.add(class_name)
+            elif id_name:
+                element_id = id_name
+            else:
+                prefixes.append((attribute, prefix))
+        compounds.append(CompoundSelector(tag.lower() if tag else None, frozenset(classes), element_id,
+                                          tuple(prefixes)))
+    return tuple(compounds)
+
+
+def matches_stack(compounds, stack):
+    """
+    Tests a selector on the last element of a stack of open elements.
+    """
+    if len(compounds) > len(stack):
+        return False
+    for compound, element in zip(reversed(compounds), reversed(stack)):
+        if not compound.matches(element):
+            return False
+    return True
+
+
+def break_line(parts):
+    """
+    Ends the current line of the text parts of a capture at a block boundary,
+    unless the text is empty or already ends a line, so consecutive
+    boundaries do not add blank lines.
+    """
+    for part in reversed(parts):
+        part = part.rstrip(' \t')
+        if part:
+            if not part.endswith('\n'):
+                parts.append('\n')
+            return
+
+
+def scan(text, selectors):
+    """
+    Collects the elements of a page matched by a list of compiled selectors,
+    in a single pass.
+
+    Returns:
+    A list with the (attributes, text) tuples of the matches of each
+    selector.
+    """
+    ## Selectors that may match an element, by tag. None for any tag.
+    selectors_by_tag = {}
+    for index, compounds in enumerate(selectors):
+        selectors_by_tag.setdefault(compounds[-1].tag, []).append((index, compounds))
+    any_tag_selectors = selectors_by_tag.pop(None, [])
+
+    stack = []
+    ## [depth, selector index, element, text parts] of the matched elements
+    ## whose end tag is not reached yet.
+    captures = []
+    matches = [[] for _ in selectors]
+
+    def pop_elements(depth):
+        del stack[depth:]
+        while captures and captures[-1][0] > depth:
+            _, index, element, parts = captures.pop()
+            matches[index].append((element.attrs, ''.join(parts).strip()))
+
+    position = 0
+    end = len(text)
+    while position < end:
+        match = TAG_REGEX.search(text, position)
+        if captures:
+            data = text[position:match.start() if match else end]
+            if data:
+                if '&' in data:
+                    data = html.unescape(data)
+                for capture in captures:
+                    capture[3].append(data)
+        if match is None:
+            break
+        position = match.end()
+        tag = match.group(2)
+        if tag is None:
+            continue
+        tag = tag.lower()
+
+        if tag in BLOCK_ELEMENTS:
+            for capture in captures:
+                break_line(capture[3])
+
+        if match.group(1):
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth].tag == tag:
+                    pop_elements(depth)
+                    break
+            continue
+
+        if tag == 'br':
+            for capture in captures:
+                capture[3].append('\n')
+            continue
+
+        while stack and tag in IMPLICITLY_CLOSED.get(stack[-1].tag, ()):
+            pop_elements(len(stack) - 1)
+
+        element = Element(tag, match.group(3))
+        stack.append(element)
+        candidates = selectors_by_tag.get(tag)
+        if candidates or any_tag_selectors:
+            for index, compounds in (candidates or []) + any_tag_selectors:
+                if matches_stack(compounds, stack):
+                    captures.append([len(stack), index, element, []])
+
+        if tag in RAW_TEXT_END_REGEXES:
+            raw_end = RAW_TEXT_END_REGEXES[tag].search(text, position)
+            raw_text = text[position:raw_end.start() if raw_end else end]
+            for capture in captures:
+                capture[3].append(raw_text)
+            position = raw_end.end() if raw_end else end
+            pop_elements(len(stack) - 1)
+        elif tag in VOID_ELEMENTS or match.group(3).endswith('/'):
+            pop_elements(len(stack) - 1)
+
+    pop_elements(0)
+    return matches
+
+
+def decode_page(page):
+    """
+    Decodes the bytes of a page with the charset of its meta tag, or
+    DEFAULT_ENCODING.
+    """
+    if isinstance(page, str):
+        return page
+    match = CHARSET_REGEX.search(page, 0, 4096)
+    encoding = match.group(1).decode('ascii') if match else DEFAULT_ENCODING
+    try:
+        return page.decode(encoding, errors='replace')
+    except LookupError:
+        return page.decode(DEFAULT_ENCODING, errors='replace')
+
+
+def select(page, selectors):
+    """
+    Finds the elements of a page matched by a list of selectors, in a single
+    pass.
+
+    Arguments:
+    page -- The page, as bytes or text.
+    selectors -- A list of selectors. The first one with matches is used, the
+    others are fallbacks.
+
+    Returns:
+    A list of (attributes, text) tuples, one for each matched element in the
+    order of the page, with its attributes dictionary and its text.
+    """
+    if not selectors:
+        raise ValueError('Invalid list of selectors. Must not be empty.')
+
+    for matches in scan(decode_page(page), [compile_selector(selector) for selector in selectors]):
+        if matches:
+            return matches
+    return []
+
+
+def extract_links(page, selectors):
+    """
+    Returns the (href, text) tuples of the links of a page matched by a list
+    of selectors, see select.
+    """
+    return [(attrs['href'], text) for attrs, text in select(page, selectors) if attrs.get('href')]
+
+
+def extract_texts(page, selectors):
+    """
+    Returns the texts of the elements of a page matched by a list of
+    selectors, see select.
+    """
+    return [text for _, text in select(page, selectors)]
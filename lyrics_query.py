@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Near-duplicate queries for single lyrics against a saved LSH index.
+
+The index, its signatures and the key dictionary are loaded once and kept
+between queries. A query normalizes the lyrics like the indexed corpus (see
+normalize_lyrics), hashes them the same way as the index (see
+build_hash_index.build_shingle_list and build_minhash), looks up its bands and
+ranks the songs found by the Jaccard similarity estimated from the signatures,
+the fraction of equal MinHash values.
+"""
+
+import numpy as np
+from batch_minhash import build_signature_matrix, build_lyrics_hashes
+from normalize_lyrics import normalize_lyrics
+from lsh_store import MappedLSHIndex
+from song_keys import load_key_dictionary, KEY_DICTIONARY_FILE
+
+DEFAULT_TOP_K = 10
+
+
+class LyricsQueryIndex(object):
+    """
+    Usage:
+        query_index = LyricsQueryIndex(index_path)
+        for key, similarity in query_index.query(lyrics, k=5):
+            ...
+    """
+
+    def __init__(self, index_path, key_dictionary_path=KEY_DICTIONARY_FILE, mmap_mode='r'):
+        """
+        Arguments:
+        index_path -- The directory of an index saved by lsh_store.save_lsh_index.
+        key_dictionary_path -- The key dictionary of the song ids of the index.
+        mmap_mode -- Passed to MappedLSHIndex. None loads the whole index into
+        memory, which avoids page faults on the first queries.
+        """
+        self.index = MappedLSHIndex(index_path, mmap_mode=mmap_mode)
+        if self.index.shingle_size is None:
+            raise ValueError('LSH index {} has no shingle size.'.format(index_path))
+        self.id_to_key, _ = load_key_dictionary(key_dictionary_path)
+
+    def get_signature(self, lyrics):
+        """
+        Returns the MinHash signature of a lyric, or None if it has no
+        shingles. The lyric is normalized first, as the indexed songs were.
+        """
+        hashes = build_lyrics_hashes(normalize_lyrics(lyrics), self.index.shingle_size, self.index.token_shingles)
+        if len(hashes) == 0:
+            return None
+
+        return build_signature_matrix([hashes], num_perm=self.index.num_perm, seed=self.index.seed)[0]
+
+    def query_signature(self, signature, k=DEFAULT_TOP_K):
+        """
+        Returns the top-k songs of the index that share a band with a
+        signature.
+
+        Arguments:
+        signature -- A MinHash signature with the permutations of the index.
+        k -- The maximum number of songs returned.
+
+        Returns:
+        A list of (song_id, estimated_jaccard) tuples, from the most similar.
+        Songs with the same similarity are sorted by id.
+        """
+        if k <= 0:
+            raise ValueError('Invalid k. Must be larger than 0.')
+
+        rows = self.index.query_rows(signature)
+        if len(rows) == 0:
+            return []
+
+        similarities = np.count_nonzero(self.index.get_signature_rows(rows) == signature[:self.index.num_perm],
+                                        axis=1) / float(self.index.num_perm)
+        song_ids = self.index.song_ids[rows]
+        if len(rows) > k:
+            ## Only the k best are sorted.
+            top = np.argpartition(-similarities, k - 1)[:k]
+            similarities, song_ids = similarities[top], song_ids[top]
+        order = np.lexsort((song_ids, -similarities))
+        return [(int(song_ids[i]), float(similarities[i])) for i in order]
+
+    def query(self, lyrics, k=DEFAULT_TOP_K):
+        """
+        Returns the top-k songs of the index that may be near duplicates of a
+        lyric.
+
+        Arguments:
+        lyrics -- The text of the lyric.
+        k -- The maximum number of songs returned.
+
+        Returns:
+        A list of ('website|artist|song', estimated_jaccard) tuples, from the
+        most similar. Empty if the lyric has no shingles or no song shares a
+        band with it.
+        """
+        signature = self.get_signature(lyrics)
+        if signature is None:
+            return []
+        return [(self.id_to_key[song_id], similarity)
+                for song_id, similarity in self.query_signature(signature, k)]
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Normalization of the lyrics of the crawled corpus.
+
+Each lyric goes through the following steps:
+
+    1. HTML residue: entities are unescaped, line break tags become new lines
+       and every other tag is removed.
+    2. Lowercasing.
+    3. Accent folding and punctuation removal, with a single str.translate
+       call over NORMALIZATION_TABLE, which is built once when the module is
+       imported.
+    4. Runs of whitespace become a single space, and empty lines are removed.
+
+The corpus is streamed in chunks to a pool of worker processes and the
+normalized corpus is written once, as a corpus_store corpus, so the later
+stages read clean lyrics.
+"""
+
+import os
+import re
+import sys
+import html
+import unicodedata
+from multiprocessing import Pool
+from job_scheduler import get_num_cpus
+from corpus_store import CorpusWriter, load_dataset
+
+INPUT_PICKLE_FILE = os.path.join('out', 'lyrics_pickle_processed_dict')
+NORMALIZED_CORPUS_PATH = os.path.join('out', 'lyrics_normalized')
+CHUNK_SIZE = 5000
+LINE_BREAK_REGEX = re.compile(r'<\s*br\s*/?\s*>|<\s*/?\s*p\s*/?\s*>', re.IGNORECASE)
+HTML_TAG_REGEX = re.compile(r'<[^<>]*>')
+## Letters that do not decompose into a base letter and accents.
+SPECIAL_FOLDS = {'ß': 'ss', 'æ': 'ae', 'œ': 'oe', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ł': 'l', 'ı': 'i'}
+## Removed without leaving a space, so contractions stay a single token.
+APOSTROPHES = '\'`´‘’'
+
+
+def build_normalization_table():
+    """
+    Builds the str.translate table that folds the accented lowercase letters
+    of the Latin blocks to ASCII and replaces punctuation by spaces.
+    """
+    table = {}
+    for code in range(0xc0, 0x250):
+        char = chr(code)
+        if char != char.lower():
+            continue
+        folded = ''.join(c for c in unicodedata.normalize('NFKD', char) if not unicodedata.combining(c))
+        if folded != char and folded.isascii() and folded.isalpha():
+            table[code] = folded
+    for char, folded in SPECIAL_FOLDS.items():
+        table[ord(char)] = folded
+
+    ## Every punctuation and symbol character of the Latin-1, general
+    ## punctuation and currency blocks.
+    for code in list(range(0x21, 0x100)) + list(range(0x2010, 0x20d0)):
+        category = unicodedata.category(chr(code))
+        if category[0] in 'PS':
+            table[code] = ' '
+    for char in APOSTROPHES:
+        table[ord(char)] = None
+    return str.maketrans(table)
+
+
+NORMALIZATION_TABLE = build_normalization_table()
+
+
+def strip_html(lyrics):
+    """
+    Unescapes the HTML entities of a lyric, replaces its line break tags by
+    new lines and removes every other tag.
+    """
+    if '&' in lyrics:
+        lyrics = html.unescape(lyrics)
+    if '<' in lyrics:
+        lyrics = HTML_TAG_REGEX.sub(' ', LINE_BREAK_REGEX.sub('\n', lyrics))
+    return lyrics
+
+
+def normalize_lyrics(lyrics):
+    """
+    Normalizes a single lyric.
+
+    Arguments:
+    lyrics -- The text of the lyric.
+
+    Returns:
+    The normalized lyric, with one line per non-empty line of the original.
+    """
+    if lyrics is None:
+        raise ValueError('Invalid lyrics.')
+    lyrics = strip_html(lyrics).lower().translate(NORMALIZATION_TABLE)
+    return '\n'.join(' '.join(tokens) for tokens in (line.split() for line in lyrics.splitlines()) if tokens)
+
+
+def normalize_chunk(items):
+    """
+    Normalizes a chunk of (key, lyrics) tuples.
+    """
+    return [(key, normalize_lyrics(lyrics)) for key, lyrics in items]
+
+
+def iter_chunks(dataset, chunk_size=CHUNK_SIZE):
+    """
+    Returns a generator of lists of at most chunk_size (key, lyrics) tuples of
+    a dataset.
+    """
+    chunk = []
+    for item in dataset.items():
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_normalized_chunks(dataset, num_processes=None, chunk_size=CHUNK_SIZE):
+    """
+    Normalizes the lyrics of a dataset on a pool of worker processes.
+
+    Arguments:
+    dataset -- A dictionary or corpus_store.MappedCorpus mapping song keys to
+    lyrics. It is read one chunk at a time.
+    num_processes -- The number of worker processes. Default value is None,
+    meaning the number of cores.
+    chunk_size -- The number of lyrics sent to a worker at once.
+
+    Returns:
+    A generator of lists of (key, normalized lyrics) tuples, in the order of
+    the dataset.
+    """
+    if num_processes is None:
+        num_processes = get_num_cpus()
+    if num_processes <= 1:
+        for chunk in iter_chunks(dataset, chunk_size):
+            yield normalize_chunk(chunk)
+        return
+
+    with Pool(processes=num_processes) as pool:
+        for normalized_chunk in pool.imap(normalize_chunk, iter_chunks(dataset, chunk_size)):
+            yield normalized_chunk
+
+
+def normalize_dataset(dataset, num_processes=None, chunk_size=CHUNK_SIZE):
+    """
+    In-memory counterpart of write_normalized_dataset.
+
+    Returns:
+    A dictionary with the same keys, in the same order, and the normalized
+    lyrics.
+    """
+    normalized_dataset = {}
+    for normalized_chunk in iter_normalized_chunks(dataset, num_processes, chunk_size):
+        normalized_dataset.update(normalized_chunk)
+    return normalized_dataset
+
+
+def write_normalized_dataset(input_path=INPUT_PICKLE_FILE, output_path=NORMALIZED_CORPUS_PATH,
+                             num_processes=None):
+    """
+    Normalizes a dataset and streams the result to a corpus (see
+    corpus_store), one chunk at a time.
+
+    Arguments:
+    input_path -- A pickled {website|artist|song-name: lyrics} dictionary or a
+    corpus.
+    output_path -- The directory of the normalized corpus.
+    num_processes -- The number of worker processes.
+
+    Returns:
+    The number of songs written.
+    """
+    dataset = load_dataset(input_path)
+    writer = CorpusWriter(output_path)
+    num_normalized_characters = 0
+    for normalized_chunk in iter_normalized_chunks(dataset, num_processes):
+        writer.add_items(normalized_chunk)
+        num_normalized_characters += sum(len(lyrics) for _, lyrics in normalized_chunk)
+    num_songs = writer.close()
+
+    print('Normalized {} lyrics, {} characters.'.format(num_songs, num_normalized_characters))
+    return num_songs
+
+
+def main():
+    input_path = sys.argv[1] if len(sys.argv) > 1 else INPUT_PICKLE_FILE
+    output_path = sys.argv[2] if len(sys.argv) > 2 else NORMALIZED_CORPUS_PATH
+    write_normalized_dataset(input_path, output_path)
+
+
+if __name__ == '__main__':
+    main()
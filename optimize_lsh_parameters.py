@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Analytical search of the LSH parameters.
+
+Two songs with Jaccard similarity s share at least one of b bands of r rows
+with probability 1 - (1 - s^r)^b. Given the Jaccard similarities of the ground
+truth pairs and of a uniform sample of the other pairs of the training set,
+the expected number of true and false candidates of every (b, r) split follows
+without building any index:
+
+    E[true candidates]  = sum over ground truth pairs of P(s)
+    E[false candidates] = (number of other pairs) * mean over sampled pairs of P(s)
+
+The similarities are computed once per shingle size, then the precision,
+recall and number of candidates are predicted for every b * r <= num_perm of
+each number of permutations of the sweep. The best predictions are checked by
+building their indexes.
+
+The sample of other pairs may miss rare near-duplicates that are not in the
+ground truth, so the predicted precision is an upper bound when they exist.
+"""
+
+import os
+import numpy as np
+from datasketch import MinHashLSH
+from batch_minhash import build_lyrics_hashes, load_signature_file, insert_signatures, get_jaccard
+from build_hash_index import SHINGLE_SIZES, NUM_PERMUTATIONS, TOKEN_SHINGLES, TRAIN_DATASET_FILE
+from build_hash_index import get_signature_paths, get_possible_duplicates
+from corpus_store import load_dataset, get_lyrics_by_id
+from candidate_pairs import pack_pairs, unpack_pairs, pack_bucket_pairs, count_common_pairs
+from find_duplicates import TRAIN_GT_FILE
+from song_keys import load_key_dictionary, load_ground_truth
+
+PREDICTIONS_FILE = os.path.join('out', 'lsh_parameter_predictions.csv')
+NUM_SAMPLED_PAIRS = 100000
+## Configurations are ranked by predicted precision among the ones with at
+## least this predicted recall.
+TARGET_RECALL = 0.95
+NUM_VERIFIED = 3
+SEED = 1
+
+
+def get_pair_similarities(pairs, lyrics_by_id, shingle_size):
+    """
+    Computes the exact Jaccard similarity of the shingle sets of pairs of songs.
+
+    Arguments:
+    pairs -- An (n, 2) array of song ids.
+    lyrics_by_id -- The lyrics of each song id, None for the songs that are not
+    in the dataset, see corpus_store.get_lyrics_by_id.
+    shingle_size -- The size of the n-grams.
+
+    Returns:
+    An array with the similarity of each pair.
+    """
+    hashes = {}
+
+    def get_hashes(song_id):
+        if song_id not in hashes:
+            hashes[song_id] = build_lyrics_hashes(lyrics_by_id[song_id], shingle_size, TOKEN_SHINGLES)
+        return hashes[song_id]
+
+    return np.array([get_jaccard(get_hashes(id_a), get_hashes(id_b)) for id_a, id_b in pairs.tolist()])
+
+
+def sample_other_pairs(song_ids, ground_truth, num_pairs, seed=SEED):
+    """
+    Samples pairs of distinct songs uniformly, leaving out the ground truth
+    pairs.
+
+    Returns:
+    An (n, 2) array of song ids, n <= num_pairs.
+    """
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    random_state = np.random.RandomState(seed)
+    first = song_ids[random_state.randint(0, len(song_ids), num_pairs)]
+    second = song_ids[random_state.randint(0, len(song_ids), num_pairs)]
+    packed_pairs = np.unique(pack_pairs(first[first != second], second[first != second]))
+    if len(ground_truth):
+        positions = np.minimum(np.searchsorted(ground_truth, packed_pairs), len(ground_truth) - 1)
+        packed_pairs = packed_pairs[np.asarray(ground_truth)[positions] != packed_pairs]
+    return unpack_pairs(packed_pairs)
+
+
+def get_candidate_probability(similarities, b, r):
+    """
+    Returns the probability of each similarity to share a band, 1 - (1 - s^r)^b.
+    """
+    return 1.0 - (1.0 - similarities ** r) ** b
+
+
+def predict_parameters(gt_similarities, other_similarities, num_other_pairs, num_perm):
+    """
+    Predicts the precision, recall and number of candidates of every (b, r)
+    split of num_perm permutations.
+
+    Arguments:
+    gt_similarities -- The similarities of the ground truth pairs.
+    other_similarities -- The similarities of a sample of the other pairs.
+    num_other_pairs -- The number of pairs of the dataset that are not in the
+    ground truth.
+    num_perm -- The number of permutations.
+
+    Returns:
+    A list of dictionaries with the keys b, r, precision, recall and
+    candidates.
+    """
+    predictions = []
+    for r in range(1, num_perm + 1):
+        for b in range(1, num_perm // r + 1):
+            true_candidates = get_candidate_probability(gt_similarities, b, r).sum()
+            false_candidates = num_other_pairs * get_candidate_probability(other_similarities, b, r).mean()
+            candidates = true_candidates + false_candidates
+            predictions.append({'b': b,
+                                'r': r,
+                                'precision': true_candidates / candidates if candidates > 0 else 0.0,
+                                'recall': true_candidates / max(len(gt_similarities), 1),
+                                'candidates': candidates})
+    return predictions
+
+
+def rank_predictions(predictions, target_recall=TARGET_RECALL):
+    """
+    Sorts predictions by precision among the ones that reach the target recall,
+    followed by the others by recall.
+    """
+    return sorted(predictions, key=lambda p: (p['recall'] < target_recall,
+                                              -p['precision'] if p['recall'] >= target_recall else -p['recall'],
+                                              p['b'] * p['r']))
+
+
+def verify_parameters(song_ids, signatures, ground_truth, num_perm, b, r):
+    """
+    Builds the MinHashLSH index of a (b, r) split and measures its actual
+    precision, recall and number of candidates.
+    """
+    lsh = MinHashLSH(num_perm=num_perm, params=(b, r))
+    insert_signatures(lsh, song_ids, signatures[:, :num_perm])
+    lsh_pairs = pack_bucket_pairs(get_possible_duplicates(lsh))
+    num_actual_matches = count_common_pairs(lsh_pairs, ground_truth)
+    precision = num_actual_matches / len(lsh_pairs) if len(lsh_pairs) else 0.0
+    return precision, num_actual_matches / len(ground_truth), len(lsh_pairs)
+
+
+def optimize(shingle_size, train_dataset, ground_truth, id_to_key, key_to_id):
+    """
+    Predicts the parameter surface of one shingle size, appends it to
+    PREDICTIONS_FILE and verifies the best configurations of each number of
+    permutations.
+
+    Returns:
+    The best prediction of the shingle size, with its num_perm.
+    """
+    signature_path, keys_path = get_signature_paths(shingle_size)
+    song_ids, signatures = load_signature_file(signature_path, keys_path)
+
+    lyrics_by_id = get_lyrics_by_id(train_dataset, key_to_id, len(id_to_key))
+
+    gt_similarities = get_pair_similarities(unpack_pairs(ground_truth), lyrics_by_id, shingle_size)
+    other_similarities = get_pair_similarities(sample_other_pairs(song_ids, ground_truth, NUM_SAMPLED_PAIRS),
+                                               lyrics_by_id, shingle_size)
+    num_other_pairs = len(song_ids) * (len(song_ids) - 1) // 2 - len(ground_truth)
+    print('Shingle size {}: mean similarity {:.3f} for {} ground truth pairs, {:.4f} for {} sampled pairs.'.format(
+        shingle_size, gt_similarities.mean(), len(gt_similarities),
+        other_similarities.mean(), len(other_similarities)))
+
+    if not os.path.exists(PREDICTIONS_FILE):
+        with open(PREDICTIONS_FILE, 'w+') as predictions_out:
+            print('Shingle.Size, Num.Hashes, Num.Bands, Rows.Per.Band, Precision, Recall, Candidates',
+                  file=predictions_out)
+
+    best_predictions = []
+    for num_perm in NUM_PERMUTATIONS:
+        predictions = rank_predictions(predict_parameters(gt_similarities, other_similarities,
+                                                          num_other_pairs, num_perm))
+        best_predictions.append(dict(predictions[0], num_perm=num_perm, shingle_size=shingle_size))
+        with open(PREDICTIONS_FILE, 'a') as predictions_out:
+            for p in predictions:
+                print('{}, {}, {}, {}, {}, {}, {:.1f}'.format(shingle_size, num_perm, p['b'], p['r'],
+                                                              p['precision'], p['recall'], p['candidates']),
+                      file=predictions_out)
+
+        for p in predictions[:NUM_VERIFIED]:
+            precision, recall, num_candidates = verify_parameters(song_ids, signatures, ground_truth,
+                                                                  num_perm, p['b'], p['r'])
+            print('(shingle_size = {}, num_hashes = {}, b = {}, r = {}) => predicted P = {:.4f}; R = {:.4f}; '
+                  'candidates = {:.0f}, actual P = {:.4f}; R = {:.4f}; candidates = {}'.format(
+                      shingle_size, num_perm, p['b'], p['r'], p['precision'], p['recall'],
+                      p['candidates'], precision, recall, num_candidates))
+
+    ## Ties keep the smallest number of permutations, the first of the sweep.
+    return rank_predictions(best_predictions)[0]
+
+
+def main():
+    train_dataset = load_dataset(TRAIN_DATASET_FILE)
+    id_to_key, key_to_id = load_key_dictionary()
+    ground_truth = load_ground_truth(TRAIN_GT_FILE, key_to_id)
+    if len(ground_truth) == 0:
+        print('INVALID GROUND TRUTH FILE')
+        exit(1)
+
+    best_predictions = [optimize(shingle_size, train_dataset, ground_truth, id_to_key, key_to_id)
+                        for shingle_size in SHINGLE_SIZES]
+    best = rank_predictions(best_predictions)[0]
+    print('Recommended: shingle_size = {}, num_hashes = {}, b = {}, r = {} (predicted P = {:.4f}; R = {:.4f}).'.format(
+        best['shingle_size'], best['num_perm'], best['b'], best['r'], best['precision'], best['recall']))
+
+
+if __name__ == '__main__':
+    main()
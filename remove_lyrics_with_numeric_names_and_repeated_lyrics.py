@@ -4,6 +4,7 @@
 
 import sys
 import pickle
+from song_keys import build_key_dictionary
 
 
 def usage(scriptname):
@@ -46,3 +47,6 @@ if __name__ == "__main__":
     
     with open(pickle_processed_dict_filename, "wb") as pickle_processed_dict_file:
         pickle.dump(dict_lyrics, pickle_processed_dict_file)
+
+    # Every later stage refers to the songs by their id in this dictionary.
+    build_key_dictionary(dict_lyrics.keys())
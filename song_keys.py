@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Song key interning.
+
+Every song is identified by a 'website|artist|song' key. The key dictionary
+assigns each key of the processed corpus a dense int32 id, and is shared by
+the train, validation and test sets, which are subsets of that corpus. Pair
+collections (candidate pairs and ground truth matches) are stored as sorted
+arrays of packed np.uint64 (min_id << 32) | max_id values, and keys are only
+resolved back to strings when reporting.
+"""
+
+import os
+import pickle
+import numpy as np
+from candidate_pairs import pack_pairs, unpack_pairs
+
+KEY_DICTIONARY_FILE = os.path.join('out', 'song_key_dictionary')
+
+
+def build_key_dictionary(keys, key_dictionary_path=KEY_DICTIONARY_FILE):
+    """
+    Assigns an id to each song key, in the given order, and saves the
+    dictionary.
+
+    Arguments:
+    keys -- An iterable with the keys of the whole processed corpus.
+    key_dictionary_path -- Where to save the dictionary.
+
+    Returns:
+    The list of keys, indexed by id.
+    """
+    id_to_key = list(keys)
+    if len(id_to_key) == 0:
+        raise ValueError('Invalid list of keys.')
+    if len(id_to_key) > np.iinfo(np.int32).max:
+        raise ValueError('Too many keys for int32 ids.')
+
+    with open(key_dictionary_path, 'wb') as dictionary_out:
+        pickle.dump(id_to_key, dictionary_out)
+    return id_to_key
+
+
+def load_key_dictionary(key_dictionary_path=KEY_DICTIONARY_FILE):
+    """
+    Loads a key dictionary saved by build_key_dictionary.
+
+    Returns:
+    The list of keys indexed by id, and a dictionary mapping each key to its id.
+    """
+    if not os.path.exists(key_dictionary_path):
+        raise ValueError('Key dictionary {} not found. It is built by '
+                         'remove_lyrics_with_numeric_names_and_repeated_lyrics.'.format(key_dictionary_path))
+
+    with open(key_dictionary_path, 'rb') as dictionary_in:
+        id_to_key = pickle.load(dictionary_in)
+    key_to_id = {key: key_id for key_id, key in enumerate(id_to_key)}
+    return id_to_key, key_to_id
+
+
+def extend_key_dictionary(keys, key_dictionary_path=KEY_DICTIONARY_FILE):
+    """
+    Appends the keys that are not in a saved key dictionary, e.g. the songs of
+    a new crawl, keeping the ids already assigned.
+
+    Returns:
+    The updated list of keys indexed by id and dictionary mapping each key to
+    its id.
+    """
+    id_to_key, key_to_id = load_key_dictionary(key_dictionary_path)
+    for key in keys:
+        if key not in key_to_id:
+            key_to_id[key] = len(id_to_key)
+            id_to_key.append(key)
+    build_key_dictionary(id_to_key, key_dictionary_path)
+    return id_to_key, key_to_id
+
+
+def keys_to_ids(keys, key_to_id):
+    """
+    Returns an np.int32 array with the id of each key.
+    """
+    return np.fromiter((key_to_id[key] for key in keys), dtype=np.int32, count=len(keys))
+
+
+def pack_key_pairs(key_pairs, key_to_id):
+    """
+    Converts a collection of (key1, key2) tuples, e.g. the match set of a
+    ground truth, to a sorted array of unique packed pairs. Both orientations
+    of a pair map to the same value.
+    """
+    key_pairs = list(key_pairs)
+    first_ids = keys_to_ids([pair[0] for pair in key_pairs], key_to_id)
+    second_ids = keys_to_ids([pair[1] for pair in key_pairs], key_to_id)
+    return np.unique(pack_pairs(first_ids, second_ids))
+
+
+def resolve_pairs(packed_pairs, id_to_key):
+    """
+    Converts packed pairs back to a list of (key1, key2) tuples, for reports.
+    """
+    return [(id_to_key[first_id], id_to_key[second_id])
+            for first_id, second_id in unpack_pairs(packed_pairs).tolist()]
+
+
+def save_ground_truth(ground_truth_path, packed_pairs):
+    """
+    Saves ground truth matches as a .npy array of sorted packed pairs. The
+    number of matches is the length of the array.
+    """
+    with open(ground_truth_path, 'wb') as file_out:
+        np.save(file_out, np.unique(np.asarray(packed_pairs, dtype=np.uint64)))
+
+
+def load_ground_truth(ground_truth_path, key_to_id=None, mmap_mode=None):
+    """
+    Loads a ground truth file as a sorted array of packed pairs.
+
+    Arguments:
+    ground_truth_path -- A file written by save_ground_truth, or a legacy
+    pickle of (count, match_set) with string key tuples.
+    key_to_id -- The key dictionary. Only needed for legacy files.
+    mmap_mode -- Passed to np.load, e.g. 'r' to memory-map the array.
+
+    Returns:
+    A sorted np.uint64 array of unique packed pairs.
+    """
+    with open(ground_truth_path, 'rb') as file_in:
+        magic = file_in.read(len(np.lib.format.MAGIC_PREFIX))
+
+    if magic == np.lib.format.MAGIC_PREFIX:
+        return np.load(ground_truth_path, mmap_mode=mmap_mode)
+
+    if key_to_id is None:
+        raise ValueError('A key dictionary is needed to read a legacy ground truth file.')
+
+    with open(ground_truth_path, 'rb') as file_in:
+        _, match_set = pickle.load(file_in)
+    return pack_key_pairs(match_set, key_to_id)
@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import pickle
-from datasketch import MinHash, MinHashLSH
+import numpy as np
 from multiprocessing import Process
 from build_hash_index import build_shingle_list
 from build_hash_index import build_minhash
 from build_hash_index import get_possible_duplicates
-from find_duplicates import build_lsh_keypair_set
+from candidate_pairs import pack_bucket_pairs, count_common_pairs
+from song_keys import load_key_dictionary, load_ground_truth
+from corpus_store import load_dataset
+from lsh_forest import build_lsh_index, ENGINE_MINHASH, DEFAULT_NUM_TREES
 
 LSH_PARAMETERS = (0.10,  5, 128)
+## Index engine, one of lsh_forest.ENGINES.
+LSH_ENGINE = ENGINE_MINHASH
+FOREST_TREES = DEFAULT_NUM_TREES
 
 def usage():
     print('./{} test_dataset test_ground_truth_dataset'.format(sys.argv[0]))
@@ -21,9 +26,8 @@ def run(test_set, test_gt_set, parameter_tuple):
     lsh_shingle_size = parameter_tuple[1]
     lsh_num_hash = parameter_tuple[2]
 
-    lsh = MinHashLSH(threshold=lsh_threshold,
-                     num_perm=lsh_num_hash)
-
+    song_ids = []
+    signatures = []
     for key, lyrics in test_set.items():
         if len(lyrics) == 0:
             continue
@@ -32,24 +36,17 @@ def run(test_set, test_gt_set, parameter_tuple):
             continue
 
         mhash = build_minhash(shingle_list, num_perm=lsh_num_hash)
-        try:
-            lsh.insert(key, mhash)
-        except ValueError:
-            print('Repeated Key = {}'.format(key))
-
-    lsh_key_set = build_lsh_keypair_set(get_possible_duplicates(lsh))
-    num_matches_lsh = len(lsh_key_set)
-    num_actual_matches = 0
-    match_set = test_gt_set[1]
+        song_ids.append(key)
+        signatures.append(mhash.hashvalues)
 
-    for key_pair in lsh_key_set:
-        if key_pair in match_set:
-            num_actual_matches += 1
-        if key_pair[::-1] in match_set:
-            num_actual_matches += 1
+    lsh = build_lsh_index(LSH_ENGINE, lsh_threshold, lsh_num_hash, song_ids, np.array(signatures),
+                          FOREST_TREES)
+    lsh_pairs = pack_bucket_pairs(get_possible_duplicates(lsh))
+    num_matches_lsh = len(lsh_pairs)
+    num_actual_matches = count_common_pairs(lsh_pairs, test_gt_set)
 
-    precision = (num_actual_matches // 2) / num_matches_lsh
-    recall = (num_actual_matches // 2) / test_gt_set[0]
+    precision = num_actual_matches / num_matches_lsh
+    recall = num_actual_matches / len(test_gt_set)
 
     print('(thresh = {}, num_hashes = {}, shingle_size = {}) => P = {}; R = {}'.format(lsh_threshold,
                                                                                        lsh_num_hash,
@@ -62,13 +59,13 @@ def main():
         usage()
         exit(1)
 
-    test_set = {}
-    with open(sys.argv[1], 'rb') as test_set_in:
-        test_set = pickle.load(test_set_in)
+    _, key_to_id = load_key_dictionary()
+
+    test_set = load_dataset(sys.argv[1])
+    ## The songs are indexed by their ids in the key dictionary.
+    test_set = dict((key_to_id[key], lyrics) for key, lyrics in test_set.items())
 
-    test_gt = set()
-    with open(sys.argv[2], 'rb') as test_gt_in:
-        test_gt = pickle.load(test_gt_in)
+    test_gt = load_ground_truth(sys.argv[2], key_to_id)
 
     run(test_set, test_gt, LSH_PARAMETERS)
 
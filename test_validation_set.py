@@ -2,19 +2,24 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import pickle
-from datasketch import MinHash, MinHashLSH
-from multiprocessing import Process
+import numpy as np
 from build_hash_index import build_shingle_list
 from build_hash_index import build_minhash
 from build_hash_index import get_possible_duplicates
-from find_duplicates import build_lsh_keypair_set
+from candidate_pairs import pack_bucket_pairs, count_common_pairs
+from song_keys import load_key_dictionary, load_ground_truth
+from corpus_store import load_dataset
+from lsh_forest import build_lsh_index, ENGINE_MINHASH, DEFAULT_NUM_TREES
+from job_scheduler import run_jobs
 
 LSH_PARAMETERS = [(0.01, 10,  64),  ## P = 0.066009708219382, R = 0.943741209563994
                   (0.50,  5, 128),  ## P = 0.085720778021916, R = 0.848925055254169
                   (0.30,  7,  64),  ## P = 0.079245407983045, R = 0.865461121157324
                   (0.10,  5, 128),  ## P = 0.086354372135589, R = 0.951758087201125
                   (0.50,  5,  64)]  ## P = 0.085093935514376, R = 0.853365481213582
+## Index engine, one of lsh_forest.ENGINES.
+LSH_ENGINE = ENGINE_MINHASH
+FOREST_TREES = DEFAULT_NUM_TREES
 
 
 
@@ -27,9 +32,8 @@ def run(validation_set, validation_gt_set, parameter_tuple):
     lsh_shingle_size = parameter_tuple[1]
     lsh_num_hash = parameter_tuple[2]
 
-    lsh = MinHashLSH(threshold=lsh_threshold,
-                     num_perm=lsh_num_hash)
-
+    song_ids = []
+    signatures = []
     for key, lyrics in validation_set.items():
         if len(lyrics) == 0:
             continue
@@ -38,24 +42,17 @@ def run(validation_set, validation_gt_set, parameter_tuple):
             continue
 
         mhash = build_minhash(shingle_list, num_perm=lsh_num_hash)
-        try:
-            lsh.insert(key, mhash)
-        except ValueError:
-            print('Repeated Key = {}'.format(key))
-
-    lsh_key_set = build_lsh_keypair_set(get_possible_duplicates(lsh))
-    num_matches_lsh = len(lsh_key_set)
-    num_actual_matches = 0
-    match_set = validation_gt_set[1]
+        song_ids.append(key)
+        signatures.append(mhash.hashvalues)
 
-    for key_pair in lsh_key_set:
-        if key_pair in match_set:
-            num_actual_matches += 1
-        if key_pair[::-1] in match_set:
-            num_actual_matches += 1
+    lsh = build_lsh_index(LSH_ENGINE, lsh_threshold, lsh_num_hash, song_ids, np.array(signatures),
+                          FOREST_TREES)
+    lsh_pairs = pack_bucket_pairs(get_possible_duplicates(lsh))
+    num_matches_lsh = len(lsh_pairs)
+    num_actual_matches = count_common_pairs(lsh_pairs, validation_gt_set)
 
-    precision = (num_actual_matches // 2) / num_matches_lsh
-    recall = (num_actual_matches // 2) / validation_gt_set[0]
+    precision = num_actual_matches / num_matches_lsh
+    recall = num_actual_matches / len(validation_gt_set)
 
     print('(thresh = {}, num_hashes = {}, shingle_size = {}) => P = {}; R = {}'.format(lsh_threshold,
                                                                                        lsh_num_hash,
@@ -68,22 +65,22 @@ def main():
         usage()
         exit(1)
 
-    validation_set = {}
-    with open(sys.argv[1], 'rb') as validation_set_in:
-        validation_set = pickle.load(validation_set_in)
+    _, key_to_id = load_key_dictionary()
+
+    validation_set = load_dataset(sys.argv[1])
+    ## The songs are indexed by their ids in the key dictionary.
+    validation_set = dict((key_to_id[key], lyrics) for key, lyrics in validation_set.items())
 
-    validation_gt = set()
-    with open(sys.argv[2], 'rb') as validation_gt_in:
-        validation_gt = pickle.load(validation_gt_in)
+    validation_gt = load_ground_truth(sys.argv[2], key_to_id)
 
-    process_pool = []
+    jobs = []
     for param_tuple in LSH_PARAMETERS:
-        p = Process(target=run, args=(validation_set, validation_gt, param_tuple))
-        process_pool.append(p)
-        p.start()
+        job_name = 'thresh-{}_shinglesize-{}_numperp-{}'.format(*param_tuple)
+        ## Lower thresholds and more hashes produce more candidate pairs.
+        jobs.append((job_name, run, (validation_set, validation_gt, param_tuple),
+                     (param_tuple[2], -param_tuple[0])))
 
-    for p in process_pool:
-        p.join()
+    run_jobs(jobs)
 
 
 if __name__ == '__main__':
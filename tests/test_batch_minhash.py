@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+The batch signatures must be bit-for-bit identical to the MinHash objects of
+build_hash_index.build_minhash.
+"""
+
+import random
+import numpy as np
+from batch_minhash import build_minhash_matrix, build_corpus_signatures, build_lyrics_hashes, get_jaccard
+from build_hash_index import build_shingle_list, build_minhash
+
+WORDS = ['amor', 'coração', 'noite', 'lua', 'você', 'saudade', 'mar', 'céu', 'dia', 'vida']
+
+
+def make_lyrics(num_songs, seed=0):
+    generator = random.Random(seed)
+    lyrics = [' '.join(generator.choice(WORDS) for _ in range(generator.randint(1, 60)))
+              for _ in range(num_songs)]
+    ## A lone surrogate cannot be encoded to UTF-8, its shingles are skipped.
+    lyrics.append('amor \ud800 noite lua mar céu dia')
+    return lyrics
+
+
+def test_build_minhash_matrix_matches_build_minhash():
+    for shingle_size in [1, 3, 5]:
+        shingle_lists = [build_shingle_list(lyrics, ngram_size=shingle_size) for lyrics in make_lyrics(50)]
+        signatures = build_minhash_matrix(shingle_lists, num_perm=64)
+        for shingle_list, signature in zip(shingle_lists, signatures):
+            np.testing.assert_array_equal(signature, build_minhash(shingle_list, num_perm=64).hashvalues)
+
+
+def test_build_corpus_signatures_matches_build_minhash():
+    dataset = dict(('key{}'.format(idx), lyrics) for idx, lyrics in enumerate(make_lyrics(40, seed=1)))
+    dataset['empty'] = ''
+    keys, signatures = build_corpus_signatures(dataset.items(), 3, num_perm=32, chunk_size=7)
+    assert keys == [key for key, lyrics in dataset.items() if lyrics]
+    for key, signature in zip(keys, signatures):
+        expected = build_minhash(build_shingle_list(dataset[key], ngram_size=3), num_perm=32).hashvalues
+        np.testing.assert_array_equal(signature, expected)
+
+
+def test_token_signatures_do_not_depend_on_chunking():
+    dataset = [('key{}'.format(idx), lyrics) for idx, lyrics in enumerate(make_lyrics(30, seed=2))]
+    keys, signatures = build_corpus_signatures(dataset, 3, num_perm=32, chunk_size=4, token_shingles=True)
+    one_keys, one_signatures = build_corpus_signatures(dataset, 3, num_perm=32, chunk_size=1000,
+                                                       token_shingles=True)
+    assert keys == one_keys
+    np.testing.assert_array_equal(signatures, one_signatures)
+
+
+def test_get_jaccard_matches_shingle_sets():
+    ## Without the lyric with a surrogate, whose shingles are not hashed.
+    lyrics = make_lyrics(20, seed=3)[:-1]
+    for lyrics_a, lyrics_b in zip(lyrics, lyrics[1:]):
+        shingles_a = set(build_shingle_list(lyrics_a, ngram_size=2))
+        shingles_b = set(build_shingle_list(lyrics_b, ngram_size=2))
+        expected = len(shingles_a & shingles_b) / float(len(shingles_a | shingles_b))
+        jaccard = get_jaccard(build_lyrics_hashes(lyrics_a, 2), build_lyrics_hashes(lyrics_b, 2))
+        assert abs(jaccard - expected) < 1e-12
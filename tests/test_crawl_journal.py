@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+A journal cut short by a crash must be truncated to its complete records and
+resumed, and compact_journal must write the songs of those records.
+"""
+
+import os
+import pickle
+from crawl_journal import CrawlJournal, iter_journal_records, compact_journal
+
+WEBSITE_NAME = 'letras.mus.br'
+
+
+def add_artists(journal, artist_names):
+    for artist_name in artist_names:
+        song_names = ['{} song {}'.format(artist_name, idx) for idx in range(3)]
+        journal.add_artist(WEBSITE_NAME, artist_name, ['lyrics of ' + name for name in song_names], song_names)
+
+
+def test_journal_resumes_after_incomplete_record(tmp_path):
+    journal_path = str(tmp_path / 'journal')
+    journal = CrawlJournal(journal_path)
+    add_artists(journal, ['abba', 'acdc'])
+    journal.close()
+    complete_size = os.path.getsize(journal_path)
+
+    ## A crash while the next record is being written.
+    record = pickle.dumps((WEBSITE_NAME, 'beatles', [('help', 'lyrics of help')]))
+    with open(journal_path, 'ab') as journal_out:
+        journal_out.write(record[:len(record) // 2])
+
+    journal = CrawlJournal(journal_path)
+    assert os.path.getsize(journal_path) == complete_size
+    assert len(journal) == 2
+    assert 'abba' in journal and 'acdc' in journal and 'beatles' not in journal
+    assert journal.num_songs == 6
+    add_artists(journal, ['beatles'])
+    journal.close()
+
+    assert [record[1] for _, record in iter_journal_records(journal_path)] == ['abba', 'acdc', 'beatles']
+    assert len(CrawlJournal(journal_path)) == 3
+
+
+def test_compact_journal_keeps_last_record_of_each_artist(tmp_path):
+    journal_path = str(tmp_path / 'journal')
+    output_path = str(tmp_path / 'lyrics_pickle_output')
+    journal = CrawlJournal(journal_path)
+    add_artists(journal, ['abba', 'acdc'])
+    journal.add_artist(WEBSITE_NAME, 'abba', ['new lyrics'], ['waterloo'])
+    journal.close()
+
+    assert compact_journal(journal_path, output_path) == 4
+    with open(output_path, 'rb') as output_in:
+        lyrics = pickle.load(output_in)
+    expected = [(WEBSITE_NAME, 'abba', 'waterloo', 'new lyrics')]
+    for idx in range(3):
+        song_name = 'acdc song {}'.format(idx)
+        expected.append((WEBSITE_NAME, 'acdc', song_name, 'lyrics of ' + song_name))
+    assert sorted(lyrics) == sorted(expected)
+
+
+def test_missing_journal_is_created(tmp_path):
+    journal_path = str(tmp_path / 'out' / 'journal')
+    journal = CrawlJournal(journal_path)
+    assert len(journal) == 0
+    journal.close()
+    assert os.path.exists(journal_path)
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+deletion_index.generate_matches must find the same matches as comparing
+every pair of keys with build_ground_truth_sets.generate_matches.
+"""
+
+import random
+import itertools
+import deletion_index
+import build_ground_truth_sets
+from deletion_index import deletion_variants, build_deletion_index, iter_candidate_pairs
+
+WEBSITES = ['vagalume.com.br', 'letras.mus.br', 'cifraclub.com.br']
+ARTISTS = ['abba', 'abb', 'aba', 'acdc', 'adcd', 'ac dc', 'bb', 'b']
+SONGS = ['amor', 'amo', 'amora', 'mar', 'amor traducao', 'amo traducao', 'lua', 'luar', 'l']
+
+
+def make_keys(seed):
+    generator = random.Random(seed)
+    keys = set()
+    while len(keys) < 150:
+        keys.add('|'.join([generator.choice(WEBSITES), generator.choice(ARTISTS), generator.choice(SONGS)]))
+    return sorted(keys)
+
+
+def test_candidate_pairs_contain_every_pair_within_distance_1():
+    strings = ['abc', 'ab', 'abd', 'bc', 'xyz', 'abcd', 'acb', 'a', '']
+    index = build_deletion_index((string, idx) for idx, string in enumerate(strings))
+    candidates = set(iter_candidate_pairs(index))
+    for (idx1, string1), (idx2, string2) in itertools.combinations(enumerate(strings), 2):
+        if deletion_variants(string1) & deletion_variants(string2):
+            assert (idx1, idx2) in candidates
+        else:
+            assert (idx1, idx2) not in candidates
+
+
+def test_generate_matches_matches_brute_force():
+    for seed in range(3):
+        keys = make_keys(seed)
+        assert deletion_index.generate_matches(keys) == build_ground_truth_sets.generate_matches(keys)
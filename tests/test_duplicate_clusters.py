@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+The union-find of duplicate_clusters must find the connected components of
+the graph of pairs, as a breadth-first search does.
+"""
+
+import numpy as np
+import duplicate_clusters
+from candidate_pairs import pack_pairs
+from duplicate_clusters import (make_parents, union_pairs, union_buckets, get_clusters, iter_clusters,
+                                cluster_packed_pairs)
+
+
+def get_components(num_ids, pairs):
+    """
+    Returns the cluster ids and representatives of the components of a graph,
+    numbered as get_clusters does, with a breadth-first search.
+    """
+    neighbors = [[] for _ in range(num_ids)]
+    for first_id, second_id in pairs:
+        neighbors[first_id].append(second_id)
+        neighbors[second_id].append(first_id)
+
+    roots = [-1] * num_ids
+    for root in range(num_ids):
+        if roots[root] >= 0:
+            continue
+        roots[root] = root
+        queue = [root]
+        while queue:
+            song_id = queue.pop()
+            for neighbor in neighbors[song_id]:
+                if roots[neighbor] < 0:
+                    roots[neighbor] = root
+                    queue.append(neighbor)
+    representatives = sorted(set(roots))
+    cluster_of_root = dict((root, cluster) for cluster, root in enumerate(representatives))
+    return np.array([cluster_of_root[root] for root in roots]), np.array(representatives)
+
+
+def make_pairs(num_ids, num_pairs, seed):
+    generator = np.random.RandomState(seed)
+    return generator.randint(0, num_ids, size=(num_pairs, 2))
+
+
+def test_union_pairs_matches_components(monkeypatch):
+    ## Small chunks, so the pairs are linked over several calls.
+    monkeypatch.setattr(duplicate_clusters, 'CHUNK_SIZE', 16)
+    for seed, num_pairs in enumerate([0, 50, 300, 2000]):
+        pairs = make_pairs(500, num_pairs, seed)
+        expected_ids, expected_representatives = get_components(500, pairs)
+
+        cluster_ids, representatives = cluster_packed_pairs(pack_pairs(pairs[:, 0], pairs[:, 1]), 500)
+        np.testing.assert_array_equal(cluster_ids, expected_ids)
+        np.testing.assert_array_equal(representatives, expected_representatives)
+
+
+def test_union_buckets_matches_components(monkeypatch):
+    monkeypatch.setattr(duplicate_clusters, 'CHUNK_SIZE', 16)
+    generator = np.random.RandomState(7)
+    buckets = [generator.choice(300, size=generator.randint(1, 6), replace=False) for _ in range(120)]
+    pairs = [(bucket[i], bucket[j]) for bucket in buckets
+             for i in range(len(bucket)) for j in range(i + 1, len(bucket))]
+
+    parents = make_parents(300)
+    union_buckets(parents, buckets)
+    cluster_ids, representatives = get_clusters(parents)
+    expected_ids, expected_representatives = get_components(300, pairs)
+    np.testing.assert_array_equal(cluster_ids, expected_ids)
+    np.testing.assert_array_equal(representatives, expected_representatives)
+
+
+def test_iter_clusters():
+    parents = make_parents(8)
+    union_pairs(parents, [5, 1, 6], [2, 5, 7])
+    cluster_ids, representatives = get_clusters(parents)
+    np.testing.assert_array_equal(representatives, [0, 1, 3, 4, 6])
+    assert [list(cluster) for cluster in iter_clusters(cluster_ids)] == [[1, 2, 5], [6, 7]]
+    assert len(list(iter_clusters(cluster_ids, min_size=1))) == 5
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+The buckets of lsh_forest.LSHForest must be the ones of a prefix tree split
+one row at a time, and its queries must return the buckets of the walk.
+"""
+
+import numpy as np
+import pytest
+from candidate_pairs import pack_bucket_pairs
+from lsh_forest import LSHForest, build_lsh_index, get_min_depth, ENGINE_FOREST
+
+NUM_PERM = 32
+
+
+def make_signatures(num_songs, num_values, seed=0):
+    ## Few distinct values, so the prefixes of many songs are shared.
+    generator = np.random.RandomState(seed)
+    return generator.randint(0, num_values, size=(num_songs, NUM_PERM)).astype(np.uint64)
+
+
+def get_tree_buckets(signatures, columns, members, depth, min_depth, max_bucket_size):
+    """
+    Reference buckets of a tree: the groups of songs sharing a prefix, split
+    by a longer prefix while they are too large.
+    """
+    groups = {}
+    for song in members:
+        groups.setdefault(tuple(signatures[song, columns[:depth]]), []).append(song)
+    buckets = []
+    for group in groups.values():
+        if len(group) <= max_bucket_size or depth == len(columns):
+            buckets.append(sorted(group))
+        else:
+            buckets.extend(get_tree_buckets(signatures, columns, group, depth + 1, min_depth, max_bucket_size))
+    return buckets
+
+
+@pytest.mark.parametrize('threshold, num_trees, max_bucket_size', [(0.01, 8, 2), (0.3, 4, 5), (0.8, 2, 3)])
+def test_buckets_match_prefix_tree(threshold, num_trees, max_bucket_size):
+    signatures = make_signatures(300, 3)
+    lsh = LSHForest(threshold, NUM_PERM, num_trees, max_bucket_size)
+    lsh.insert_signatures(np.arange(len(signatures)) + 1000, signatures)
+
+    expected_buckets = []
+    for tree in range(num_trees):
+        buckets = get_tree_buckets(signatures, lsh.get_tree_columns(tree), range(len(signatures)),
+                                   lsh.min_depth, lsh.min_depth, max_bucket_size)
+        assert sorted(lsh.get_bucket_sizes(tree)) == sorted(len(bucket) for bucket in buckets)
+        expected_buckets.extend(np.array(bucket) + 1000 for bucket in buckets if len(bucket) > 1)
+    np.testing.assert_array_equal(pack_bucket_pairs(lsh.iter_buckets()), pack_bucket_pairs(expected_buckets))
+
+
+def test_query_returns_buckets_of_walk():
+    signatures = make_signatures(200, 4, seed=1)
+    lsh = build_lsh_index(ENGINE_FOREST, 0.2, NUM_PERM, np.arange(len(signatures)), signatures,
+                          num_trees=8, max_bucket_size=4)
+    neighbors = [set([song]) for song in range(len(signatures))]
+    for bucket in lsh.iter_buckets():
+        for song in bucket:
+            neighbors[song].update(bucket.tolist())
+    for song in range(len(signatures)):
+        assert set(lsh.query(signatures[song]).tolist()) == neighbors[song]
+    assert len(lsh.query(np.full(NUM_PERM, 99, dtype=np.uint64))) == 0
+
+
+def test_min_depth():
+    assert get_min_depth(0.001, 16, 8) == 1
+    assert get_min_depth(0.999, 2, 16) == 16
+    for threshold in [0.3, 0.5, 0.7]:
+        min_depth = get_min_depth(threshold, 8, 16)
+        assert 1.0 - (1.0 - threshold ** min_depth) ** 8 >= 0.5
+        assert 1.0 - (1.0 - threshold ** (min_depth + 1)) ** 8 < 0.5
+
+
+def test_invalid_forests():
+    with pytest.raises(ValueError):
+        LSHForest(0.5, NUM_PERM, num_trees=NUM_PERM + 1)
+    with pytest.raises(ValueError):
+        LSHForest(0.5, NUM_PERM, max_bucket_size=1)
+    with pytest.raises(ValueError):
+        build_lsh_index('multiprobe', 0.5, NUM_PERM, [0], make_signatures(1, 2))
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+An index grown with insert_songs must have the same buckets, pairs and query
+results as an index saved from all the songs at once.
+"""
+
+import numpy as np
+import pytest
+import lsh_store
+from batch_minhash import build_corpus_signatures
+from candidate_pairs import pack_bucket_pairs
+from lsh_store import MappedLSHIndex, save_lsh_index, insert_songs, compact_lsh_index
+
+WORDS = ['amor', 'noite', 'lua', 'mar', 'dia', 'vida', 'sol', 'flor']
+THRESHOLD = 0.3
+NUM_PERM = 32
+
+
+def make_signatures(num_songs, seed=0):
+    generator = np.random.RandomState(seed)
+    ## Few distinct words, so many songs share buckets.
+    dataset = [('key{}'.format(idx), ' '.join(generator.choice(WORDS, size=generator.randint(3, 12))))
+               for idx in range(num_songs)]
+    _, signatures = build_corpus_signatures(dataset, 2, num_perm=NUM_PERM)
+    return np.arange(num_songs, dtype=np.int32), signatures
+
+
+def get_index_pairs(index_path):
+    return pack_bucket_pairs(MappedLSHIndex(index_path).iter_buckets())
+
+
+def test_inserts_match_full_index(tmp_path, monkeypatch):
+    ## Few segments, so the index is compacted during the inserts.
+    monkeypatch.setattr(lsh_store, 'MAX_SEGMENTS', 2)
+    song_ids, signatures = make_signatures(200)
+    full_path = str(tmp_path / 'full')
+    save_lsh_index(full_path, song_ids, signatures, THRESHOLD)
+    full_pairs = get_index_pairs(full_path)
+
+    index_path = str(tmp_path / 'inserted')
+    save_lsh_index(index_path, song_ids[:80], signatures[:80], THRESHOLD)
+    inserted_pairs = [get_index_pairs(index_path)]
+    for start in range(80, 200, 30):
+        new_pairs = insert_songs(index_path, song_ids[start:start + 30], signatures[start:start + 30])
+        assert np.all(np.isin(new_pairs >> np.uint64(32), song_ids[start:start + 30]) |
+                      np.isin(new_pairs & np.uint64(0xffffffff), song_ids[start:start + 30]))
+        inserted_pairs.append(new_pairs)
+        np.testing.assert_array_equal(np.unique(np.concatenate(inserted_pairs)), get_index_pairs(index_path))
+    np.testing.assert_array_equal(np.unique(np.concatenate(inserted_pairs)), full_pairs)
+    np.testing.assert_array_equal(get_index_pairs(index_path), full_pairs)
+
+    full_index, index = MappedLSHIndex(full_path), MappedLSHIndex(index_path)
+    for signature in signatures[::17]:
+        np.testing.assert_array_equal(np.sort(index.query(signature)), np.sort(full_index.query(signature)))
+    np.testing.assert_array_equal(index.get_song_signatures(song_ids[::7]),
+                                  full_index.get_song_signatures(song_ids[::7]))
+
+
+def test_compaction_keeps_pairs(tmp_path):
+    song_ids, signatures = make_signatures(120, seed=1)
+    index_path = str(tmp_path / 'index')
+    save_lsh_index(index_path, song_ids[:40], signatures[:40], THRESHOLD)
+    for start in range(40, 120, 20):
+        insert_songs(index_path, song_ids[start:start + 20], signatures[start:start + 20])
+    assert len(MappedLSHIndex(index_path).segments) == 5
+    pairs = get_index_pairs(index_path)
+
+    compact_lsh_index(index_path)
+    assert len(MappedLSHIndex(index_path).segments) == 1
+    np.testing.assert_array_equal(get_index_pairs(index_path), pairs)
+
+
+def test_repeated_songs_are_skipped(tmp_path):
+    song_ids, signatures = make_signatures(30, seed=2)
+    index_path = str(tmp_path / 'index')
+    save_lsh_index(index_path, song_ids[:20], signatures[:20], THRESHOLD)
+    assert len(insert_songs(index_path, song_ids[:20], signatures[:20])) == 0
+    assert len(MappedLSHIndex(index_path)) == 20
+    with pytest.raises(ValueError):
+        insert_songs(index_path, song_ids[20:], signatures[:5])
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+The selectors of lyrics_extraction must find the same links and lyrics as the
+BeautifulSoup predicates the crawlers used before them, on the saved pages of
+the fixtures directory.
+"""
+
+import os
+import pytest
+from lyrics_extraction import SITE_RULES, select, extract_links, extract_texts, compile_selector
+from benchmark_lyrics_extraction import (LEGACY_PREDICATES, load_fixtures, select_with_soup, get_soup_results,
+                                         get_selector_results)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures')
+## The legacy predicates of the cifraclub.com.br song links never matched,
+## see benchmark_lyrics_extraction.
+LEGACY_MISSES = [('cifraclub.com.br', 'songs')]
+
+
+@pytest.mark.parametrize('website, kind, rule, page', load_fixtures(FIXTURES_DIR),
+                         ids=lambda value: value if isinstance(value, str) else None)
+def test_selectors_match_legacy_predicates(website, kind, rule, page):
+    matches = select(page, SITE_RULES[website][rule])
+    assert matches
+    soup_results = get_soup_results(select_with_soup(page, LEGACY_PREDICATES[website][rule]), rule)
+    if (website, rule) in LEGACY_MISSES:
+        assert soup_results == []
+    else:
+        assert get_selector_results(matches, website, rule) == soup_results
+
+
+def test_block_elements_break_lines():
+    page = ('<div id="lyr"><p>first line<br>second  line</p><p>third &amp; last</p>'
+            '<div><div>nested</div></div> tail</div>')
+    assert extract_texts(page, ['div#lyr']) == ['first line\nsecond  line\nthird & last\nnested\n tail']
+
+
+def test_implicitly_closed_elements_and_attributes():
+    page = ("<ul class='list a'><li><a href=\"/x?a=1&amp;b=2\">X</a><li><a href=/y>Y</a>"
+            "<li><a>no link</a></ul><a href='/z'>Z</a>")
+    assert extract_links(page, ['ul.list > li > a']) == [('/x?a=1&b=2', 'X'), ('/y', 'Y')]
+    assert extract_links(page, ['a[href^="/z"]']) == [('/z', 'Z')]
+
+
+def test_first_selector_with_matches_is_used():
+    page = b'<meta charset="iso-8859-1"><div class="letra">cora\xe7\xe3o</div>'
+    assert extract_texts(page, ['div.letra-l', 'div.letra']) == ['coração']
+    assert select(page, ['div.letra-l']) == []
+
+
+def test_invalid_selectors():
+    with pytest.raises(ValueError):
+        compile_selector('div >')
+    with pytest.raises(ValueError):
+        compile_selector('div[href="x"]')
+    with pytest.raises(ValueError):
+        select('<div></div>', [])
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Staged verification of the candidate pairs of an LSH index.
+
+The candidate pairs of a bucket only share one band of their signatures. Each
+pair goes through three filters, from the cheapest to the most expensive, and
+only the pairs that pass all of them are kept:
+
+    1. Signature agreement -- the fraction of equal MinHash values, an
+       estimate of the Jaccard similarity of the shingle sets.
+    2. Exact Jaccard similarity of the sorted shingle hash arrays.
+    3. Edit distance of the lyrics, with find_duplicates.is_same_string_batch.
+
+The pairs are verified in chunks on a pool of worker processes.
+"""
+
+import sys
+import time
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import Pool
+from batch_minhash import build_lyrics_hashes, load_signature_file, get_jaccard
+from build_hash_index import get_signature_paths, TOKEN_SHINGLES
+from corpus_store import load_dataset, get_lyrics_by_id
+from candidate_pairs import CandidatePairWriter, iter_candidate_pairs, count_candidate_pairs
+from find_duplicates import is_same_string_batch, calc_precision_recall
+from job_scheduler import get_num_cpus
+from song_keys import load_key_dictionary, load_ground_truth
+
+SIGNATURE_THRESHOLD = 0.2
+JACCARD_THRESHOLD = 0.25
+## Fraction of the characters of the shortest lyric, see is_same_string.
+EDIT_CHAR_MARGIN = 0.3
+CHUNK_SIZE = 1 << 14
+## Shingle hash arrays kept by each worker, the least recently used ones are
+## dropped first.
+MAX_CACHED_HASHES = 1 << 14
+STAGE_NAMES = ['candidates', 'signature agreement', 'exact jaccard', 'edit distance']
+
+
+def usage():
+    print('./{} candidate_pairs_file dataset shingle_size [ground_truth]'.format(sys.argv[0]))
+
+
+def _init_worker(lyrics_by_id, rows_by_id, signatures, shingle_size, thresholds):
+    """
+    Keeps the dataset and its signatures in each worker, so tasks only carry
+    the pairs of song ids.
+    """
+    global WORKER_STATE
+    WORKER_STATE = {'lyrics_by_id': lyrics_by_id,
+                    'rows_by_id': rows_by_id,
+                    'signatures': signatures,
+                    'shingle_size': shingle_size,
+                    'thresholds': thresholds,
+                    'hashes': OrderedDict()}
+
+
+def get_shingle_hashes(song_id):
+    """
+    Returns the sorted shingle hashes of a song. The hashes of the last
+    MAX_CACHED_HASHES songs used by the worker are cached.
+    """
+    cache = WORKER_STATE['hashes']
+    hashes = cache.get(song_id)
+    if hashes is not None:
+        cache.move_to_end(song_id)
+        return hashes
+
+    hashes = build_lyrics_hashes(WORKER_STATE['lyrics_by_id'][song_id],
+                                 WORKER_STATE['shingle_size'], TOKEN_SHINGLES)
+    cache[song_id] = hashes
+    if len(cache) > MAX_CACHED_HASHES:
+        cache.popitem(last=False)
+    return hashes
+
+
+def verify_chunk(pairs):
+    """
+    Runs the three filters on a chunk of candidate pairs.
+
+    Arguments:
+    pairs -- An (n, 2) array of song ids.
+
+    Returns:
+    The (m, 2) array of the pairs that passed every filter, and a list with the
+    number of pairs left before the first filter and after each one.
+    """
+    signature_threshold, jaccard_threshold, char_margin = WORKER_STATE['thresholds']
+    counts = [len(pairs)]
+
+    ## 1. Signature agreement, for the whole chunk at once.
+    rows = WORKER_STATE['rows_by_id'][pairs]
+    signatures = WORKER_STATE['signatures']
+    agreement = np.count_nonzero(signatures[rows[:, 0]] == signatures[rows[:, 1]], axis=1)
+    ## Songs without a signature (rows of -1) never pass.
+    is_similar = (agreement >= signature_threshold * signatures.shape[1]) & (rows.min(axis=1) >= 0)
+    pairs = pairs[is_similar]
+    counts.append(len(pairs))
+
+    ## 2. Exact Jaccard similarity of the shingle sets.
+    is_similar = [get_jaccard(get_shingle_hashes(id_a), get_shingle_hashes(id_b)) >= jaccard_threshold
+                  for id_a, id_b in pairs.tolist()]
+    pairs = pairs[np.array(is_similar, dtype=bool)]
+    counts.append(len(pairs))
+
+    ## 3. Edit distance of the lyrics.
+    lyrics_by_id = WORKER_STATE['lyrics_by_id']
+    pairs = pairs[is_same_string_batch([lyrics_by_id[id_a] for id_a in pairs[:, 0].tolist()],
+                                       [lyrics_by_id[id_b] for id_b in pairs[:, 1].tolist()],
+                                       char_margin)]
+    counts.append(len(pairs))
+
+    return pairs, counts
+
+
+def verify_candidate_pairs(pairs_path, verified_path, dataset, shingle_size,
+                           signature_threshold=SIGNATURE_THRESHOLD,
+                           jaccard_threshold=JACCARD_THRESHOLD,
+                           char_margin=EDIT_CHAR_MARGIN,
+                           num_processes=None, chunk_size=CHUNK_SIZE):
+    """
+    Verifies the candidate pairs of an LSH index of the training dataset.
+
+    Arguments:
+    pairs_path -- The candidate pairs file, e.g. from
+    build_hash_index.dump_possible_duplicates.
+    verified_path -- The candidate pairs file where the pairs that pass every
+    filter are written.
+    dataset -- The dictionary or corpus_store.MappedCorpus mapping song keys to
+    lyrics the index was built from. The workers share the pages of a corpus.
+    shingle_size -- The shingle size of the index. The signatures are read from
+    the files written by build_hash_index.build_signatures.
+    signature_threshold -- The minimum fraction of equal signature values.
+    jaccard_threshold -- The minimum Jaccard similarity of the shingle sets.
+    char_margin -- The margin passed to is_same_string.
+    num_processes -- The number of worker processes. Default value is None,
+    meaning the number of cores.
+    chunk_size -- The number of pairs verified by each task.
+
+    Returns:
+    A list with the number of pairs left before the first filter and after
+    each one.
+    """
+    id_to_key, key_to_id = load_key_dictionary()
+    lyrics_by_id = get_lyrics_by_id(dataset, key_to_id, len(id_to_key))
+
+    signature_path, keys_path = get_signature_paths(shingle_size)
+    song_ids, signatures = load_signature_file(signature_path, keys_path)
+    rows_by_id = np.full(len(id_to_key), -1, dtype=np.int64)
+    rows_by_id[song_ids] = np.arange(len(song_ids))
+
+    if num_processes is None:
+        num_processes = get_num_cpus()
+    thresholds = (signature_threshold, jaccard_threshold, char_margin)
+
+    counts = [0] * len(STAGE_NAMES)
+    writer = CandidatePairWriter(verified_path, len(id_to_key))
+    start_time = time.time()
+    with Pool(processes=num_processes, initializer=_init_worker,
+              initargs=(lyrics_by_id, rows_by_id, signatures, shingle_size, thresholds)) as pool:
+        for verified_pairs, chunk_counts in pool.imap(verify_chunk,
+                                                      iter_candidate_pairs(pairs_path, chunk_size)):
+            writer.add_pairs(verified_pairs[:, 0], verified_pairs[:, 1])
+            counts = [total + count for total, count in zip(counts, chunk_counts)]
+    writer.close()
+
+    print('Verified {} candidate pairs in {:.1f}s.'.format(counts[0], time.time() - start_time))
+    for stage in range(1, len(STAGE_NAMES)):
+        print('{}: removed {} of {} pairs, {} left.'.format(STAGE_NAMES[stage],
+                                                           counts[stage - 1] - counts[stage],
+                                                           counts[stage - 1], counts[stage]))
+    return counts
+
+
+def main():
+    if len(sys.argv) < 4:
+        usage()
+        exit(1)
+
+    pairs_path = sys.argv[1]
+    shingle_size = int(sys.argv[3])
+    dataset = load_dataset(sys.argv[2])
+
+    verified_path = pairs_path + '.verified'
+    verify_candidate_pairs(pairs_path, verified_path, dataset, shingle_size)
+
+    if len(sys.argv) > 4 and count_candidate_pairs(verified_path) > 0:
+        _, key_to_id = load_key_dictionary()
+        ground_truth = load_ground_truth(sys.argv[4], key_to_id, mmap_mode='r')
+        for path in [pairs_path, verified_path]:
+            precision, recall = calc_precision_recall(path, ground_truth)
+            print('{} => P = {}; R = {}'.format(path, precision, recall))
+
+
+if __name__ == '__main__':
+    main()